@@ -0,0 +1,118 @@
+"""
+Benchmark NutritionService.get_daily_progress as the meals table grows.
+
+Seeds a throwaway SQLite database with an increasing number of historical
+meals (spread over many users and days, with a matching daily_tracking
+rollup) and reports the latency of the progress query at each size.
+
+Usage:
+    python benchmarks/bench_daily_progress.py [--sizes 10000,100000,1000000] [--runs 200]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from services.db_pool import SqliteConnectionPool  # noqa: E402
+from services.migrations import apply_migrations  # noqa: E402
+
+MEALS_PER_DAY = 4
+USERS = 1000
+
+
+def seed(db_path, total_meals):
+    # Same schema the app runs on, so the benchmark can't drift from the migrations
+    pool = SqliteConnectionPool(db_path)
+    apply_migrations(pool, use_sqlite=True)
+    pool.closeall()
+
+    conn = sqlite3.connect(db_path)
+
+    users = [f"whatsapp:+1555{i:07d}" for i in range(USERS)]
+    conn.executemany("INSERT INTO authorized_users (phone_number) VALUES (?)", [(u,) for u in users])
+
+    days = max(1, total_meals // (USERS * MEALS_PER_DAY))
+    today = date.today()
+    meals = []
+    rollups = []
+    for d in range(days):
+        day = (today - timedelta(days=d)).isoformat()
+        for user in users:
+            totals = [0, 0, 0, 0]
+            for _ in range(MEALS_PER_DAY):
+                macros = [random.randint(100, 900), random.randint(5, 60),
+                          random.randint(10, 120), random.randint(2, 40)]
+                totals = [a + b for a, b in zip(totals, macros)]
+                meals.append((user, day, f"{day} 12:00:00", '[]', *macros, ''))
+            rollups.append((user, day, *totals))
+        if len(meals) >= 100000:
+            _flush(conn, meals, rollups)
+    _flush(conn, meals, rollups)
+    conn.commit()
+    conn.close()
+    return users
+
+
+def _flush(conn, meals, rollups):
+    conn.executemany("""
+        INSERT INTO meals (phone_number, date, meal_time, food_items,
+                           calories, protein, carbs, fat, analysis_text)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, meals)
+    conn.executemany("""
+        INSERT INTO daily_tracking (phone_number, date, total_calories,
+                                    total_protein, total_carbs, total_fat)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rollups)
+    meals.clear()
+    rollups.clear()
+
+
+def bench(total_meals, runs):
+    workdir = tempfile.mkdtemp(prefix='bench-progress-')
+    os.chdir(workdir)
+    users = seed('nutrition.db', total_meals)
+
+    os.environ.pop('DATABASE_URL', None)
+    from services.nutrition_services import NutritionService
+    service = NutritionService()
+
+    timings = []
+    for _ in range(runs):
+        phone_number = random.choice(users)
+        start = time.perf_counter()
+        service.get_daily_progress(phone_number)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    service.pool.closeall()
+    timings.sort()
+    return {
+        'meals': total_meals,
+        'p50': statistics.median(timings),
+        'p95': timings[int(len(timings) * 0.95) - 1],
+        'max': timings[-1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'meals':>10} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        result = bench(size, args.runs)
+        print(f"{result['meals']:>10} {result['p50']:>10.3f} {result['p95']:>10.3f} {result['max']:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark image preprocessing before upload to the vision model.
+
+Generates a synthetic phone-sized photo, then compares the payload sent to
+the model with and without services.image_preprocessing.prepare_image:
+base64 bytes, preprocessing time, and the estimated end-to-end upload
+latency over a given uplink bandwidth. "heap MB" is peak Python heap use
+(tracemalloc), which does not include Pillow's own pixel buffers.
+
+Usage:
+    python benchmarks/bench_image_preprocessing.py [--width 4032 --height 3024] [--uplink-mbps 20]
+"""
+import argparse
+import base64
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from services.image_preprocessing import prepare_image  # noqa: E402
+
+
+def make_photo(width, height, quality):
+    """Noisy, detailed image that compresses roughly like a real food photo"""
+    img = Image.merge('RGB', [Image.effect_noise((width, height), 90) for _ in range(3)])
+    draw = ImageDraw.Draw(img)
+    for _ in range(200):
+        x, y = random.randrange(width), random.randrange(height)
+        r = random.randrange(20, width // 8)
+        draw.ellipse((x - r, y - r, x + r, y + r), outline=tuple(random.randrange(256) for _ in range(3)),
+                     width=random.randrange(2, 20))
+    img = img.filter(ImageFilter.SMOOTH)
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def measure(label, fn, runs):
+    timings = []
+    peak = 0
+    for _ in range(runs):
+        tracemalloc.start()
+        start = time.perf_counter()
+        payload = fn()
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    timings.sort()
+    return label, len(payload), timings[len(timings) // 2], peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=4032)
+    parser.add_argument('--height', type=int, default=3024)
+    parser.add_argument('--source-quality', type=int, default=92)
+    parser.add_argument('--max-edge', type=int, default=1024)
+    parser.add_argument('--quality', type=int, default=80)
+    parser.add_argument('--uplink-mbps', type=float, default=20.0)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    photo = make_photo(args.width, args.height, args.source_quality)
+    print(f"Source image: {args.width}x{args.height}, {len(photo) / 1e6:.2f} MB JPEG")
+
+    results = [
+        measure('original', lambda: base64.b64encode(photo).decode('ascii'), args.runs),
+        measure('preprocessed',
+                lambda: prepare_image(photo, max_edge=args.max_edge, quality=args.quality)[1],
+                args.runs),
+    ]
+
+    bytes_per_second = args.uplink_mbps * 1e6 / 8
+    print(f"{'mode':<14} {'upload MB':>10} {'prep ms':>9} {'heap MB':>9} {'upload ms':>10} {'total ms':>9}")
+    for label, size, prep, peak in results:
+        upload = size / bytes_per_second
+        print(f"{label:<14} {size / 1e6:>10.2f} {prep * 1000:>9.1f} {peak / 1e6:>9.1f} "
+              f"{upload * 1000:>10.1f} {(prep + upload) * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark and verify the nutrition parser against a corpus of model outputs.
+
+Every entry in fixtures/model_outputs.jsonl is parsed with
+services.nutrition_parser.parse_nutrition and checked against its expected
+result, then the corpus is parsed repeatedly to compare throughput with the
+previous multi-pass regex implementation.
+
+Usage:
+    python benchmarks/bench_nutrition_parser.py [--iterations 2000]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from services.nutrition_parser import parse_nutrition  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'model_outputs.jsonl')
+
+
+def legacy_parse(analysis_text):
+    """The pre-compiled-parser implementation, kept here as the baseline"""
+    nutrition = {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0, 'food_items': []}
+
+    food_items = []
+    capture_foods = False
+    for line in analysis_text.split('\n'):
+        line = line.strip()
+        if 'מנות:' in line:
+            capture_foods = True
+            continue
+        elif '### ערכים תזונתיים:' in line:
+            capture_foods = False
+        elif capture_foods and line.startswith('-'):
+            food_item = line.strip('- ').strip()
+            if food_item:
+                food_items.append(food_item)
+    nutrition['food_items'] = food_items
+
+    for key, word in (('calories', 'קלוריות'), ('protein', 'חלבון'), ('carbs', 'פחמימה'), ('fat', 'שומן')):
+        match = re.search(rf'\*\*{word}\*\*:?\s*(?:כ-)?(\d+)', analysis_text)
+        if not match:
+            match = re.search(rf'{word}:?\s*(?:כ-)?(\d+)', analysis_text)
+        if match:
+            nutrition[key] = int(match.group(1))
+
+    food_list = []
+    for line in analysis_text.split('\n'):
+        line = line.strip()
+        if line.startswith('-'):
+            if not any(word in line for word in ['קלוריות', 'חלבון', 'פחמימה', 'שומן']):
+                food = line.strip('- ').strip()
+                if food:
+                    food_list.append(food)
+    nutrition['food_items'] = food_list
+    return nutrition
+
+
+def load_corpus():
+    with open(CORPUS, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check(name, parser, corpus):
+    failures = 0
+    for i, case in enumerate(corpus):
+        result = parser(case['text'])
+        if result != case['expected']:
+            failures += 1
+            if name == 'compiled':
+                print(f"  case {i}: got {result}, expected {case['expected']}")
+    return failures
+
+
+def throughput(parser, texts, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            parser(text)
+    elapsed = time.perf_counter() - start
+    return iterations * len(texts) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    texts = [case['text'] for case in corpus]
+
+    print(f"{'parser':<10} {'correct':>9} {'parses/s':>12}")
+    failed = 0
+    for name, fn in (('legacy', legacy_parse), ('compiled', parse_nutrition)):
+        failures = check(name, fn, corpus)
+        rate = throughput(fn, texts, args.iterations)
+        print(f"{name:<10} {len(corpus) - failures:>4}/{len(corpus):<4} {rate:>12,.0f}")
+        if name == 'compiled':
+            failed = failures
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""
+Load-test /webhook with synthetic Twilio form posts.
+
+Starts local fakes for Twilio media and the OpenAI API (see harness.py),
+seeds a database with meal history, then fires a weighted mix of commands
+at the webhook from a pool of concurrent clients and reports throughput and
+p50/p95/p99 latency per command.
+
+By default the app runs in-process (Flask test client) against a throwaway
+SQLite database. Set DATABASE_URL to benchmark against Postgres instead
+(the database must be empty), or pass --url to drive an already running
+server; that server has to be started with the OPENAI_BASE_URL printed by
+--print-env so that it talks to the fakes.
+
+Usage:
+    python benchmarks/bench_webhook.py [--requests 2000] [--concurrency 16]
+        [--mix image=1,summary=4,goals=4,help=1,welcome=1,wizard=1]
+        [--openai-latency-ms 800] [--media-latency-ms 50]
+        [--users 200] [--days 90] [--repeat-images] [--url http://localhost:8000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import FakeOpenAI, FakeTwilioMedia, percentile, seed_database
+
+# Message bodies for each command in the mix; 'wizard' is the goal-setting flow
+COMMANDS = {
+    'summary': 'סיכום',
+    'goals': 'יעדים',
+    'week': 'שבוע',
+    'month': 'חודש',
+    'help': 'עזרה',
+    'welcome': 'היי',
+}
+WIZARD_STEPS = ['להגדיר יעדים', '2000', '150', '200', '60']
+ERROR_REPLY = 'משהו השתבש'
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in COMMANDS and name not in ('image', 'wizard'):
+            raise SystemExit(f"Unknown command in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class InProcessClient:
+    """Posts to the app through Flask's test client, one per thread"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.local = threading.local()
+
+    def post(self, form):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.flask_app.test_client()
+        response = client.post('/webhook', data=form)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HttpClient:
+    """Posts to a running server over keep-alive connections, one session per thread"""
+
+    def __init__(self, url):
+        import requests
+        self.requests = requests
+        self.url = url.rstrip('/') + '/webhook'
+        self.local = threading.local()
+
+    def post(self, form):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.post(self.url, data=form, timeout=120)
+        return response.status_code, response.text
+
+
+def run_task(client, media, phones, wizard_phone, command, task_id):
+    """Run one command (several messages for the wizard); returns [(command, seconds, ok)]"""
+    if command == 'wizard':
+        messages = [{'From': wizard_phone, 'Body': body} for body in WIZARD_STEPS]
+    elif command == 'image':
+        messages = [{'From': random.choice(phones), 'Body': '', 'NumMedia': '1',
+                     'MediaUrl0': media.media_url(task_id), 'MediaContentType0': 'image/jpeg'}]
+    else:
+        messages = [{'From': random.choice(phones), 'Body': COMMANDS[command]}]
+
+    results = []
+    for form in messages:
+        form['To'] = 'whatsapp:+14155238886'
+        start = time.perf_counter()
+        try:
+            status, body = client.post(form)
+            ok = status == 200 and ERROR_REPLY not in body
+        except Exception:
+            ok = False
+        results.append((command, time.perf_counter() - start, ok))
+    return results
+
+
+def report(results, elapsed):
+    by_command = defaultdict(list)
+    errors = defaultdict(int)
+    for command, seconds, ok in results:
+        by_command[command].append(seconds)
+        if not ok:
+            errors[command] += 1
+
+    print(f"\n{'command':<9} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for command in sorted(by_command):
+        timings = sorted(by_command[command])
+        print(f"{command:<9} {len(timings):>9} {errors[command]:>7} {len(timings) / elapsed:>8.1f} "
+              f"{percentile(timings, 50) * 1000:>9.1f} {percentile(timings, 95) * 1000:>9.1f} "
+              f"{percentile(timings, 99) * 1000:>9.1f}")
+    total = sorted(seconds for _, seconds, _ in results)
+    print(f"{'all':<9} {len(total):>9} {sum(errors.values()):>7} {len(total) / elapsed:>8.1f} "
+          f"{percentile(total, 50) * 1000:>9.1f} {percentile(total, 95) * 1000:>9.1f} "
+          f"{percentile(total, 99) * 1000:>9.1f}")
+    return sum(errors.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='Commands to send (a wizard run counts once)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', default='image=1,summary=4,goals=4,help=1,welcome=1,wizard=1')
+    parser.add_argument('--openai-latency-ms', type=float, default=800)
+    parser.add_argument('--media-latency-ms', type=float, default=50)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--days', type=int, default=90, help='Days of meal history per user')
+    parser.add_argument('--repeat-images', action='store_true',
+                        help='Serve the same photo for every image message (exercises the image cache)')
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process app')
+    parser.add_argument('--print-env', action='store_true',
+                        help='Start the fakes, print the env for an external server and wait')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    media = FakeTwilioMedia(latency_ms=args.media_latency_ms, unique=not args.repeat_images).start()
+    openai = FakeOpenAI(latency_ms=args.openai_latency_ms).start()
+
+    if args.print_env:
+        print(f"OPENAI_BASE_URL={openai.base_url}")
+        print("OPENAI_API_KEY=bench")
+        print(f"Media server: {media.url}/media/<id> (Ctrl-C to stop)")
+        while True:
+            time.sleep(3600)
+
+    if args.url:
+        client = HttpClient(args.url)
+        phones = [f"whatsapp:+1555{i:07d}" for i in range(args.users)]
+        print(f"Driving {args.url}; make sure it uses OPENAI_BASE_URL={openai.base_url}")
+    else:
+        # The app reads its settings at import time
+        os.environ['OPENAI_BASE_URL'] = openai.base_url
+        os.environ.setdefault('OPENAI_API_KEY', 'bench')
+        os.environ.setdefault('TWILIO_ACCOUNT_SID', 'bench')
+        os.environ.setdefault('TWILIO_AUTH_TOKEN', 'bench')
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.environ.setdefault('VISION_MAX_CONCURRENCY', str(args.concurrency))
+        if not os.environ.get('DATABASE_URL'):
+            os.chdir(tempfile.mkdtemp(prefix='bench-webhook-'))
+
+        import app as bot
+
+        print(f"Seeding {args.users} users x {args.days} days of meals...")
+        start = time.perf_counter()
+        phones = seed_database(bot.nutrition_service.pool, bot.nutrition_service.use_sqlite,
+                               args.users, args.days)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s")
+        client = InProcessClient(bot.app)
+
+    names = list(mix)
+    commands = random.choices(names, weights=[mix[n] for n in names], k=args.requests)
+    print(f"Sending {args.requests} commands with concurrency {args.concurrency} "
+          f"(OpenAI latency {args.openai_latency_ms:.0f} ms, media latency {args.media_latency_ms:.0f} ms)")
+
+    results = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(run_task, client, media, phones, f"whatsapp:+1666{i:07d}", command, i)
+            for i, command in enumerate(commands)
+        ]
+        for future in futures:
+            results.extend(future.result())
+    elapsed = time.perf_counter() - start
+
+    print(f"Done in {elapsed:.1f}s; fake OpenAI calls: {openai.requests}, media downloads: {media.requests}")
+    failed = report(results, elapsed)
+    media.stop()
+    openai.stop()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
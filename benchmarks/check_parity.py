@@ -0,0 +1,243 @@
+"""
+Backend parity check for the shared database layer.
+
+The same scripted workload runs through every query the services issue,
+once against a fresh SQLite file and once against a scratch schema in
+PostgreSQL (created and dropped by the check; nothing else in the database
+is touched), and the results are compared step by step. Without a
+PostgreSQL URL only the SQLite run happens. Exits non-zero on any
+difference or error.
+
+Usage:
+    python benchmarks/check_parity.py [--postgres-url postgresql://localhost/foodbot_test] [-v]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from services.analytics import analyze_export  # noqa: E402
+from services.db import Database  # noqa: E402
+from services.db_pool import PostgresConnectionPool, SqliteConnectionPool  # noqa: E402
+from services.export import export_history  # noqa: E402
+from services.importer import MealImporter  # noqa: E402
+from services.migrations import apply_migrations, check_query_plans  # noqa: E402
+from services.nutrition_services import NutritionService  # noqa: E402
+from services.state_store import DatabaseStateStore  # noqa: E402
+from services.user_services import UserService  # noqa: E402
+
+PHONE = 'whatsapp:+447700900001'
+UNKNOWN_PHONE = 'whatsapp:+14155550001'
+IMPORTED_PHONE = 'whatsapp:+972501110001'
+
+MEALS = [
+    {'calories': 520, 'protein': 45, 'carbs': 55, 'fat': 12, 'food_items': ['חזה עוף', 'אורז'],
+     'analysis_text': 'ארוחת צהריים'},
+    {'calories': 310, 'protein': 12, 'carbs': 40, 'fat': 9, 'food_items': []},
+    {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0},
+]
+
+
+def _normalize(value):
+    """Comparable, printable form of a step result"""
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, set):
+        return sorted(_normalize(v) for v in value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return None if np.isnan(value) else round(value, 6)
+    return value
+
+
+def run_workload(db):
+    """Run every service query once, in a fixed order. Returns [(step, result)]."""
+    apply_migrations(db.pool, db.use_sqlite)
+    users = UserService(db=db)
+    nutrition = NutritionService(db=db)
+    timezones = nutrition.timezones
+    state = DatabaseStateStore(db)
+    caches = [users.known_users, users.goals_cache, nutrition.report_cache, timezones.cache]
+    results = []
+
+    def step(name, fn):
+        # Every step goes to the database, never to a cache filled by an earlier one
+        for cache in caches:
+            cache.clear()
+        try:
+            value = fn()
+        except Exception as e:
+            value = {'error': f"{e.__class__.__name__}: {e}"}
+        results.append((name, _normalize(value)))
+
+    step('register_user', lambda: users.register_user(PHONE))
+    step('register_user_again', lambda: users.register_user(PHONE))
+    step('get_user_goals_missing', lambda: users.get_user_goals(PHONE))
+    step('set_user_goals_insert', lambda: users.set_user_goals(PHONE, 2000, 150, 200, 60))
+    step('set_user_goals_update', lambda: users.set_user_goals(PHONE, 1800, 140, 180, 55))
+    step('get_user_goals', lambda: users.get_user_goals(PHONE))
+
+    step('timezone_from_phone', lambda: timezones.get(PHONE).key)
+    step('timezone_set', lambda: timezones.set(PHONE, 'america/chicago'))
+    step('timezone_stored', lambda: timezones.get(PHONE).key)
+    step('timezone_set_unknown_user', lambda: timezones.set(UNKNOWN_PHONE, 'UTC'))
+
+    for i, meal in enumerate(MEALS):
+        step(f'log_meal_{i}', lambda meal=meal: nutrition.log_meal(PHONE, meal))
+    step('get_daily_progress', lambda: nutrition.get_daily_progress(PHONE))
+    step('get_daily_progress_no_meals', lambda: nutrition.get_daily_progress(UNKNOWN_PHONE))
+    step('get_range_summary', lambda: nutrition.get_range_summary(PHONE, 7))
+    today = timezones.today(PHONE)
+    step('rebuild_daily_tracking', lambda: nutrition.rebuild_daily_tracking(
+        (today - timedelta(days=7)).isoformat(), today.isoformat(), PHONE))
+    step('get_daily_progress_after_rebuild', lambda: nutrition.get_daily_progress(PHONE))
+
+    step('state_start', lambda: state.start(PHONE, {'step': 'calories'}))
+    step('state_get', lambda: state.get(PHONE))
+    step('state_transition', lambda: state.transition(PHONE, {'step': 'protein', 'calories': 2000, '_version': 1}))
+    step('state_transition_stale', lambda: state.transition(PHONE, {'step': 'carbs', '_version': 1}))
+    step('state_get_after_transition', lambda: state.get(PHONE))
+    step('state_delete', lambda: state.delete(PHONE))
+    step('state_get_deleted', lambda: state.get(PHONE))
+
+    imported_today = timezones.today(IMPORTED_PHONE)
+    rows = [
+        (line, {'phone_number': IMPORTED_PHONE, 'date': (imported_today - timedelta(days=line % 3 + 1)).isoformat(),
+                'calories': 100 * line, 'protein': line, 'carbs': 2 * line, 'fat': 3, 'food_items': 'a; b'})
+        for line in range(1, 8)
+    ] + [(8, {'phone_number': 'nope', 'date': imported_today.isoformat()})]
+
+    def import_meals():
+        result = MealImporter(db, batch_size=3).run(iter(rows))
+        return {key: result[key] for key in ('rows_read', 'imported', 'rejected', 'errors',
+                                             'users_registered', 'days_rebuilt', 'phones')}
+    step('import_meals', import_meals)
+    step('range_summary_imported', lambda: nutrition.get_range_summary(IMPORTED_PHONE, 7))
+
+    export_dir = tempfile.mkdtemp(prefix='parity-export-')
+    try:
+        step('export_history', lambda: {
+            table: info['rows'] for table, info in export_history(db, export_dir, chunk_size=2)['tables'].items()
+        })
+
+        def analyze():
+            report = analyze_export(export_dir)
+            return {
+                phone: {column: values[i] for column, values in report.items() if column != 'phone_number'}
+                for i, phone in enumerate(report['phone_number'])
+            }
+        step('analyze_export', analyze)
+    finally:
+        shutil.rmtree(export_dir, ignore_errors=True)
+
+    step('query_plans', lambda: [
+        (name, uses_index) for name, uses_index, _ in check_query_plans(db.pool, db.use_sqlite)
+    ])
+    return results
+
+
+@contextmanager
+def scratch_sqlite():
+    directory = tempfile.mkdtemp(prefix='parity-sqlite-')
+    pool = SqliteConnectionPool(os.path.join(directory, 'parity.db'))
+    try:
+        yield Database(pool, use_sqlite=True, description='SQLite (scratch file)')
+    finally:
+        pool.closeall()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+@contextmanager
+def scratch_postgres(url):
+    """A Database on a throwaway schema, dropped afterwards; nothing else in the database is touched"""
+    import psycopg2
+    from psycopg2.extensions import make_dsn
+
+    schema = f"parity_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(url)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE SCHEMA {schema}")
+    pool = PostgresConnectionPool(make_dsn(url, options=f"-c search_path={schema}"), max_size=2)
+    try:
+        yield Database(pool, use_sqlite=False, description=f'PostgreSQL (schema {schema})')
+    finally:
+        pool.closeall()
+        admin.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+
+@contextmanager
+def memory_caches():
+    """Build the services' caches in process memory, so nothing leaks between backends"""
+    previous = os.environ.get('CACHE_BACKEND')
+    os.environ['CACHE_BACKEND'] = 'memory'
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop('CACHE_BACKEND', None)
+        else:
+            os.environ['CACHE_BACKEND'] = previous
+
+
+def run_parity(postgres_url=None):
+    """
+    Run the workload on SQLite and, given a URL, on PostgreSQL.
+
+    Returns [(step, sqlite result, postgres result or None)].
+    """
+    with memory_caches():
+        with scratch_sqlite() as db:
+            sqlite_results = run_workload(db)
+        if not postgres_url:
+            return [(name, value, None) for name, value in sqlite_results]
+
+        with scratch_postgres(postgres_url) as db:
+            postgres_results = dict(run_workload(db))
+    return [(name, value, postgres_results.get(name)) for name, value in sqlite_results]
+
+
+def is_error(value):
+    return isinstance(value, dict) and set(value) == {'error'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--postgres-url', default=os.environ.get('PARITY_DATABASE_URL'),
+                        help='Database to create a scratch schema in (default: $PARITY_DATABASE_URL)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print every result')
+    args = parser.parse_args()
+
+    results = run_parity(args.postgres_url)
+    failed = 0
+    for name, sqlite_value, postgres_value in results:
+        if args.postgres_url:
+            ok = sqlite_value == postgres_value and not is_error(sqlite_value)
+        else:
+            ok = not is_error(sqlite_value)
+        failed += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+        if not ok or args.verbose:
+            print(f"    sqlite:   {sqlite_value}")
+            if args.postgres_url:
+                print(f"    postgres: {postgres_value}")
+    if not args.postgres_url:
+        print("PostgreSQL skipped: pass --postgres-url or set PARITY_DATABASE_URL to compare backends")
+    print(f"{len(results) - failed}/{len(results)} step(s) passed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
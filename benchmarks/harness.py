@@ -0,0 +1,233 @@
+"""
+Local stand-ins and database seeding shared by the benchmarks.
+
+FakeTwilioMedia serves JPEG photos the way Twilio's media URLs do, and
+FakeOpenAI answers /v1/chat/completions with a canned analysis (free-form
+text, or schema-shaped JSON when response_format asks for it). Both run in
+background threads and add a configurable latency per request, so the bot
+can be exercised end to end without network access or API keys.
+"""
+import io
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+ANALYSIS_TEXT = """מנות:
+- חזה עוף בגריל (150 גרם)
+- אורז לבן (כוס)
+- סלט ירקות
+
+### ערכים תזונתיים:
+- **קלוריות**: 520
+- **חלבון**: 45 גרם
+- **פחמימה**: 55 גרם
+- **שומן**: 12 גרם"""
+
+STRUCTURED_ANALYSIS = {
+    "items": [
+        {"name": "חזה עוף בגריל", "quantity": "150 גרם", "calories": 250, "protein": 40, "carbs": 0, "fat": 6},
+        {"name": "אורז לבן", "quantity": "כוס", "calories": 205, "protein": 4, "carbs": 45, "fat": 1},
+        {"name": "סלט ירקות", "quantity": "קערה קטנה", "calories": 65, "protein": 1, "carbs": 10, "fat": 5}
+    ]
+}
+
+
+def make_photo(width=1280, height=960, quality=85):
+    """A noisy JPEG roughly the size of a WhatsApp-compressed food photo"""
+    from PIL import Image, ImageFilter
+
+    img = Image.merge('RGB', [Image.effect_noise((width, height), 60) for _ in range(3)])
+    img = img.filter(ImageFilter.SMOOTH)
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+class _FakeServer:
+    """ThreadingHTTPServer running in a daemon thread on a free local port"""
+
+    handler_class = None
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(self.handler_class):
+            fake = server
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _hit(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class _MediaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.fake._hit()
+        body = self.fake.photo_for(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTwilioMedia(_FakeServer):
+    """
+    Serves /media/<id> as a JPEG. With unique=True every id gets distinct
+    bytes (trailing data after the JPEG end marker), so the image result
+    cache doesn't short-circuit the pipeline.
+    """
+
+    handler_class = _MediaHandler
+
+    def __init__(self, latency_ms=0.0, unique=True, photo=None):
+        super().__init__(latency_ms)
+        self.unique = unique
+        self.photo = photo or make_photo()
+
+    def photo_for(self, path):
+        if not self.unique:
+            return self.photo
+        return self.photo + path.encode('utf-8')
+
+    def media_url(self, media_id):
+        return f"{self.url}/media/{media_id}"
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        self.fake._hit()
+
+        if payload.get('response_format', {}).get('type') == 'json_schema':
+            content = json.dumps(STRUCTURED_ANALYSIS, ensure_ascii=False)
+        else:
+            content = ANALYSIS_TEXT
+
+        body = json.dumps({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get('model', 'gpt-4o'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 800, "completion_tokens": 120, "total_tokens": 920}
+        }, ensure_ascii=False).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOpenAI(_FakeServer):
+    """Chat completions endpoint; point the bot at it with OPENAI_BASE_URL=<url>/v1"""
+
+    handler_class = _OpenAIHandler
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+
+def seed_database(pool, use_sqlite, users, days, meals_per_day=4, batch_size=50000):
+    """
+    Fill a migrated database with `users` users, each with goals and
+    `days` days of meal history (plus the matching daily_tracking rows)
+    ending today. Returns the phone numbers.
+    """
+    p = '?' if use_sqlite else '%s'
+    phones = [f"whatsapp:+1555{i:07d}" for i in range(users)]
+    today = date.today()
+
+    conn = pool.getconn()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(f"INSERT INTO authorized_users (phone_number) VALUES ({p})", [(u,) for u in phones])
+        cursor.executemany(
+            f"INSERT INTO user_goals (phone_number, calories, protein, carbs, fat) VALUES ({p}, {p}, {p}, {p}, {p})",
+            [(u, 2000, 150, 200, 60) for u in phones]
+        )
+
+        meals = []
+        rollups = []
+        for d in range(days):
+            day = (today - timedelta(days=d)).isoformat()
+            for phone in phones:
+                totals = [0, 0, 0, 0]
+                for _ in range(meals_per_day):
+                    macros = [random.randint(100, 900), random.randint(5, 60),
+                              random.randint(10, 120), random.randint(2, 40)]
+                    totals = [a + b for a, b in zip(totals, macros)]
+                    meals.append((phone, day, f"{day} 12:00:00", '[]', *macros, ''))
+                rollups.append((phone, day, *totals))
+            if len(meals) >= batch_size:
+                _flush(cursor, p, meals, rollups)
+        _flush(cursor, p, meals, rollups)
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+    return phones
+
+
+def _flush(cursor, p, meals, rollups):
+    if meals:
+        cursor.executemany(f"""
+            INSERT INTO meals (phone_number, date, meal_time, food_items,
+                               calories, protein, carbs, fat, analysis_text)
+            VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p})
+        """, meals)
+    if rollups:
+        cursor.executemany(f"""
+            INSERT INTO daily_tracking (phone_number, date, total_calories,
+                                        total_protein, total_carbs, total_fat)
+            VALUES ({p}, {p}, {p}, {p}, {p}, {p})
+        """, rollups)
+    meals.clear()
+    rollups.clear()
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
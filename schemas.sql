@@ -1,13 +1,14 @@
 CREATE TABLE authorized_users (
   id SERIAL PRIMARY KEY,
-  phone_number TEXT UNIQUE NOT NULL
+  phone_number TEXT UNIQUE NOT NULL,
+  timezone TEXT
 );
 
 CREATE TABLE meals (
   id SERIAL PRIMARY KEY,
   phone_number TEXT NOT NULL,
-  date TEXT NOT NULL,
-  meal_time TEXT NOT NULL,
+  date DATE NOT NULL,
+  meal_time TIMESTAMP NOT NULL,
   food_items TEXT NOT NULL,
   calories INTEGER,
   protein INTEGER,
@@ -29,10 +30,30 @@ CREATE TABLE user_goals (
 CREATE TABLE daily_tracking (
   id SERIAL PRIMARY KEY,
   phone_number TEXT,
-  date TEXT,
+  date DATE,
   total_calories REAL,
   total_protein REAL,
   total_carbs REAL,
   total_fat REAL,
   FOREIGN KEY (phone_number) REFERENCES authorized_users(phone_number)
-);
\ No newline at end of file
+);
+
+CREATE INDEX idx_meals_phone_date ON meals (phone_number, date);
+
+CREATE UNIQUE INDEX idx_daily_tracking_phone_date ON daily_tracking (phone_number, date);
+
+CREATE TABLE conversation_state (
+  phone_number TEXT PRIMARY KEY,
+  state TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  expires_at DOUBLE PRECISION NOT NULL
+);
+
+CREATE INDEX idx_conversation_state_expiry ON conversation_state (expires_at);
+
+CREATE TABLE meal_imports (
+  checksum TEXT PRIMARY KEY,
+  source TEXT NOT NULL,
+  row_count INTEGER NOT NULL,
+  imported_at TEXT NOT NULL
+);
@@ -1,6 +1,7 @@
 CREATE TABLE IF NOT EXISTS authorized_users (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
-  phone_number TEXT UNIQUE NOT NULL
+  phone_number TEXT UNIQUE NOT NULL,
+  timezone TEXT
 );
 
 CREATE TABLE IF NOT EXISTS meals (
@@ -36,4 +37,24 @@ CREATE TABLE IF NOT EXISTS daily_tracking (
   total_carbs REAL,
   total_fat REAL,
   FOREIGN KEY (phone_number) REFERENCES authorized_users(phone_number)
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS idx_meals_phone_date ON meals (phone_number, date);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_tracking_phone_date ON daily_tracking (phone_number, date);
+
+CREATE TABLE IF NOT EXISTS conversation_state (
+  phone_number TEXT PRIMARY KEY,
+  state TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  expires_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversation_state_expiry ON conversation_state (expires_at);
+
+CREATE TABLE IF NOT EXISTS meal_imports (
+  checksum TEXT PRIMARY KEY,
+  source TEXT NOT NULL,
+  row_count INTEGER NOT NULL,
+  imported_at TEXT NOT NULL
+);
@@ -1,14 +1,28 @@
-from flask import Flask, request
+from flask import Flask, Response, g, request
 from twilio.twiml.messaging_response import MessagingResponse
 from services.vision_service import VisionService
 from services.nutrition_services import NutritionService
 from services.user_services import UserService
+from services.job_queue import AnalysisJobQueue
+from services.message_sender import create_message_sender
+from services.migrations import apply_migrations
+from services.state_store import create_state_store
+from services.command_router import CommandRouter
+from services.logging_config import configure_logging
+from services import metrics
+import logging
 import os
+import time
+from datetime import date
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Leveled JSON logs, written from a background thread (see LOG_* settings)
+configure_logging()
+logger = logging.getLogger('app')
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -17,8 +31,11 @@ vision_service = VisionService()
 nutrition_service = NutritionService()
 user_service = UserService()
 
-# Dictionary to store the goal setting state for each user
-goal_setting_state = {}
+# Bring the schema (tables, indexes, constraints) up to date before serving
+apply_migrations(nutrition_service.pool, nutrition_service.use_sqlite)
+
+# Goal setting wizard state, shared between workers (see CONVERSATION_STATE_BACKEND)
+conversation_state = create_state_store(nutrition_service.db)
 
 # Hebrew translations dictionary
 HEBREW_MESSAGES = {
@@ -34,13 +51,22 @@ HEBREW_MESSAGES = {
     'goals_set': 'היעדים התזונתיים היומיים שלך עודכנו בהצלחה! 🎉',
     'invalid_goals': 'פורמט היעדים אינו תקין. אנא נסה שוב לפי ההוראות.',
     'progress_bars': '📊 התקדמות יומית:\n',
+    'state_conflict': 'ההודעה הקודמת שלך עדיין בטיפול. אנא שלח את הערך שוב.',
+    'analysis_busy': 'יש כרגע עומס בניתוח תמונות. אנא שלח את התמונה שוב בעוד דקה. ⏳',
+    'service_unavailable': 'שירות ניתוח התמונות אינו זמין כרגע. אנא נסה שוב מאוחר יותר. 🙏',
+    'timezone_prompt': '🕒 אזור הזמן שלך: {zone} (השעה אצלך עכשיו {time}).\nכדי לשנות, שלח את שם אזור הזמן, לדוגמה: Europe/London\nכדי להשאיר אותו, שלח \'ביטול\'.',
+    'timezone_set': '✅ אזור הזמן עודכן ל-{zone}. הארוחות ייספרו לפי היום אצלך.',
+    'invalid_timezone': 'לא מצאתי את אזור הזמן הזה. נסה שם כמו Asia/Jerusalem או America/New_York, או שלח \'ביטול\':',
+    'timezone_unchanged': 'אזור הזמן לא שונה ({zone}).',
     'goal_reached': '🎉 כל הכבוד! הגעת ליעד היומי שלך עבור {nutrient}! 💪',
     'help_message': '''👋 איך אני יכול לעזור:
 
 📸 שלח תמונת מזון: אנתח אותה ואעקוב אחר הערכים התזונתיים
 📊 כתוב 'סיכום': לצפייה בסיכום התזונה היומי 
+📅 כתוב 'שבוע' או 'חודש': לסיכום 7 או 30 הימים האחרונים
 🎯 כתוב 'להגדיר יעדים': להגדרת היעדים התזונתיים היומיים שלך
 📈 כתוב 'יעדים': להצגת ההתקדמות שלך ביחס ליעדים
+🕒 כתוב 'אזור זמן': להצגה או שינוי של אזור הזמן שלך
 ❓ כתוב 'עזרה': להצגת הודעה זו שוב
 
 אשמח לעזור לך לעקוב אחר המסע התזונתי שלך! 🌟''',
@@ -49,6 +75,7 @@ HEBREW_MESSAGES = {
 אתה יכול:
 📸 לשלוח לי תמונה של האוכל שלך ואני אנתח אותה  
 📊 לכתוב 'סיכום' לקבלת סיכום יומי
+📅 לכתוב 'שבוע' או 'חודש' לסיכום תקופתי
 🎯 לכתוב 'להגדיר יעדים' כדי להגדיר יעדים תזונתיים יומיים
 📈 לכתוב 'יעדים' כדי לראות את ההתקדמות שלך
 
@@ -83,342 +110,499 @@ def calculate_remaining_calories(state):
     return remaining, total_used
 
 
-@app.route('/')
-def home():
-    return "Bot is running!"
+def get_media_urls(values):
+    """All image URLs attached to an incoming Twilio message (MediaUrl0..N)"""
+    try:
+        num_media = int(values.get('NumMedia') or 0)
+    except ValueError:
+        num_media = 0
+    urls = [values.get(f'MediaUrl{i}') for i in range(num_media)]
+    if not num_media and values.get('MediaUrl0'):
+        urls = [values.get('MediaUrl0')]
+    return [url for url in urls if url]
+
+
+class MealImageError(Exception):
+    """Raised when a meal image can't be analyzed or logged; the message is user-facing"""
+
+
+class TransientMealImageError(MealImageError):
+    """A MealImageError from a network or server hiccup; the job queue retries these"""
+
+
+def twilio_auth():
+    return (
+        os.getenv('TWILIO_ACCOUNT_SID'),
+        os.getenv('TWILIO_AUTH_TOKEN')
+    )
+
+
+def analyze_and_log_meal(phone_number, media_urls):
+    """Analyze the meal photos of one message together, log the meal and return the reply text"""
+    result = vision_service.analyze_food_images(media_urls, twilio_auth())
+    return log_analyzed_meal(phone_number, media_urls, result)
+
+
+def log_analyzed_meal(phone_number, media_urls, result):
+    """Log the meal from an analyze_food_images result and build the reply text"""
+    error_class = TransientMealImageError if isinstance(result, dict) and result.get('retryable') else MealImageError
+    if isinstance(result, dict) and result.get('unavailable'):
+        raise error_class(HEBREW_MESSAGES['service_unavailable'])
+
+    if not (isinstance(result, dict) and result.get('success')):
+        error_message = result.get('error', "התוצאה אינה תקינה.")
+        raise error_class(f"{HEBREW_MESSAGES['analysis_failed']}{error_message}")
+
+    analysis_data = result.get('analysis')
+    nutrition_data = result.get('nutrition', {})
+    if not analysis_data:
+        raise MealImageError(HEBREW_MESSAGES['analysis_failed'] + "התוצאה אינה תקינה.")
+
+    meal_data = {
+        'analysis_text': analysis_data,
+        'image_url': media_urls[0],
+        'calories': nutrition_data.get('calories', 0),
+        'protein': nutrition_data.get('protein', 0),
+        'carbs': nutrition_data.get('carbs', 0),
+        'fat': nutrition_data.get('fat', 0),
+        'food_items': nutrition_data.get('food_items', [])
+    }
+
+    if not nutrition_service.log_meal(phone_number, meal_data):
+        raise MealImageError("שגיאה ברישום הארוחה. אנא נסה שוב.")
+
+    msg = "🍳 ניתוח ארוחה\n"
+    msg += "──────────────\n\n"
+
+    # Add food items section
+    food_items = meal_data.get('food_items', [])
+    if food_items:
+        for item in food_items:
+            msg += f"• {item}\n"
+        msg += "\n"
+
+    # Add nutrition section with emojis and alignment
+    msg += "📊 ערכים תזונתיים:\n"
+    msg += f"🔥 קלוריות:  {meal_data['calories']} קק״ל\n"
+    msg += f"🥩 חלבון:    {meal_data['protein']} גרם\n"
+    msg += f"🌾 פחמימות: {meal_data['carbs']} גרם\n"
+    msg += f"🥑 שומן:     {meal_data['fat']} גרם\n"
+
+    msg += "\n──────────────\n"
+    msg += "✅ הארוחה נוספה בהצלחה!"
+    return msg
+
+
+def _run_analysis_job(job):
+    return analyze_and_log_meal(job['phone_number'], job['media_urls'])
+
+
+def _analysis_job_failed(job, error):
+    if isinstance(error, MealImageError):
+        return str(error)
+    return "מצטערים, משהו השתבש. אנא נסה שוב!"
+
+
+# Optional background pipeline for image analysis (ASYNC_IMAGE_ANALYSIS=1)
+analysis_queue = None
+if os.getenv('ASYNC_IMAGE_ANALYSIS', '').lower() in ('1', 'true', 'yes'):
+    analysis_queue = AnalysisJobQueue(
+        handler=_run_analysis_job,
+        sender=create_message_sender(),
+        on_failure=_analysis_job_failed,
+        workers=int(os.getenv('ANALYSIS_WORKERS', 4)),
+        max_pending=int(os.getenv('ANALYSIS_MAX_PENDING', 50)),
+        max_retries=int(os.getenv('ANALYSIS_MAX_RETRIES', 2)),
+        retry_on=(TransientMealImageError,)
+    )
+
+# Component stats exposed as gauges on /metrics
+metrics.register_stats('db_pool', nutrition_service.pool.stats)
+metrics.register_stats('db', nutrition_service.db.stats)
+metrics.register_stats('cache', user_service.registration_cache_stats, cache='known_users')
+metrics.register_stats('cache', user_service.goals_cache_stats, cache='goals')
+metrics.register_stats('cache', nutrition_service.report_cache.stats, cache='reports')
+metrics.register_stats('cache', nutrition_service.timezones.stats, cache='timezones')
+if vision_service.image_cache is not None:
+    metrics.register_stats('cache', vision_service.image_cache.stats, cache='image_results')
+metrics.register_stats('vision', vision_service.resilience_stats)
+metrics.register_stats('media', vision_service.downloader.stats)
+if analysis_queue is not None:
+    metrics.register_stats('analysis_queue', analysis_queue.stats)
+
+# Requests slower than this (ms) are logged with their spans; 0 disables
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+
+
+def _reset_goal_wizard(state, text):
+    """Recovery choice after the macros exceeded the calorie goal"""
+    if text == '1':
+        # Start over
+        for key in ('calories', 'protein', 'carbs', 'fat'):
+            state.pop(key, None)
+        state['step'] = 'calories'
+        return HEBREW_MESSAGES['set_calories']
+    if text == '2':
+        # Retry last step
+        if 'fat' in state:
+            state['step'] = 'fat'
+            return HEBREW_MESSAGES['set_fat']
+        if 'carbs' in state:
+            state['step'] = 'carbs'
+            return HEBREW_MESSAGES['set_carbs']
+        # Shouldn't get here, but just in case
+        state['step'] = 'calories'
+        return HEBREW_MESSAGES['set_calories']
+    return "אנא בחר 1 להתחיל מחדש או 2 להגדיר את השלב האחרון מחדש."
+
+
+def _macro_error(state):
+    remaining, used_cals = calculate_remaining_calories(state)
+    if remaining >= 0:
+        return None
+    state['step'] = 'error'
+    return HEBREW_MESSAGES['macro_error'].format(
+        used_cals=used_cals,
+        total_cals=state['calories'],
+        excess=abs(remaining)
+    )
+
+
+def _goal_step_calories(phone_number, state, value):
+    if value <= 0:
+        return "ערך הקלוריות חייב להיות חיובי. נסה שוב:"
+    state['calories'] = value
+    state['step'] = 'protein'
+    return HEBREW_MESSAGES['set_protein']
+
+
+def _goal_step_protein(phone_number, state, value):
+    if value < 0:
+        return "ערך החלבון לא יכול להיות שלילי. נסה שוב:"
+    state['protein'] = value
+    protein_calories = value * 4
+    if protein_calories > state['calories']:
+        return f"ערך החלבון שהזנת ({value}g) שווה ל-{protein_calories} קלוריות, יותר מסך הקלוריות שהגדרת ({state['calories']}). נסה שוב:"
+    state['step'] = 'carbs'
+    return HEBREW_MESSAGES['set_carbs']
+
+
+def _goal_step_carbs(phone_number, state, value):
+    if value < 0:
+        return "ערך הפחמימות לא יכול להיות שלילי. נסה שוב:"
+    state['carbs'] = value
+    error = _macro_error(state)
+    if error:
+        return error
+    state['step'] = 'fat'
+    return HEBREW_MESSAGES['set_fat']
+
+
+def _goal_step_fat(phone_number, state, value):
+    if value < 0:
+        return "ערך השומן לא יכול להיות שלילי. נסה שוב:"
+    state['fat'] = value
+    error = _macro_error(state)
+    if error:
+        return error
+
+    # Success - save goals to database; the wizard is finished either way
+    state['step'] = 'done'
+    success = user_service.set_user_goals(
+        phone_number,
+        state['calories'],
+        state['protein'],
+        state['carbs'],
+        state['fat']
+    )
+    if not success:
+        return "❌ חלה שגיאה בהגדרת היעדים. אנא נסה שוב."
+
+    protein_cals = state['protein'] * 4
+    carbs_cals = state['carbs'] * 4
+    fat_cals = state['fat'] * 9
+    return HEBREW_MESSAGES['goals_success'].format(
+        calories=state['calories'],
+        protein=state['protein'],
+        carbs=state['carbs'],
+        fat=state['fat'],
+        protein_cals=protein_cals,
+        carbs_cals=carbs_cals,
+        fat_cals=fat_cals,
+        actual_cals=protein_cals + carbs_cals + fat_cals
+    )
+
+
+# Goal wizard state machine: current step -> handler for the number the user sent
+GOAL_WIZARD_STEPS = {
+    'calories': _goal_step_calories,
+    'protein': _goal_step_protein,
+    'carbs': _goal_step_carbs,
+    'fat': _goal_step_fat,
+}
 
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    try:
-        incoming_msg = request.values.get('Body', '').lower()
-        media_url = request.values.get('MediaUrl0')
-        response = MessagingResponse()
-        phone_number = request.values.get('From')
+# Replies that leave the time zone prompt without changing anything
+CANCEL_WORDS = {'ביטול', 'בטל', 'cancel'}
 
-        # Register user if not already registered
-        user_service.register_user(phone_number)
 
-        msg = None
+def _set_timezone_step(phone_number, state, text):
+    if text in CANCEL_WORDS:
+        state['step'] = 'done'
+        return HEBREW_MESSAGES['timezone_unchanged'].format(zone=nutrition_service.timezones.get(phone_number).key)
+    zone = nutrition_service.timezones.set(phone_number, text)
+    if zone is None:
+        # Stay on this step and ask again
+        return HEBREW_MESSAGES['invalid_timezone']
+    state['step'] = 'done'
+    return HEBREW_MESSAGES['timezone_set'].format(zone=zone)
 
-        if media_url:
-            print(f"Received image URL: {media_url}")
-            twilio_auth = (
-                os.getenv('TWILIO_ACCOUNT_SID'),
-                os.getenv('TWILIO_AUTH_TOKEN')
-            )
-
-            result = vision_service.analyze_food_image(media_url, twilio_auth)
-
-            if isinstance(result, dict) and result.get('success'):
-                analysis_data = result.get('analysis')
-                nutrition_data = result.get('nutrition', {})
-
-                if analysis_data:
-                    meal_data = {
-                        'analysis_text': analysis_data,
-                        'image_url': media_url,
-                        'calories': nutrition_data.get('calories', 0),
-                        'protein': nutrition_data.get('protein', 0),
-                        'carbs': nutrition_data.get('carbs', 0),
-                        'fat': nutrition_data.get('fat', 0),
-                        'food_items': nutrition_data.get('food_items', [])
-                    }
-
-                    success = nutrition_service.log_meal(phone_number, meal_data)
-                    if success:
-                        msg = "🍳 ניתוח ארוחה\n"
-                        msg += "──────────────\n\n"
-
-                        # Add food items section
-                        food_items = meal_data.get('food_items', [])
-                        if food_items:
-                            for item in food_items:
-                                msg += f"• {item}\n"
-                            msg += "\n"
-
-                        # Add nutrition section with emojis and alignment
-                        msg += "📊 ערכים תזונתיים:\n"
-                        msg += f"🔥 קלוריות:  {meal_data['calories']} קק״ל\n"
-                        msg += f"🥩 חלבון:    {meal_data['protein']} גרם\n"
-                        msg += f"🌾 פחמימות: {meal_data['carbs']} גרם\n"
-                        msg += f"🥑 שומן:     {meal_data['fat']} גרם\n"
-
-                        msg += "\n──────────────\n"
-                        msg += "✅ הארוחה נוספה בהצלחה!"
-                    else:
-                        msg = "שגיאה ברישום הארוחה. אנא נסה שוב."
-                else:
-                    msg = HEBREW_MESSAGES['analysis_failed'] + "התוצאה אינה תקינה."
-            else:
-                error_message = result.get('error', "התוצאה אינה תקינה.")
-                msg = f"{HEBREW_MESSAGES['analysis_failed']}{error_message}"
 
+def handle_conversation(phone_number, text):
+    """Anything that isn't a command: goal wizard or time zone input, or the welcome message"""
+    state = conversation_state.get(phone_number)
+    if state is None:
+        return HEBREW_MESSAGES['welcome_message']
+
+    try:
+        if state['step'] == 'error':
+            msg = _reset_goal_wizard(state, text)
+        elif state['step'] == 'timezone':
+            msg = _set_timezone_step(phone_number, state, text)
+        elif text.isdigit() and state['step'] in GOAL_WIZARD_STEPS:
+            msg = GOAL_WIZARD_STEPS[state['step']](phone_number, state, int(text))
         else:
-            if incoming_msg == 'סיכום':
-                print("\n=== Debug: Processing סיכום command ===")
-                progress_data = nutrition_service.get_daily_progress(phone_number)
-                print(f"Progress data received: {progress_data}")
+            return HEBREW_MESSAGES['welcome_message']
+
+        if state['step'] == 'done':
+            conversation_state.delete(phone_number)
+        # Persist the step change; a concurrent message from the same
+        # user may have moved the wizard on in another worker
+        elif not conversation_state.transition(phone_number, state):
+            msg = HEBREW_MESSAGES['state_conflict']
+        return msg
+
+    except ValueError:
+        return "אנא הזן מספר בלבד."
+    except Exception as e:
+        logger.exception("Error in goal setting: %s", e)
+        conversation_state.delete(phone_number)
+        return "חלה שגיאה בהגדרת היעדים. אנא נסה שוב מהתחלה."
 
-                if progress_data and progress_data.get('totals'):
-                    totals = progress_data["totals"]
-                    print(f"Totals extracted: {totals}")
 
-                    # Enhanced summary format
-                    msg = "📊 סיכום יומי\n"
-                    msg += "──────────────\n"
+router = CommandRouter(fallback=handle_conversation)
 
-                    # Calories with emoji
-                    msg += f"🔥 קלוריות: {int(totals['calories'])} קק״ל\n"
 
-                    # Macronutrients with emojis and spacing
-                    msg += f"🥩 חלבון:    {int(totals['protein'])} גרם\n"
-                    msg += f"🌾 פחמימות: {int(totals['carbs'])} גרם\n"
-                    msg += f"🥑 שומן:     {int(totals['fat'])} גרם\n"
+@router.command('סיכום')
+def show_daily_summary(phone_number, text):
+    progress_data = nutrition_service.get_daily_progress(phone_number)
+    if not (progress_data and progress_data.get('totals')):
+        return "לא נרשמו ארוחות היום! שלח לי תמונה של האוכל שלך כדי להתחיל. 📸"
 
-                    # Add separator
-                    msg += "──────────────\n"
+    totals = progress_data["totals"]
 
-                    # Add encouraging message based on progress
-                    if totals['calories'] > 0:
-                        msg += "💪 המשך כך! זוכרים לצלם את כל הארוחות"
-                    else:
-                        msg += "📸 צלם את הארוחה הבאה שלך כדי לעקוב אחרי התזונה"
-                else:
-                    msg = "לא נרשמו ארוחות היום! שלח לי תמונה של האוכל שלך כדי להתחיל. 📸"
+    # Enhanced summary format
+    msg = "📊 סיכום יומי\n"
+    msg += "──────────────\n"
 
-                print(f"Final message: {msg}")
+    # Calories with emoji
+    msg += f"🔥 קלוריות: {int(totals['calories'])} קק״ל\n"
 
+    # Macronutrients with emojis and spacing
+    msg += f"🥩 חלבון:    {int(totals['protein'])} גרם\n"
+    msg += f"🌾 פחמימות: {int(totals['carbs'])} גרם\n"
+    msg += f"🥑 שומן:     {int(totals['fat'])} גרם\n"
 
-            elif incoming_msg == 'יעדים':
+    # Add separator
+    msg += "──────────────\n"
 
-                print("\n=== Debug: Processing יעדים command ===")
+    # Add encouraging message based on progress
+    if totals['calories'] > 0:
+        msg += "💪 המשך כך! זוכרים לצלם את כל הארוחות"
+    else:
+        msg += "📸 צלם את הארוחה הבאה שלך כדי לעקוב אחרי התזונה"
+    return msg
 
-                goals = user_service.get_user_goals(phone_number)
 
-                progress_data = nutrition_service.get_daily_progress(phone_number)
+# Hebrew day-of-week letters, indexed by date.weekday() (Monday first)
+HEBREW_WEEKDAYS = ['ב׳', 'ג׳', 'ד׳', 'ה׳', 'ו׳', 'ש׳', 'א׳']
 
-                print(f"Goals retrieved: {goals}")
 
-                print(f"Progress data retrieved: {progress_data}")
+def format_range_summary(phone_number, days, title, show_days):
+    summary = nutrition_service.get_range_summary(phone_number, days)
+    if summary is None:
+        return "מצטערים, משהו השתבש. אנא נסה שוב!"
+    if not summary['logged_days']:
+        return f"לא נרשמו ארוחות ב-{days} הימים האחרונים. שלח לי תמונה של האוכל שלך כדי להתחיל. 📸"
 
-                if goals and progress_data and progress_data.get('totals'):
+    start = date.fromisoformat(summary['start'])
+    end = date.fromisoformat(summary['end'])
+    averages = summary['averages']
 
-                    totals = progress_data['totals']
+    msg = f"📅 {title} ({start:%d/%m}–{end:%d/%m})\n"
+    msg += "──────────────\n"
+    msg += f"ימים עם רישום: {summary['logged_days']}/{days}\n\n"
 
-                    msg = HEBREW_MESSAGES['progress_bars']
+    msg += "ממוצע יומי:\n"
+    msg += f"🔥 קלוריות: {int(averages['calories'])} קק״ל\n"
+    msg += f"🥩 חלבון:    {int(averages['protein'])} גרם\n"
+    msg += f"🌾 פחמימות: {int(averages['carbs'])} גרם\n"
+    msg += f"🥑 שומן:     {int(averages['fat'])} גרם\n"
 
-                    print(f"Starting with totals: {totals}")
+    goals = user_service.get_user_goals(phone_number)
+    if goals and goals.get('calories'):
+        percentage = averages['calories'] / float(goals['calories']) * 100
+        msg += f"🎯 {percentage:.0f}% מיעד הקלוריות היומי\n"
 
-                    for nutrient in ['calories', 'protein', 'carbs', 'fat']:
+    if show_days:
+        msg += "\nלפי יום:\n"
+        for day in summary['daily']:
+            day_date = date.fromisoformat(day['date'])
+            msg += f"{HEBREW_WEEKDAYS[day_date.weekday()]} {day_date:%d/%m}: {int(day['calories'])} קק״ל\n"
 
-                        goal = float(goals.get(nutrient, 0))
+    msg += "──────────────\n"
+    msg += f"סה״כ: {int(summary['totals']['calories'])} קק״ל"
+    return msg
 
-                        actual = float(totals.get(nutrient, 0))
 
-                        print(f"\nDebug - {nutrient}:")
+@router.command('שבוע')
+def show_weekly_summary(phone_number, text):
+    return format_range_summary(phone_number, 7, 'סיכום שבועי', show_days=True)
 
-                        print(f"Actual: {actual}, Goal: {goal}")
 
-                        percentage = (actual / goal * 100) if goal > 0 else 0
+@router.command('חודש')
+def show_monthly_summary(phone_number, text):
+    return format_range_summary(phone_number, 30, 'סיכום חודשי', show_days=False)
 
-                        filled_bars = int(percentage // 10)
 
-                        print(f"Percentage: {percentage:.1f}%")
+# Progress bar line format per nutrient
+GOAL_PROGRESS_LINES = {
+    'calories': "🔥 קלוריות: {actual}/{goal}\n{bar}\n\n",
+    'protein': "🥩 חלבון: {actual}/{goal} גרם\n{bar}\n\n",
+    'carbs': "🌾 פחמימות: {actual}/{goal} גרם\n{bar}\n\n",
+    'fat': "🥑 שומן: {actual}/{goal} גרם\n{bar}\n",
+}
 
-                        print(f"Filled bars: {filled_bars}")
 
-                        bar = '█' * filled_bars + '░' * (10 - filled_bars)
+@router.command('יעדים')
+def show_goal_progress(phone_number, text):
+    goals = user_service.get_user_goals(phone_number)
+    if not goals:
+        return "לא נמצאו יעדים או נתוני מעקב. נסה להגדיר יעדים ולהזין ארוחות."
 
-                        if nutrient == 'calories':
+    progress_data = nutrition_service.get_daily_progress(phone_number)
+    if not (progress_data and progress_data.get('totals')):
+        return "לא נמצאו יעדים או נתוני מעקב. נסה להגדיר יעדים ולהזין ארוחות."
 
-                            msg += f"🔥 קלוריות: {int(actual)}/{int(goal)}\n{bar}\n\n"
+    totals = progress_data['totals']
+    msg = HEBREW_MESSAGES['progress_bars']
+    for nutrient, line in GOAL_PROGRESS_LINES.items():
+        goal = float(goals.get(nutrient, 0))
+        actual = float(totals.get(nutrient, 0))
+        percentage = (actual / goal * 100) if goal > 0 else 0
+        filled_bars = int(percentage // 10)
+        bar = '█' * filled_bars + '░' * (10 - filled_bars)
+        msg += line.format(actual=int(actual), goal=int(goal), bar=bar)
+    return msg
 
-                        elif nutrient == 'protein':
 
-                            msg += f"🥩 חלבון: {int(actual)}/{int(goal)} גרם\n{bar}\n\n"
+@router.command('להגדיר יעדים')
+def start_goal_wizard(phone_number, text):
+    # Start the goal setting process
+    conversation_state.start(phone_number, {'step': 'calories'})
+    return HEBREW_MESSAGES['set_calories']
 
-                        elif nutrient == 'carbs':
 
-                            msg += f"🌾 פחמימות: {int(actual)}/{int(goal)} גרם\n{bar}\n\n"
+@router.command('אזור זמן')
+def show_timezone(phone_number, text):
+    zone = nutrition_service.timezones.get(phone_number)
+    conversation_state.start(phone_number, {'step': 'timezone'})
+    return HEBREW_MESSAGES['timezone_prompt'].format(
+        zone=zone.key,
+        time=nutrition_service.timezones.now(phone_number).strftime('%H:%M')
+    )
 
-                        elif nutrient == 'fat':
 
-                            msg += f"🥑 שומן: {int(actual)}/{int(goal)} גרם\n{bar}\n"
+@router.command('עזרה')
+def show_help(phone_number, text):
+    return HEBREW_MESSAGES['help_message']
 
-                        print(f"Generated line: {msg.splitlines()[-2]}")
 
-                        print(f"Generated bar: {msg.splitlines()[-1]}")
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    metrics.start_trace()
 
-                else:
 
-                    msg = "לא נמצאו יעדים או נתוני מעקב. נסה להגדיר יעדים ולהזין ארוחות."
+@app.after_request
+def record_request_latency(response):
+    elapsed = time.perf_counter() - g.pop('request_start', time.perf_counter())
+    spans = metrics.end_trace()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(elapsed, route=route, status=response.status_code)
 
-                print(f"Final message: {msg}")
+    # X-Trace: 1 returns the per-step breakdown in a Server-Timing header
+    if request.headers.get('X-Trace'):
+        response.headers['Server-Timing'] = ', '.join(
+            [f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans] + [f"total;dur={elapsed * 1000:.1f}"]
+        )
+    if SLOW_REQUEST_MS and elapsed * 1000 > SLOW_REQUEST_MS:
+        logger.warning("Slow request %s took %.0f ms", route, elapsed * 1000,
+                       extra={'spans': {name: round(seconds * 1000, 1) for name, seconds in spans}})
+    return response
 
-            elif incoming_msg == 'להגדיר יעדים':
-                # Start the goal setting process
-                goal_setting_state[phone_number] = {'step': 'calories'}
-                msg = HEBREW_MESSAGES['set_calories']
 
-            elif phone_number in goal_setting_state and incoming_msg.isdigit():
-                try:
-                    value = int(incoming_msg)
-                    state = goal_setting_state[phone_number]
-
-                    if state['step'] == 'calories':
-                        if value <= 0:
-                            msg = "ערך הקלוריות חייב להיות חיובי. נסה שוב:"
-                        else:
-                            state['calories'] = value
-                            state['step'] = 'protein'
-                            msg = HEBREW_MESSAGES['set_protein']
-
-                    elif state['step'] == 'protein':
-                        if value < 0:
-                            msg = "ערך החלבון לא יכול להיות שלילי. נסה שוב:"
-                        else:
-                            state['protein'] = value
-                            protein_calories = value * 4
-                            if protein_calories > state['calories']:
-                                msg = f"ערך החלבון שהזנת ({value}g) שווה ל-{protein_calories} קלוריות, יותר מסך הקלוריות שהגדרת ({state['calories']}). נסה שוב:"
-                            else:
-                                state['step'] = 'carbs'
-                                msg = HEBREW_MESSAGES['set_carbs']
-
-                    elif state['step'] == 'carbs':
-                        if value < 0:
-                            msg = "ערך הפחמימות לא יכול להיות שלילי. נסה שוב:"
-                        else:
-                            state['carbs'] = value
-                            remaining, used_cals = calculate_remaining_calories(state)
-                            carbs_calories = value * 4
-
-                            if remaining < 0:
-                                total_cals = state['calories']
-                                excess = abs(remaining)
-                                msg = HEBREW_MESSAGES['macro_error'].format(
-                                    used_cals=used_cals,
-                                    total_cals=total_cals,
-                                    excess=excess
-                                )
-                                state['step'] = 'error'
-                            else:
-                                state['step'] = 'fat'
-                                msg = HEBREW_MESSAGES['set_fat']
-
-                    elif state['step'] == 'fat':
-                        if value < 0:
-                            msg = "ערך השומן לא יכול להיות שלילי. נסה שוב:"
-                        else:
-                            state['fat'] = value
-                            remaining, used_cals = calculate_remaining_calories(state)
-
-                            if remaining < 0:
-                                total_cals = state['calories']
-                                excess = abs(remaining)
-                                msg = HEBREW_MESSAGES['macro_error'].format(
-                                    used_cals=used_cals,
-                                    total_cals=total_cals,
-                                    excess=excess
-                                )
-                                state['step'] = 'error'
-                            else:
-                                # Success - save goals to database
-                                success = user_service.set_user_goals(
-                                    phone_number,
-                                    state['calories'],
-                                    state['protein'],
-                                    state['carbs'],
-                                    state['fat']
-                                )
-
-                                if success:
-                                    protein_cals = state['protein'] * 4
-                                    carbs_cals = state['carbs'] * 4
-                                    fat_cals = state['fat'] * 9
-                                    actual_cals = protein_cals + carbs_cals + fat_cals
-
-                                    msg = HEBREW_MESSAGES['goals_success'].format(
-                                        calories=state['calories'],
-                                        protein=state['protein'],
-                                        carbs=state['carbs'],
-                                        fat=state['fat'],
-                                        protein_cals=protein_cals,
-                                        carbs_cals=carbs_cals,
-                                        fat_cals=fat_cals,
-                                        actual_cals=actual_cals
-                                    )
-                                else:
-                                    msg = "❌ חלה שגיאה בהגדרת היעדים. אנא נסה שוב."
-
-                                # Clear the state now that we're done
-                                del goal_setting_state[phone_number]
-
-                    elif state['step'] == 'error':
-                        # Handle error recovery
-                        if incoming_msg == '1':
-                            # Start over
-                            goal_setting_state[phone_number] = {'step': 'calories'}
-                            msg = HEBREW_MESSAGES['set_calories']
-                        elif incoming_msg == '2':
-                            # Retry last step
-                            if 'fat' in state:
-                                state['step'] = 'fat'
-                                msg = HEBREW_MESSAGES['set_fat']
-                            elif 'carbs' in state:
-                                state['step'] = 'carbs'
-                                msg = HEBREW_MESSAGES['set_carbs']
-                            else:
-                                # Shouldn't get here, but just in case
-                                state['step'] = 'calories'
-                                msg = HEBREW_MESSAGES['set_calories']
-                        else:
-                            msg = "אנא בחר 1 להתחיל מחדש או 2 להגדיר את השלב האחרון מחדש."
-
-                except ValueError:
-                    msg = "אנא הזן מספר בלבד."
-                except Exception as e:
-                    print(f"Error in goal setting: {str(e)}")
-                    msg = "חלה שגיאה בהגדרת היעדים. אנא נסה שוב מהתחלה."
-                    if phone_number in goal_setting_state:
-                        del goal_setting_state[phone_number]
-
-            elif phone_number in goal_setting_state and goal_setting_state[phone_number]['step'] == 'error':
-                state = goal_setting_state[phone_number]
-                if incoming_msg == '1':
-                    # Start over
-                    goal_setting_state[phone_number] = {'step': 'calories'}
-                    msg = HEBREW_MESSAGES['set_calories']
-                elif incoming_msg == '2':
-                    # Retry last step
-                    if 'fat' in state:
-                        state['step'] = 'fat'
-                        msg = HEBREW_MESSAGES['set_fat']
-                    elif 'carbs' in state:
-                        state['step'] = 'carbs'
-                        msg = HEBREW_MESSAGES['set_carbs']
-                    else:
-                        # Shouldn't get here, but just in case
-                        state['step'] = 'calories'
-                        msg = HEBREW_MESSAGES['set_calories']
-                else:
-                    msg = "אנא בחר 1 להתחיל מחדש או 2 להגדיר את השלב האחרון מחדש."
-
-            elif incoming_msg == 'עזרה':
-                msg = HEBREW_MESSAGES['help_message']
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
+
+@app.route('/')
+def home():
+    return "Bot is running!"
+
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    try:
+        media_urls = get_media_urls(request.values)
+        response = MessagingResponse()
+        phone_number = request.values.get('From')
+
+        # Register user if not already registered
+        user_service.register_user(phone_number)
+
+        msg = None
+
+        if media_urls:
+            logger.info("Received %d image(s) from %s", len(media_urls), phone_number)
+
+            if analysis_queue is not None:
+                # Acknowledge right away; the worker replies through the REST API
+                queued = analysis_queue.submit({
+                    'phone_number': phone_number,
+                    'media_urls': media_urls,
+                    'reply_from': request.values.get('To')
+                })
+                if queued:
+                    return str(response)
+                msg = HEBREW_MESSAGES['analysis_busy']
             else:
-                msg = HEBREW_MESSAGES['welcome_message']
+                try:
+                    msg = analyze_and_log_meal(phone_number, media_urls)
+                except MealImageError as e:
+                    msg = str(e)
 
-        if msg is not None:
-            response.message(msg)
-        return str(response)
+        else:
+            msg = router.dispatch(phone_number, request.values.get('Body', ''))
+
+        with metrics.timed('twiml_render'):
+            if msg is not None:
+                response.message(msg)
+            return str(response)
 
     except Exception as e:
-        print(f"Error in webhook: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in webhook: %s", e)
         response = MessagingResponse()
         response.message("מצטערים, משהו השתבש. אנא נסה שוב!")
         return str(response)
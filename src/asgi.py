@@ -0,0 +1,183 @@
+"""
+ASGI entry point: the same bot, served from an event loop.
+
+    cd src && uvicorn asgi:app --workers 2
+
+Image analysis (media download and the GPT-4o call) is awaited, so a
+single process keeps many analyses in flight instead of one per sync
+gunicorn worker. Everything else reuses the Flask app's services and
+command router: database work runs in the loop's default thread pool,
+sized to the DB connection pool (ASGI_DB_THREADS), since psycopg2/sqlite3
+are blocking and the repo's SQL is written against their drivers. Image
+preprocessing gets its own pool (see AsyncVisionService).
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from twilio.twiml.messaging_response import MessagingResponse
+
+import app as bot
+from services import metrics
+from services.async_vision_service import AsyncVisionService
+from services.db_pool import pool_max_size
+
+logger = logging.getLogger('asgi')
+
+vision = AsyncVisionService(bot.vision_service)
+MAX_BODY_BYTES = 64 * 1024
+
+# Background analyses when ASYNC_IMAGE_ANALYSIS is on (kept referenced until done)
+_background = set()
+
+
+async def _startup():
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=int(os.getenv('ASGI_DB_THREADS', pool_max_size())),
+        thread_name_prefix='asgi-db'
+    ))
+    await vision.start()
+
+
+async def _shutdown():
+    if _background:
+        await asyncio.gather(*_background, return_exceptions=True)
+    await vision.close()
+
+
+async def analyze_and_log_meal(phone_number, media_urls):
+    """Async counterpart of app.analyze_and_log_meal"""
+    result = await vision.analyze_food_images(media_urls, bot.twilio_auth())
+    return await asyncio.to_thread(bot.log_analyzed_meal, phone_number, media_urls, result)
+
+
+async def _analyze_and_reply(phone_number, media_urls, reply_from):
+    """Background analysis; the reply goes out through the REST API like the job queue's"""
+    try:
+        msg = await analyze_and_log_meal(phone_number, media_urls)
+    except bot.MealImageError as e:
+        msg = str(e)
+    except Exception as e:
+        logger.exception("Error in background analysis: %s", e)
+        msg = "מצטערים, משהו השתבש. אנא נסה שוב!"
+    try:
+        await asyncio.to_thread(bot.analysis_queue.sender.send, phone_number, msg, from_=reply_from)
+    except Exception as e:
+        logger.exception("Error delivering analysis result: %s", e)
+
+
+async def webhook(form):
+    response = MessagingResponse()
+    phone_number = form.get('From')
+    media_urls = bot.get_media_urls(form)
+
+    # Register user if not already registered
+    await asyncio.to_thread(bot.user_service.register_user, phone_number)
+
+    if media_urls:
+        logger.info("Received %d image(s) from %s", len(media_urls), phone_number)
+        if bot.analysis_queue is not None:
+            # Acknowledge right away and reply when the analysis is done
+            if len(_background) >= bot.analysis_queue.max_pending:
+                msg = bot.HEBREW_MESSAGES['analysis_busy']
+            else:
+                task = asyncio.create_task(_analyze_and_reply(phone_number, media_urls, form.get('To')))
+                _background.add(task)
+                task.add_done_callback(_background.discard)
+                return str(response)
+        else:
+            try:
+                msg = await analyze_and_log_meal(phone_number, media_urls)
+            except bot.MealImageError as e:
+                msg = str(e)
+    else:
+        msg = await asyncio.to_thread(bot.router.dispatch, phone_number, form.get('Body', ''))
+
+    with metrics.timed('twiml_render'):
+        if msg is not None:
+            response.message(msg)
+        return str(response)
+
+
+async def _read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def _respond(send, status, body, content_type, headers=()):
+    body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            *headers
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _handle_http(scope, receive, send):
+    start = time.perf_counter()
+    metrics.start_trace()
+    method, path = scope['method'], scope['path']
+    route = path if path in ('/', '/webhook', '/metrics') else 'unmatched'
+    status = 200
+
+    if path == '/webhook' and method == 'POST':
+        try:
+            form = dict(parse_qsl((await _read_body(receive)).decode('utf-8'), keep_blank_values=True))
+            body = await webhook(form)
+        except Exception as e:
+            logger.exception("Error in webhook: %s", e)
+            response = MessagingResponse()
+            response.message("מצטערים, משהו השתבש. אנא נסה שוב!")
+            body = str(response)
+        content_type = 'text/html; charset=utf-8'
+    elif path == '/metrics' and method == 'GET':
+        body, content_type = metrics.render_prometheus(), 'text/plain; version=0.0.4; charset=utf-8'
+    elif path == '/' and method == 'GET':
+        body, content_type = "Bot is running!", 'text/html; charset=utf-8'
+    else:
+        status, body, content_type = 404, "Not Found", 'text/plain; charset=utf-8'
+
+    elapsed = time.perf_counter() - start
+    spans = metrics.end_trace()
+    metrics.REQUEST_SECONDS.observe(elapsed, route=route, status=status)
+
+    headers = []
+    request_headers = dict(scope.get('headers') or [])
+    if request_headers.get(b'x-trace'):
+        timing = ', '.join([f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans]
+                           + [f"total;dur={elapsed * 1000:.1f}"])
+        headers.append((b'server-timing', timing.encode('latin-1')))
+    if bot.SLOW_REQUEST_MS and elapsed * 1000 > bot.SLOW_REQUEST_MS:
+        logger.warning("Slow request %s took %.0f ms", route, elapsed * 1000,
+                       extra={'spans': {name: round(seconds * 1000, 1) for name, seconds in spans}})
+    await _respond(send, status, body, content_type, headers)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await _startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await _shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] == 'http':
+        await _handle_http(scope, receive, send)
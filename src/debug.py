@@ -1,6 +1,22 @@
 # Test functions to debug summary and goals separately
+import argparse
+import os
 import sqlite3
-from datetime import date
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from services.timezones import timezone_for_phone
+
+
+def user_today(cursor, phone_number):
+    """Today in the user's time zone, the day the bot files their meals under"""
+    try:
+        cursor.execute("SELECT timezone FROM authorized_users WHERE phone_number = ?", (phone_number,))
+        row = cursor.fetchone()
+    except sqlite3.OperationalError:  # database from before per-user time zones
+        row = None
+    zone = row[0] if row and row[0] else timezone_for_phone(phone_number)
+    return datetime.now(ZoneInfo(zone)).date().isoformat()
 
 
 def test_summary(db_path, phone_number):
@@ -8,7 +24,7 @@ def test_summary(db_path, phone_number):
     try:
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
-        today = date.today().isoformat()
+        today = user_today(cursor, phone_number)
 
         print("\n=== Testing Summary Command ===")
 
@@ -59,7 +75,7 @@ def test_goals(db_path, phone_number):
     try:
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
-        today = date.today().isoformat()
+        today = user_today(cursor, phone_number)
 
         print("\n=== Testing Goals Command ===")
 
@@ -105,8 +121,11 @@ def test_goals(db_path, phone_number):
 
 
 if __name__ == "__main__":
-    db_path = '/Users/tfg/food-tracker-bot/src/database/database/nutrition.db'
-    phone_number = 'whatsapp:+12403166242'  # Your test phone number
-
-    test_summary(db_path, phone_number)
-    test_goals(db_path, phone_number)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Print what the summary and goals commands see for a user')
+    parser.add_argument('phone_number', help="Sender as Twilio sends it, e.g. 'whatsapp:+972501234567'")
+    parser.add_argument('--db-path', default=os.environ.get('SQLITE_DB_PATH', 'nutrition.db'),
+                        help='SQLite database file (default: $SQLITE_DB_PATH or nutrition.db)')
+    args = parser.parse_args()
+
+    test_summary(args.db_path, args.phone_number)
+    test_goals(args.db_path, args.phone_number)
@@ -0,0 +1,209 @@
+"""
+Maintenance commands for the food tracker database.
+
+Run from the src directory, e.g.:
+    python manage.py migrate
+    python manage.py check-plans
+    python manage.py rebuild-rollups --start 2024-01-01 --end 2024-01-31
+    python manage.py export --out export/
+    python manage.py analyze --input export/ --csv report.csv
+    python manage.py import meals.csv
+    python manage.py set-timezone whatsapp:+972501234567 Europe/London
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from services.analytics import analyze_export, write_csv
+from services.cache import create_cache
+from services.db import get_database
+from services.export import export_history
+from services.importer import import_file
+from services.logging_config import configure_logging
+from services.migrations import apply_migrations, check_query_plans
+from services.nutrition_services import NutritionService
+from services.timezones import UserTimezones
+
+
+def _unshared_cache_warning():
+    """
+    Why cache invalidations from this process won't reach the running
+    workers, or None if they will (see create_cache).
+    """
+    if os.environ.get('CACHE_BACKEND', '').lower() == 'memory':
+        return "CACHE_BACKEND=memory, so cached reports in running workers were not invalidated; restart them"
+    path = os.environ.get('CACHE_PATH', 'cache.db')
+    if not os.path.exists(path):
+        return (f"no shared cache at {os.path.abspath(path)}; if workers are running, run this from their "
+                f"directory or set CACHE_PATH, or restart them so cached reports are dropped")
+    return None
+
+
+def _get_database():
+    db = get_database()
+    apply_migrations(db.pool, db.use_sqlite)
+    return db
+
+
+def cmd_migrate(args):
+    db = get_database()
+    applied = apply_migrations(db.pool, db.use_sqlite)
+    print(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
+    return 0
+
+
+def cmd_check_plans(args):
+    db = _get_database()
+    failed = 0
+    for name, uses_index, plan in check_query_plans(db.pool, db.use_sqlite):
+        print(f"{'OK  ' if uses_index else 'FAIL'} {name}")
+        if not uses_index or args.verbose:
+            print('    ' + plan.replace('\n', '\n    '))
+        failed += not uses_index
+    return 1 if failed else 0
+
+
+def cmd_rebuild_rollups(args):
+    warning = _unshared_cache_warning()
+    service = NutritionService()
+    rebuilt = service.rebuild_daily_tracking(args.start, args.end, args.phone)
+    if rebuilt is None:
+        return 1
+    print(f"Rebuilt {rebuilt} daily_tracking row(s) between {args.start} and {args.end}")
+    if warning:
+        print(f"Warning: {warning}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_export(args):
+    db = get_database()
+    try:
+        manifest = export_history(db, args.out, fmt=args.format, chunk_size=args.chunk_size,
+                                  start_date=args.start, end_date=args.end, compress=args.compress)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for table, info in manifest['tables'].items():
+        print(f"{table}: {info['rows']} row(s) -> {info['file']} ({info['seconds']}s)")
+    print(f"{manifest['users']} user(s) written to {args.out}")
+    return 0
+
+
+def cmd_analyze(args):
+    report = analyze_export(args.input, as_of=args.as_of)
+    if args.csv:
+        write_csv(report, args.csv)
+        print(f"Wrote {len(report['phone_number'])} user(s) to {args.csv}")
+        return 0
+
+    print(f"{'user':<24} {'days':>5} {'kcal avg':>9} {'kcal p50':>9} {'kcal goal':>10} "
+          f"{'protein goal':>13} {'streak':>7} {'longest':>8}")
+    for i, phone in enumerate(report['phone_number']):
+        print(f"{phone:<24} {report['logged_days'][i]:>5} {report['calories_mean'][i]:>9.0f} "
+              f"{report['calories_p50'][i]:>9.0f} {report['calorie_goal_rate'][i]:>10.0%} "
+              f"{report['protein_goal_rate'][i]:>13.0%} {report['current_streak'][i]:>7} "
+              f"{report['longest_streak'][i]:>8}")
+    return 0
+
+
+def cmd_import(args):
+    db = _get_database()
+    try:
+        result = import_file(db, args.path, fmt=args.format, batch_size=args.batch_size,
+                             max_errors=args.max_errors, dry_run=args.dry_run)
+    except (OSError, ValueError) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        return 1
+
+    for line, error in result['errors'][:20]:
+        print(f"line {line}: {error}")
+    if len(result['errors']) > 20:
+        print(f"... and {len(result['errors']) - 20} more invalid row(s)")
+
+    # Checked before create_cache, which would create the file
+    warning = _unshared_cache_warning() if result['committed'] else None
+    if result['committed']:
+        report_cache = create_cache('reports', shared=True)
+        for phone in result['phones']:
+            report_cache.delete(phone)
+
+    print(f"{'Would import' if args.dry_run else 'Imported'} {result['imported']} of {result['rows_read']} row(s) "
+          f"({result['rejected']} rejected), {result['users_registered']} new user(s), "
+          f"{result['days_rebuilt']} day(s) rebuilt")
+    print(f"{result['seconds']:.1f}s, {result['rows_per_second']:.0f} rows/s")
+    if warning:
+        print(f"Warning: {warning}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_set_timezone(args):
+    zone = UserTimezones(_get_database()).set(args.phone, args.timezone)
+    if zone is None:
+        print(f"Unknown user {args.phone} or time zone {args.timezone}", file=sys.stderr)
+        return 1
+    print(f"Time zone for {args.phone} set to {zone}")
+    return 0
+
+
+def main(argv=None):
+    load_dotenv()
+    configure_logging()
+    parser = argparse.ArgumentParser(description='Food tracker maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('migrate', help='Apply pending schema migrations')
+
+    plans = subparsers.add_parser('check-plans', help='Verify hot queries use their indexes')
+    plans.add_argument('-v', '--verbose', action='store_true', help='Print every query plan')
+
+    rollups = subparsers.add_parser('rebuild-rollups', help='Recompute daily_tracking from meals')
+    rollups.add_argument('--start', required=True, help='First date to rebuild (YYYY-MM-DD)')
+    rollups.add_argument('--end', required=True, help='Last date to rebuild (YYYY-MM-DD)')
+    rollups.add_argument('--phone', help='Only rebuild this phone number')
+
+    export = subparsers.add_parser('export', help='Export meal history to columnar files')
+    export.add_argument('--out', required=True, help='Output directory')
+    export.add_argument('--format', choices=['npz', 'parquet'], default='npz',
+                        help='NumPy .npz (default) or Parquet (needs pyarrow)')
+    export.add_argument('--chunk-size', type=int, default=50000, help='Rows fetched per round trip')
+    export.add_argument('--compress', action='store_true', help='Smaller files, slower export')
+    export.add_argument('--start', help='Only export meals from this date (YYYY-MM-DD)')
+    export.add_argument('--end', help='Only export meals up to this date (YYYY-MM-DD)')
+
+    analyze = subparsers.add_parser('analyze', help='Per-user macro, goal and streak report from an export')
+    analyze.add_argument('--input', required=True, help='Directory written by the export command')
+    analyze.add_argument('--as-of', help='Day current streaks are measured to (default: latest day exported)')
+    analyze.add_argument('--csv', help='Write the full report to this CSV file instead of printing')
+
+    importer = subparsers.add_parser('import',
+                                     help='Bulk import meals from a CSV or JSONL file; the same file is refused twice')
+    importer.add_argument('path', help='CSV with a header row, or JSONL with one meal per line')
+    importer.add_argument('--format', choices=['csv', 'jsonl'], help='Default: from the file extension')
+    importer.add_argument('--batch-size', type=int, default=5000, help='Rows per insert batch')
+    importer.add_argument('--max-errors', type=int, default=100,
+                          help='Abort and roll back after this many invalid rows')
+    importer.add_argument('--dry-run', action='store_true', help='Validate and load, then roll back')
+
+    timezone = subparsers.add_parser('set-timezone', help="Override a user's time zone")
+    timezone.add_argument('phone', help="Sender as Twilio sends it, e.g. 'whatsapp:+972501234567'")
+    timezone.add_argument('timezone', help='IANA time zone name, e.g. Europe/London')
+
+    args = parser.parse_args(argv)
+    handlers = {
+        'migrate': cmd_migrate,
+        'check-plans': cmd_check_plans,
+        'rebuild-rollups': cmd_rebuild_rollups,
+        'export': cmd_export,
+        'analyze': cmd_analyze,
+        'import': cmd_import,
+        'set-timezone': cmd_set_timezone,
+    }
+    return handlers[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import csv
+import logging
+
+import numpy as np
+
+from services.export import MACROS, load_table, load_users
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (10, 50, 90)
+CALORIE_TOLERANCE = 0.10  # a day "hits" the calorie goal within +/-10%
+
+
+def _group_bounds(sorted_ids, n_groups):
+    """Start offsets and sizes of each id's run in an array sorted by id"""
+    counts = np.bincount(sorted_ids, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return starts, counts
+
+
+def macro_distributions(user_ids, values, n_users):
+    """
+    Per-user mean, std and percentiles of one macro's daily totals.
+
+    One sort by (user, value) puts every user's values in order, so each
+    percentile is a single fancy-index into the sorted array.
+    """
+    order = np.lexsort((values, user_ids))
+    users, values = user_ids[order], values[order].astype(np.float64)
+    starts, counts = _group_bounds(users, n_users)
+
+    sums = np.bincount(users, weights=values, minlength=n_users)
+    squares = np.bincount(users, weights=values * values, minlength=n_users)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+        std = np.sqrt(np.maximum(squares / counts - mean * mean, 0))
+
+    result = {'days': counts, 'mean': mean, 'std': std}
+    has_data = counts > 0
+    for q in PERCENTILES:
+        column = np.full(n_users, np.nan)
+        index = starts + np.round((counts - 1) * q / 100).astype(np.int64)
+        column[has_data] = values[index[has_data]]
+        result[f'p{q}'] = column
+    return result
+
+
+def goal_adherence(user_ids, calories, protein, goals, n_users):
+    """Share of each user's logged days that hit the calorie goal (+/-10%) and the protein goal"""
+    calorie_goal = np.full(n_users, np.nan)
+    protein_goal = np.full(n_users, np.nan)
+    calorie_goal[goals['user_id']] = goals['calories']
+    protein_goal[goals['user_id']] = goals['protein']
+
+    day_calorie_goal = calorie_goal[user_ids]
+    day_protein_goal = protein_goal[user_ids]
+    calories_hit = np.abs(calories - day_calorie_goal) <= CALORIE_TOLERANCE * day_calorie_goal
+    protein_hit = protein >= day_protein_goal
+
+    days = np.bincount(user_ids, minlength=n_users)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'calories': np.bincount(user_ids, weights=calories_hit, minlength=n_users) / days,
+            'protein': np.bincount(user_ids, weights=protein_hit, minlength=n_users) / days,
+            'both': np.bincount(user_ids, weights=calories_hit & protein_hit, minlength=n_users) / days,
+            'has_goals': ~np.isnan(calorie_goal),
+        }
+
+
+def streaks(user_ids, dates, n_users, as_of=None):
+    """
+    Longest and current run of consecutive logged days per user.
+
+    A run breaks wherever the user changes or the gap to the previous day
+    isn't exactly one day. The current streak counts only if its last day
+    is `as_of` (default: the latest day in the data) or the day before.
+    """
+    longest = np.zeros(n_users, dtype=np.int64)
+    current = np.zeros(n_users, dtype=np.int64)
+    if len(user_ids) == 0:
+        return {'longest': longest, 'current': current}
+
+    order = np.lexsort((dates, user_ids))
+    users, days = user_ids[order], dates[order].astype('datetime64[D]').astype(np.int64)
+    if as_of is None:
+        as_of = days.max()
+    else:
+        as_of = np.datetime64(as_of, 'D').astype(np.int64)
+
+    breaks = np.ones(len(users), dtype=bool)
+    breaks[1:] = (users[1:] != users[:-1]) | (days[1:] - days[:-1] != 1)
+    run_ids = np.cumsum(breaks) - 1
+    run_lengths = np.bincount(run_ids)
+    run_users = users[breaks]
+    np.maximum.at(longest, run_users, run_lengths)
+
+    # The last run of each user is the one that may still be going
+    last_run = np.ones(len(run_users), dtype=bool)
+    last_run[:-1] = run_users[1:] != run_users[:-1]
+    run_ends = days[np.concatenate((np.flatnonzero(breaks)[1:], [len(days)])) - 1]
+    active = last_run & (run_ends >= as_of - 1)
+    current[run_users[active]] = run_lengths[active]
+    return {'longest': longest, 'current': current}
+
+
+def analyze_export(data_dir, as_of=None):
+    """
+    Per-user report over an export written by services.export: daily macro
+    distributions, goal adherence and logging streaks. Returns a dict of
+    equal-length column arrays, one row per user.
+    """
+    phones = load_users(data_dir)
+    n_users = len(phones)
+    daily = load_table(data_dir, 'daily_tracking')
+    goals = load_table(data_dir, 'user_goals')
+    user_ids = daily['user_id'].astype(np.int64)
+
+    report = {'phone_number': phones}
+    for macro in MACROS:
+        for stat, column in macro_distributions(user_ids, daily[f'total_{macro}'], n_users).items():
+            if stat == 'days':
+                report['logged_days'] = column
+            else:
+                report[f'{macro}_{stat}'] = column
+
+    adherence = goal_adherence(user_ids, daily['total_calories'], daily['total_protein'], goals, n_users)
+    report['calorie_goal_rate'] = adherence['calories']
+    report['protein_goal_rate'] = adherence['protein']
+    report['both_goals_rate'] = adherence['both']
+
+    streak = streaks(user_ids, daily['date'], n_users, as_of)
+    report['longest_streak'] = streak['longest']
+    report['current_streak'] = streak['current']
+    logger.info("Analyzed %d daily rows for %d users", len(user_ids), n_users)
+    return report
+
+
+def write_csv(report, path):
+    columns = list(report)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in zip(*(report[c] for c in columns)):
+            writer.writerow([round(float(v), 3) if isinstance(v, np.floating) else v for v in row])
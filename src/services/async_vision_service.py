@@ -0,0 +1,198 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from openai import AsyncOpenAI
+
+from services.http_client import RETRY_STATUSES, MediaDownloadError
+from services.metrics import timed
+from services.resilience import UpstreamUnavailableError
+from services.vision_service import UPSTREAM_ERRORS, is_transient
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncVisionService:
+    """
+    Event-loop counterpart of VisionService for the ASGI entry point.
+
+    Media downloads (aiohttp) and model calls (AsyncOpenAI) are awaited
+    instead of holding a thread, so one process can keep many analyses in
+    flight. Prompts, preprocessing, parsing, the image result cache and the
+    circuit breaker / rate limiter are shared with the wrapped VisionService.
+    CPU-bound preprocessing and image-cache I/O run on a dedicated thread
+    pool (ASGI_IMAGE_THREADS), so a burst of photos can't take the threads
+    the loop's default executor keeps for database work.
+    """
+
+    def __init__(self, vision_service):
+        self.vision = vision_service
+        self.client = AsyncOpenAI(
+            api_key=vision_service.openai_api_key,
+            timeout=float(os.getenv('VISION_TIMEOUT', 45)),
+            max_retries=int(os.getenv('VISION_CLIENT_RETRIES', 0))
+        )
+        self.max_in_flight = int(os.getenv('ASGI_VISION_CONCURRENCY', 200))
+        self.media_max_bytes = vision_service.downloader.max_bytes
+        self.media_retries = int(os.getenv('MEDIA_RETRIES', 3))
+        self._media_timeout = aiohttp.ClientTimeout(
+            sock_connect=float(os.getenv('MEDIA_CONNECT_TIMEOUT', 5)),
+            sock_read=float(os.getenv('MEDIA_READ_TIMEOUT', 30))
+        )
+        self.image_threads = int(os.getenv('ASGI_IMAGE_THREADS', os.cpu_count() or 2))
+        self._session = None
+        self._slots = None
+        self._image_pool = None
+
+    async def start(self):
+        """Create loop-bound resources; call once the event loop is running"""
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._image_pool = ThreadPoolExecutor(max_workers=self.image_threads, thread_name_prefix='asgi-image')
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=int(os.getenv('MEDIA_POOL_SIZE', 100)), keepalive_timeout=30),
+            timeout=self._media_timeout
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+        if self._image_pool is not None:
+            self._image_pool.shutdown(wait=False)
+        await self.client.close()
+
+    async def _in_image_pool(self, fn, *args):
+        """asyncio.to_thread on the image pool (keeps the metrics trace context)"""
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._image_pool, call)
+
+    async def download(self, url, auth=None):
+        """Fetch one media URL with retries and the same size limit as MediaDownloader"""
+        basic_auth = aiohttp.BasicAuth(*auth) if auth and auth[0] else None
+        for attempt in range(self.media_retries + 1):
+            try:
+                async with self._session.get(url, auth=basic_auth) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.media_retries:
+                        await asyncio.sleep(0.5 * (2 ** attempt))
+                        continue
+                    if response.status != 200:
+                        raise MediaDownloadError(f"Failed to fetch image: {response.status}",
+                                                 transient=response.status in RETRY_STATUSES)
+                    if response.content_length and response.content_length > self.media_max_bytes:
+                        raise MediaDownloadError(f"Image is too large ({response.content_length // 1024} KB)")
+
+                    data = bytearray()
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        data += chunk
+                        if len(data) > self.media_max_bytes:
+                            raise MediaDownloadError(f"Image is too large (over {self.media_max_bytes // 1024} KB)")
+                    return bytes(data)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.media_retries:
+                    raise MediaDownloadError(f"Failed to fetch image: {e.__class__.__name__}",
+                                             transient=True) from e
+                await asyncio.sleep(0.5 * (2 ** attempt))
+
+    async def _create_completion(self, **kwargs):
+        """Awaitable model call behind the shared circuit breaker and rate limiter"""
+        vision = self.vision
+        # Every exit below must settle the breaker, including cancellation
+        # (CancelledError isn't an Exception): a half-open trial that is never
+        # released would make the breaker reject all later calls
+        vision.circuit_breaker.before_call()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=vision.slot_timeout)
+        except asyncio.TimeoutError:
+            vision.circuit_breaker.release()
+            raise UpstreamUnavailableError("Too many model calls in progress")
+        except BaseException:
+            vision.circuit_breaker.release()
+            raise
+
+        try:
+            # Only a call that holds a slot spends a rate token
+            limiter = vision.rate_limiter
+            if limiter is not None and not await limiter.acquire_async(timeout=vision.slot_timeout):
+                raise UpstreamUnavailableError("Rate limit reached for model calls")
+            with timed('model_call'):
+                response = await self.client.chat.completions.create(**kwargs)
+        except UPSTREAM_ERRORS:
+            vision.circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            vision.circuit_breaker.release()
+            raise
+        else:
+            vision.circuit_breaker.record_success()
+            return response
+        finally:
+            self._slots.release()
+
+    @timed('analyze_food_image')
+    async def analyze_food_images(self, image_urls, twilio_auth):
+        """Same contract as VisionService.analyze_food_images"""
+        vision = self.vision
+        if self._session is None:
+            await self.start()
+        try:
+            image_urls = image_urls[:vision.max_images]
+            with timed('media_download'):
+                images = await asyncio.gather(*(self.download(url, auth=twilio_auth) for url in image_urls))
+            vision.check_total_size(images)
+
+            # Resent or near-identical photos reuse the earlier analysis
+            cache_key = None
+            if vision.image_cache is not None:
+                cache_key, cached = await self._in_image_pool(vision.image_cache.lookup, images)
+                if cached is not None:
+                    logger.info("Using cached analysis for previously seen image")
+                    return {
+                        'success': True,
+                        'analysis': cached['analysis'],
+                        'nutrition': cached['nutrition'],
+                        'cached': True
+                    }
+
+            prepared = await self._in_image_pool(vision.prepare_images, images)
+            del images
+
+            request = vision.build_completion_request(prepared)
+            response = await self._create_completion(**request)
+            if vision.is_truncated(response):
+                # Once, with twice the room; parse_completion rejects a second cut-off
+                logger.warning("Structured analysis hit max_tokens=%d, retrying with %d",
+                               request['max_tokens'], request['max_tokens'] * 2)
+                request['max_tokens'] *= 2
+                response = await self._create_completion(**request)
+            analysis, nutrition_data = vision.parse_completion(response)
+
+            # Don't cache responses we couldn't parse, so a resend gets a fresh try
+            if cache_key is not None and nutrition_data.get('calories'):
+                await self._in_image_pool(vision.image_cache.store, cache_key,
+                                          {'analysis': analysis, 'nutrition': nutrition_data})
+
+            return {
+                'success': True,
+                'analysis': analysis,
+                'nutrition': nutrition_data
+            }
+
+        except (UpstreamUnavailableError,) + UPSTREAM_ERRORS as e:
+            logger.warning("Model unavailable: %s", e)
+            return {
+                'success': False,
+                'error': str(e),
+                'unavailable': True,
+                'retryable': is_transient(e)
+            }
+
+        except Exception as e:
+            logger.exception("Error in analyze_food_images: %s", e)
+            return {
+                'success': False,
+                'error': str(e),
+                'retryable': is_transient(e)
+            }
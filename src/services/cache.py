@@ -0,0 +1,264 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by TTLCache.get on a miss so that None can be cached as a value
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a per-entry time to live.
+
+    Holds at most `max_size` entries, evicting the least recently used one
+    when full. Entries older than `ttl` seconds are treated as misses.
+
+    Filling the cache from a database read can race with a write that
+    invalidates the key: take `generation(key)` before the read and pass it
+    to `set`, which then stores nothing if the key was deleted (or the cache
+    cleared) in the meantime.
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._generations = {}  # key -> times deleted; one small int per invalidated key
+        self._cleared = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def generation(self, key):
+        with self._lock:
+            return self._cleared + self._generations.get(key, 0)
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._cleared + self._generations.get(key, 0):
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._cleared += 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class SqliteCache:
+    """
+    Cache stored in a local SQLite file so every gunicorn worker on the host
+    shares it. Values must be JSON-serializable.
+
+    Hit/miss counters are per process; size and evictions are shared.
+    Generations (see TTLCache) live in the file too, so a delete in one
+    worker stops a stale fill in another. The key '' is reserved for
+    clear().
+    """
+
+    def __init__(self, namespace, path='cache.db', max_size=10000, ttl=300):
+        self.namespace = namespace
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_expiry ON cache_entries (namespace, expires_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_generations (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                generation INTEGER NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            # WAL lets readers in other workers proceed while one writes
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=MISSING):
+        row = self._conn().execute(
+            "SELECT value FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.namespace, str(key), time.time())
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return json.loads(row[0])
+
+    def generation(self, key):
+        row = self._conn().execute(
+            "SELECT COALESCE(SUM(generation), 0) FROM cache_generations WHERE namespace = ? AND key IN (?, '')",
+            (self.namespace, str(key))
+        ).fetchone()
+        return row[0]
+
+    def set(self, key, value, generation=None):
+        conn = self._conn()
+        entry = (self.namespace, str(key), json.dumps(value, ensure_ascii=False), time.time() + self.ttl)
+        if generation is None:
+            conn.execute("""
+                INSERT INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (namespace, key) DO UPDATE SET
+                    value = excluded.value,
+                    expires_at = excluded.expires_at
+            """, entry)
+        else:
+            # Check and store in one statement, so no delete can slip in between
+            conn.execute("""
+                INSERT INTO cache_entries (namespace, key, value, expires_at)
+                SELECT ?, ?, ?, ?
+                WHERE (
+                    SELECT COALESCE(SUM(generation), 0) FROM cache_generations
+                    WHERE namespace = ? AND key IN (?, '')
+                ) = ?
+                ON CONFLICT (namespace, key) DO UPDATE SET
+                    value = excluded.value,
+                    expires_at = excluded.expires_at
+            """, entry + (self.namespace, str(key), generation))
+        conn.commit()
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % 100 == 0
+        if prune:
+            self._prune(conn)
+
+    def _bump_generation(self, conn, key):
+        conn.execute("""
+            INSERT INTO cache_generations (namespace, key, generation) VALUES (?, ?, 1)
+            ON CONFLICT (namespace, key) DO UPDATE SET generation = generation + 1
+        """, (self.namespace, key))
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, str(key)))
+        self._bump_generation(conn, str(key))
+        conn.commit()
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+        self._bump_generation(conn, '')
+        conn.commit()
+
+    def _prune(self, conn):
+        """Drop expired entries, then the soonest-to-expire ones beyond max_size"""
+        cursor = conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?",
+            (self.namespace, time.time())
+        )
+        evicted = cursor.rowcount
+        cursor = conn.execute("""
+            DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                SELECT key FROM cache_entries WHERE namespace = ?
+                ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.namespace, self.namespace, self.max_size))
+        evicted += cursor.rowcount
+        conn.commit()
+        with self._lock:
+            self.evictions += evicted
+
+    def __len__(self):
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        return row[0]
+
+    def stats(self):
+        size = len(self)
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+def create_cache(namespace, max_size=1024, ttl=300, shared=False):
+    """
+    Build a cache using the backend selected by CACHE_BACKEND.
+
+    'memory' keeps entries in this process; 'sqlite' shares them between all
+    workers on the host through the file at CACHE_PATH. Without
+    CACHE_BACKEND, caches marked `shared` (ones invalidated on update, where
+    every worker must see another worker's write) use 'sqlite' and the rest
+    use 'memory'. CACHE_BACKEND=memory puts every cache in process memory,
+    which is only correct when a single process serves the bot.
+    """
+    backend = os.environ.get('CACHE_BACKEND', '').lower() or ('sqlite' if shared else 'memory')
+    if backend == 'sqlite':
+        return SqliteCache(namespace, path=os.environ.get('CACHE_PATH', 'cache.db'), max_size=max_size, ttl=ttl)
+    return TTLCache(max_size=max_size, ttl=ttl)
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from services.metrics import COMMAND_SECONDS
+
+
+class CommandRouter:
+    """
+    Dispatch table for incoming text messages.
+
+    Commands are matched with a single dict lookup on the normalized text, so
+    adding commands doesn't make routing slower. Anything that isn't a known
+    command goes to `fallback`, which is where multi-step flows such as the
+    goal wizard live. Every dispatch is timed per route.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self._commands = {}
+        self._lock = threading.Lock()
+        self._timings = {}
+
+    def command(self, text):
+        """Decorator registering a handler(phone_number, text) for an exact command"""
+        def register(handler):
+            self._commands[self.normalize(text)] = (text, handler)
+            return handler
+        return register
+
+    @staticmethod
+    def normalize(text):
+        return (text or '').strip().lower()
+
+    def dispatch(self, phone_number, text):
+        text = self.normalize(text)
+        route = self._commands.get(text)
+        if route is not None:
+            name, handler = route
+        else:
+            name, handler = self.fallback.__name__, self.fallback
+
+        start = time.perf_counter()
+        try:
+            return handler(phone_number, text)
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def _record(self, name, elapsed):
+        COMMAND_SECONDS.observe(elapsed, command=name)
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            timing['count'] += 1
+            timing['total_ms'] += elapsed * 1000
+            timing['max_ms'] = max(timing['max_ms'], elapsed * 1000)
+
+    def stats(self):
+        """Per-route call count and latency in milliseconds"""
+        with self._lock:
+            return {
+                name: {
+                    'count': timing['count'],
+                    'avg_ms': round(timing['total_ms'] / timing['count'], 2),
+                    'max_ms': round(timing['max_ms'], 2)
+                }
+                for name, timing in self._timings.items()
+            }
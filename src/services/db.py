@@ -0,0 +1,323 @@
+import io
+import itertools
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+
+from services.db_pool import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Queries are written once with '?' placeholders and translated per backend.
+# They must not contain a literal '?' (use a parameter instead).
+
+
+class SqliteAdapter:
+    """SQLite specifics: '?' placeholders, executemany for bulk loads, fetchmany streaming"""
+
+    name = 'sqlite'
+
+    def translate(self, sql):
+        return sql
+
+    def cursor(self, conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None  # plain tuples, the same shape psycopg2 returns
+        return cursor
+
+    def map_row(self, row):
+        return row
+
+    def copy_rows(self, cursor, table, columns, rows):
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            rows
+        )
+
+    def stream_cursor(self, conn, chunk_size):
+        return self.cursor(conn)
+
+    def begin_snapshot(self, conn):
+        if not conn.in_transaction:
+            conn.execute("BEGIN")  # one read transaction = one snapshot
+
+    def end_snapshot(self, conn):
+        conn.rollback()
+
+
+class PostgresAdapter:
+    """PostgreSQL specifics: '%s' placeholders, COPY for bulk loads, server-side cursors"""
+
+    name = 'postgres'
+
+    def __init__(self):
+        self._cursor_ids = itertools.count()
+
+    def translate(self, sql):
+        return sql.replace('%', '%%').replace('?', '%s')
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def map_row(self, row):
+        # DATE/TIMESTAMP/NUMERIC come back as objects; SQLite returns ISO
+        # strings and floats, so normalize to those
+        return tuple(_plain_value(value) for value in row)
+
+    def copy_rows(self, cursor, table, columns, rows):
+        buffer = io.StringIO()
+        buffer.writelines(','.join(map(_csv_field, row)) + '\n' for row in rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def stream_cursor(self, conn, chunk_size):
+        cursor = conn.cursor(name=f'stream_{next(self._cursor_ids)}')
+        cursor.itersize = chunk_size
+        return cursor
+
+    def begin_snapshot(self, conn):
+        conn.rollback()  # set_session needs an idle connection
+        conn.set_session(readonly=True, isolation_level='REPEATABLE READ')
+
+    def end_snapshot(self, conn):
+        conn.rollback()
+        conn.set_session(readonly=False, isolation_level='DEFAULT')
+
+
+def _csv_field(value):
+    # In COPY's CSV format an unquoted empty field is NULL and a quoted one is
+    # an empty string, so strings are always quoted to match what SQLite stores
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+def _plain_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(' ', 'seconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class Session:
+    """Queries on one pooled connection, inside one transaction"""
+
+    def __init__(self, db, conn):
+        self.db = db
+        self.conn = conn
+        self.adapter = db.adapter
+        self._cursor = None
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.adapter.cursor(self.conn)
+        return self._cursor
+
+    def execute(self, sql, params=()):
+        """Run a statement; returns the affected row count"""
+        self.cursor.execute(self.db.statement(sql), params)
+        return self.cursor.rowcount
+
+    def executemany(self, sql, seq_of_params):
+        """Run a statement once per parameter tuple; returns the total row count"""
+        self.cursor.executemany(self.db.statement(sql), seq_of_params)
+        return self.cursor.rowcount
+
+    def fetchone(self, sql, params=()):
+        self.cursor.execute(self.db.statement(sql), params)
+        row = self.cursor.fetchone()
+        return self.adapter.map_row(row) if row is not None else None
+
+    def fetchall(self, sql, params=()):
+        self.cursor.execute(self.db.statement(sql), params)
+        return [self.adapter.map_row(row) for row in self.cursor.fetchall()]
+
+    def fetchone_dict(self, sql, params=()):
+        row = self.fetchone(sql, params)
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in self.cursor.description], row))
+
+    def copy_rows(self, table, columns, rows):
+        """Bulk insert tuples (COPY on PostgreSQL, executemany on SQLite)"""
+        self.adapter.copy_rows(self.cursor, table, columns, rows)
+        return len(rows)
+
+    def stream(self, sql, params=(), chunk_size=10000):
+        """
+        Yield the result in lists of up to `chunk_size` raw driver rows,
+        without loading it all into memory (server-side cursor on PostgreSQL).
+        Rows are not normalized, so dates may be strings or date objects.
+        """
+        cursor = self.adapter.stream_cursor(self.conn, chunk_size)
+        try:
+            cursor.execute(self.db.statement(sql), params)
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            cursor.close()
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+
+class Database:
+    """
+    Backend-neutral access to the bot's database.
+
+    Services write each query once with '?' placeholders; the backend form
+    is produced once per distinct statement and cached, so the driver sees
+    the exact same SQL string every time (sqlite3 reuses its compiled
+    statement for it). Rows come back as tuples of plain values on both
+    backends. Pooling, bulk loads and upserts live here rather than in each
+    service.
+    """
+
+    def __init__(self, pool, use_sqlite, description=None):
+        self.pool = pool
+        self.use_sqlite = use_sqlite
+        self.adapter = SqliteAdapter() if use_sqlite else PostgresAdapter()
+        self.description = description or self.adapter.name
+        self._statements = {}
+        self._upserts = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def backend(self):
+        return self.adapter.name
+
+    def statement(self, sql):
+        """Backend form of a '?' query, from the statement cache"""
+        translated = self._statements.get(sql)
+        if translated is not None:
+            self._hits += 1  # approximate under concurrency; only used for stats
+            return translated
+        translated = self.adapter.translate(sql)
+        with self._lock:
+            self._misses += 1
+            self._statements[sql] = translated
+        return translated
+
+    @contextmanager
+    def transaction(self, commit=True):
+        """
+        A Session whose work is committed when the block exits normally and
+        rolled back if it raises (or always, with commit=False).
+        """
+        conn = self.pool.getconn()
+        session = Session(self, conn)
+        try:
+            yield session
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            session.close()
+            self.pool.putconn(conn)
+
+    @contextmanager
+    def snapshot(self):
+        """A read-only Session that sees one consistent view of every table"""
+        conn = self.pool.getconn()
+        session = Session(self, conn)
+        try:
+            self.adapter.begin_snapshot(conn)
+            yield session
+        finally:
+            session.close()
+            try:
+                self.adapter.end_snapshot(conn)
+            finally:
+                self.pool.putconn(conn)
+
+    def execute(self, sql, params=()):
+        with self.transaction() as session:
+            return session.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        with self.transaction() as session:
+            return session.executemany(sql, seq_of_params)
+
+    def fetchone(self, sql, params=()):
+        with self.transaction() as session:
+            return session.fetchone(sql, params)
+
+    def fetchall(self, sql, params=()):
+        with self.transaction() as session:
+            return session.fetchall(sql, params)
+
+    def fetchone_dict(self, sql, params=()):
+        with self.transaction() as session:
+            return session.fetchone_dict(sql, params)
+
+    def upsert_sql(self, table, columns, conflict, update=()):
+        """
+        INSERT ... ON CONFLICT statement for `columns`; conflicting rows get
+        the `update` columns overwritten, or are left alone if there are none.
+        """
+        sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+               f"ON CONFLICT ({', '.join(conflict)}) ")
+        if update:
+            return sql + "DO UPDATE SET " + ', '.join(f"{column} = excluded.{column}" for column in update)
+        return sql + "DO NOTHING"
+
+    def upsert(self, table, values, conflict, update=()):
+        """Insert or update one row given as a dict; returns the affected row count"""
+        columns = tuple(values)
+        key = (table, columns, tuple(conflict), tuple(update))
+        sql = self._upserts.get(key)
+        if sql is None:
+            sql = self._upserts[key] = self.upsert_sql(table, *key[1:])
+        return self.execute(sql, tuple(values[column] for column in columns))
+
+    def stats(self):
+        return {
+            'statements': len(self._statements),
+            'statement_cache_hits': self._hits,
+            'statement_cache_misses': self._misses
+        }
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(db_url=None, db_path=None):
+    """
+    The shared Database for DATABASE_URL (PostgreSQL) or, without it, the
+    local SQLite file. Built on get_pool, so it follows the same per-process
+    pooling.
+    """
+    if db_url is None and db_path is None:
+        db_url = os.environ.get('DATABASE_URL')
+        db_path = None if db_url else 'nutrition.db'
+    key = (os.getpid(), db_url or db_path)
+    with _databases_lock:
+        db = _databases.get(key)
+        if db is None:
+            if db_url:
+                db = Database(get_pool(db_url=db_url), use_sqlite=False, description='PostgreSQL')
+            else:
+                db = Database(get_pool(db_path=db_path), use_sqlite=True, description=f'SQLite: {db_path}')
+            _databases[key] = db
+        return db
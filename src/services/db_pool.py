@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class PostgresConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections.
+
+    Connections idle longer than `health_check_after` seconds are pinged before
+    being handed out, and connections idle longer than `max_idle` seconds are
+    closed so we don't hold server slots we no longer need.
+    """
+
+    def __init__(self, dsn, max_size=5, max_idle=300, health_check_after=30, acquire_timeout=10):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+
+        self._idle = []  # list of (conn, last_used)
+        self._size = 0  # idle + checked out
+        self._cond = threading.Condition()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            self._evict_idle()
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.acquire_timeout}s")
+                self._cond.wait(remaining)
+
+            if self._idle:
+                # LIFO keeps the warmest connections in use and lets the rest age out
+                conn, last_used = self._idle.pop()
+            else:
+                conn, last_used = None, None
+                self._size += 1
+
+        # Network I/O happens outside the lock
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = psycopg2.connect(self.dsn)
+            return conn
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed:
+                self._close_quietly(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self.max_size
+            }
+
+    def _evict_idle(self):
+        """Close connections that have been idle too long. Caller holds the lock."""
+        now = time.monotonic()
+        keep = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.max_idle:
+                self._close_quietly(conn)
+                self._size -= 1
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class SqliteConnectionPool:
+    """
+    One persistent SQLite connection per thread.
+
+    SQLite connections are cheap to keep open and can't be shared across
+    threads, so instead of pooling we simply reuse the calling thread's
+    connection for every request it serves.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def getconn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row  # This makes rows accessible by column name
+            # Enable foreign keys
+            conn.execute('PRAGMA foreign_keys = ON')
+            self._local.conn = conn
+            with self._lock:
+                self._opened += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                return
+            except sqlite3.Error:
+                pass
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.conn = None
+
+    def closeall(self):
+        # Only the calling thread's connection is reachable; other threads'
+        # connections are closed when those threads exit.
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self.putconn(conn, discard=True)
+
+    def stats(self):
+        with self._lock:
+            return {'opened': self._opened}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_max_size():
+    """Connections per PostgreSQL pool (DB_POOL_MAX_SIZE)"""
+    return int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+
+
+def get_pool(db_url=None, db_path=None):
+    """
+    Return the shared pool for a database, creating it on first use.
+
+    Pools are keyed by process id so that each gunicorn worker builds its own
+    connections after fork instead of sharing sockets inherited from the master.
+    """
+    key = (os.getpid(), db_url or db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if db_url:
+                pool = PostgresConnectionPool(
+                    db_url,
+                    max_size=pool_max_size(),
+                    max_idle=float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+                    health_check_after=float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', 30)),
+                    acquire_timeout=float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', 10))
+                )
+            else:
+                pool = SqliteConnectionPool(db_path)
+            _pools[key] = pool
+        return pool
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional; NumPy .npz is always available
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+MACROS = ('calories', 'protein', 'carbs', 'fat')
+
+# Exported tables: (table, date column, [(column, numpy dtype)]). Text columns
+# (food_items, analysis_text) are left out; analytics only needs the numbers.
+TABLES = [
+    ('meals', 'date', [
+        ('id', np.int64),
+        ('phone_number', None),
+        ('date', 'datetime64[D]'),
+        ('meal_time', 'datetime64[s]'),
+        ('calories', np.float32),
+        ('protein', np.float32),
+        ('carbs', np.float32),
+        ('fat', np.float32),
+    ]),
+    ('daily_tracking', 'date', [
+        ('phone_number', None),
+        ('date', 'datetime64[D]'),
+        ('total_calories', np.float32),
+        ('total_protein', np.float32),
+        ('total_carbs', np.float32),
+        ('total_fat', np.float32),
+    ]),
+    ('user_goals', None, [
+        ('phone_number', None),
+        ('calories', np.float32),
+        ('protein', np.float32),
+        ('carbs', np.float32),
+        ('fat', np.float32),
+    ]),
+]
+
+
+class _UserIndex:
+    """Maps phone numbers to dense integer ids shared by every exported table"""
+
+    def __init__(self):
+        self.ids = {}
+
+    def encode(self, phones):
+        ids = self.ids
+        return np.fromiter((ids.setdefault(phone, len(ids)) for phone in phones), dtype=np.int32, count=len(phones))
+
+    def phones(self):
+        return np.array(list(self.ids), dtype=str)
+
+
+def _to_column(values, dtype):
+    if isinstance(dtype, str):
+        try:
+            # ISO strings (SQLite) and date/datetime objects (psycopg2) convert directly
+            return np.array(values, dtype=dtype)
+        except (TypeError, ValueError):
+            width = 10 if dtype == 'datetime64[D]' else 19
+            return np.array([str(v)[:width] for v in values], dtype=dtype)
+    # None becomes NaN
+    return np.array(values, dtype=np.float64).astype(dtype)
+
+
+class _NpzWriter:
+    """Collects compact column chunks and writes one .npz per table"""
+
+    extension = 'npz'
+
+    def __init__(self, path, columns, compress=False):
+        self.path = path
+        self.columns = columns
+        self.compress = compress
+        self.chunks = {name: [] for name, _ in columns}
+
+    def write(self, arrays):
+        for name, array in arrays.items():
+            self.chunks[name].append(array)
+
+    def close(self):
+        columns = {}
+        for name, dtype in self.columns:
+            key = 'user_id' if name == 'phone_number' else name
+            chunks = self.chunks[name]
+            empty_dtype = np.int32 if dtype is None else dtype
+            columns[key] = np.concatenate(chunks) if chunks else np.array([], dtype=empty_dtype)
+        (np.savez_compressed if self.compress else np.savez)(self.path, **columns)
+
+
+class _ParquetWriter:
+    """Streams each chunk to a Parquet row group as it arrives"""
+
+    extension = 'parquet'
+
+    def __init__(self, path, columns, compress=False):
+        self.path = path
+        self.compression = 'zstd' if compress else 'snappy'
+        self.writer = None
+
+    def write(self, arrays):
+        table = pa.table({('user_id' if k == 'phone_number' else k): v for k, v in arrays.items()})
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema, compression=self.compression)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def export_history(db, out_dir, fmt='npz', chunk_size=50000, start_date=None, end_date=None, compress=False):
+    """
+    Stream meals, daily_tracking and user_goals into a columnar dataset in out_dir.
+
+    Rows are read in chunks of `chunk_size` (a named server-side cursor on
+    PostgreSQL, fetchmany on SQLite) inside a single read-only snapshot, so
+    the export never holds the whole table in the database driver and sees
+    a consistent view of all tables. Phone numbers are replaced by dense
+    user ids; the mapping is written to users.npz. `compress` trades export
+    time for file size (zlib for .npz, zstd instead of snappy for Parquet).
+    Returns the manifest.
+    """
+    if fmt == 'parquet' and pa is None:
+        raise RuntimeError("Parquet export needs pyarrow; install it or use --format npz")
+    writer_class = _ParquetWriter if fmt == 'parquet' else _NpzWriter
+    os.makedirs(out_dir, exist_ok=True)
+
+    users = _UserIndex()
+    manifest = {'format': fmt, 'exported_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'tables': {}}
+
+    with db.snapshot() as session:
+        for table, date_column, columns in TABLES:
+            started = time.perf_counter()
+            names = [name for name, _ in columns]
+            query = f"SELECT {', '.join(names)} FROM {table}"
+            params = []
+            if date_column and (start_date or end_date):
+                query += f" WHERE {date_column} BETWEEN ? AND ?"
+                params = [start_date or '0001-01-01', end_date or '9999-12-31']
+
+            path = os.path.join(out_dir, f"{table}.{writer_class.extension}")
+            writer = writer_class(path, columns, compress)
+            rows = 0
+            for chunk in session.stream(query, params, chunk_size):
+                values = list(zip(*chunk))
+                writer.write({
+                    name: users.encode(values[i]) if dtype is None else _to_column(values[i], dtype)
+                    for i, (name, dtype) in enumerate(columns)
+                })
+                rows += len(chunk)
+            writer.close()
+
+            elapsed = time.perf_counter() - started
+            manifest['tables'][table] = {'rows': rows, 'file': os.path.basename(path), 'seconds': round(elapsed, 2)}
+            logger.info("Exported %d %s rows in %.1fs", rows, table, elapsed)
+
+    np.savez_compressed(os.path.join(out_dir, 'users.npz'), phone_number=users.phones())
+    manifest['users'] = len(users.ids)
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_table(data_dir, table):
+    """Columns of an exported table as a dict of NumPy arrays"""
+    with open(os.path.join(data_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    path = os.path.join(data_dir, manifest['tables'][table]['file'])
+    if manifest['format'] == 'parquet':
+        if pa is None:
+            raise RuntimeError("Reading a Parquet export needs pyarrow")
+        parquet = pq.read_table(path)
+        return {name: parquet.column(name).to_numpy() for name in parquet.column_names}
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def load_users(data_dir):
+    with np.load(os.path.join(data_dir, 'users.npz')) as data:
+        return data['phone_number']
@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+# Statuses worth retrying: the media host is overloaded or briefly failing
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class MediaDownloadError(Exception):
+    """
+    Raised when media can't be downloaded; the message is shown to the user.
+    `transient` is set for network errors and retryable statuses, where a
+    later attempt may succeed, as opposed to e.g. an oversized file.
+    """
+
+    def __init__(self, message, transient=False):
+        super().__init__(message)
+        self.transient = transient
+
+
+class MediaDownloader:
+    """
+    Downloads Twilio media over a shared keep-alive session.
+
+    Connections to Twilio (and the storage it redirects to) are pooled and
+    reused across requests, every download has connect/read timeouts,
+    transient failures are retried with backoff, and bodies are streamed so
+    oversized files are cut off without being read into memory.
+    """
+
+    def __init__(self, max_bytes=20 * 1024 * 1024, connect_timeout=5, read_timeout=30,
+                 retries=3, backoff=0.5, pool_size=10):
+        self.max_bytes = max_bytes
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._stats = {'downloads': 0, 'failures': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def download(self, url, auth=None):
+        start = time.perf_counter()
+        try:
+            with self.session.get(url, auth=auth, timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    raise MediaDownloadError(f"Failed to fetch image: {response.status_code}",
+                                             transient=response.status_code in RETRY_STATUSES)
+
+                declared = response.headers.get('Content-Length')
+                if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                    raise MediaDownloadError(f"Image is too large ({int(declared) // 1024} KB)")
+
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    data += chunk
+                    if len(data) > self.max_bytes:
+                        raise MediaDownloadError(f"Image is too large (over {self.max_bytes // 1024} KB)")
+        except MediaDownloadError:
+            self._record(start, 0, failed=True)
+            raise
+        except requests.RequestException as e:
+            self._record(start, 0, failed=True)
+            raise MediaDownloadError(f"Failed to fetch image: {e.__class__.__name__}", transient=True) from e
+
+        elapsed = self._record(start, len(data))
+        logger.debug("Downloaded %d bytes in %.0f ms", len(data), elapsed * 1000)
+        return bytes(data)
+
+    def _record(self, start, size, failed=False):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._stats['failures' if failed else 'downloads'] += 1
+            self._stats['bytes'] += size
+            self._stats['seconds'] += elapsed
+        return elapsed
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def create_media_downloader():
+    """Build the media downloader from MEDIA_* settings"""
+    return MediaDownloader(
+        max_bytes=int(os.getenv('MEDIA_MAX_BYTES', 20 * 1024 * 1024)),
+        connect_timeout=float(os.getenv('MEDIA_CONNECT_TIMEOUT', 5)),
+        read_timeout=float(os.getenv('MEDIA_READ_TIMEOUT', 30)),
+        retries=int(os.getenv('MEDIA_RETRIES', 3))
+    )
@@ -0,0 +1,127 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from services.cache import MISSING, create_cache
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it only exact matches are cached
+    Image = None
+
+
+def dhash(image_bytes, size=8):
+    """
+    64-bit difference hash of an image, or None if it can't be computed.
+
+    Near-identical photos (recompressed, resized, slightly re-shot) end up a
+    few bits apart, unlike a cryptographic hash.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft('L', (size * 4, size * 4))  # cheap JPEG downscale while decoding
+            pixels = list(img.convert('L').resize((size + 1, size)).getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class ImageResultCache:
+    """
+    Content-addressed cache of parsed analysis results.
+
+    Results are keyed by the SHA-256 of the downloaded image bytes. When
+    `near_duplicates` is enabled (requires Pillow), a perceptual hash index is
+    also kept so that near-identical photos can reuse a cached result.
+    """
+
+    def __init__(self, max_size=1000, ttl=7 * 86400, near_duplicates=False, max_distance=4):
+        self.results = create_cache('image_results', max_size=max_size, ttl=ttl)
+        self.near_duplicates = near_duplicates and Image is not None
+        self.max_distance = max_distance
+        self.max_size = max_size
+        self._phashes = OrderedDict()  # sha256 -> dhash, bounded like the result cache
+        self._lock = threading.Lock()
+        self.near_hits = 0
+
+    def lookup(self, images):
+        """
+        Find a cached result for a list of image byte strings.
+
+        Returns (key, result); result is None on a miss and key identifies the
+        images for a later store(). Near-duplicate matching only applies to
+        single-image requests.
+        """
+        if len(images) == 1:
+            digest = hashlib.sha256(images[0]).hexdigest()
+        else:
+            combined = hashlib.sha256()
+            for image_bytes in images:
+                combined.update(hashlib.sha256(image_bytes).digest())
+            digest = combined.hexdigest()
+
+        key = (digest, None)
+        result = self.results.get(digest)
+        if result is not MISSING:
+            return key, result
+
+        if self.near_duplicates and len(images) == 1:
+            phash = dhash(images[0])
+            key = (digest, phash)
+            if phash is not None:
+                similar = self._nearest(phash)
+                if similar is not None:
+                    result = self.results.get(similar)
+                    if result is not MISSING:
+                        with self._lock:
+                            self.near_hits += 1
+                        return key, result
+        return key, None
+
+    def store(self, key, result):
+        digest, phash = key
+        self.results.set(digest, result)
+        if phash is not None:
+            with self._lock:
+                self._phashes[digest] = phash
+                self._phashes.move_to_end(digest)
+                while len(self._phashes) > self.max_size:
+                    self._phashes.popitem(last=False)
+
+    def _nearest(self, phash):
+        best_key, best_distance = None, self.max_distance + 1
+        with self._lock:
+            candidates = list(self._phashes.items())
+        for key, other in candidates:
+            distance = bin(phash ^ other).count('1')
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def stats(self):
+        stats = self.results.stats()
+        with self._lock:
+            stats['near_hits'] = self.near_hits
+        return stats
+
+
+def create_image_cache():
+    """Build the image result cache from IMAGE_CACHE_* settings, or None if disabled"""
+    if os.getenv('IMAGE_CACHE_ENABLED', '1').lower() in ('0', 'false', 'no'):
+        return None
+    return ImageResultCache(
+        max_size=int(os.getenv('IMAGE_CACHE_SIZE', 1000)),
+        ttl=float(os.getenv('IMAGE_CACHE_TTL', 7 * 86400)),
+        near_duplicates=os.getenv('IMAGE_CACHE_NEAR_DUPLICATES', '').lower() in ('1', 'true', 'yes'),
+        max_distance=int(os.getenv('IMAGE_CACHE_MAX_DISTANCE', 4))
+    )
@@ -0,0 +1,75 @@
+import base64
+import io
+import logging
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Without Pillow images are sent as downloaded
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Formats the vision model accepts as-is
+SUPPORTED_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+
+def detect_mime_type(data):
+    """Identify the image format from its magic bytes rather than trusting the URL or headers"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp' and data[8:12] in (b'heic', b'heix', b'mif1', b'msf1', b'hevc'):
+        return 'image/heic'
+    return 'application/octet-stream'
+
+
+def prepare_image(data, max_edge=1024, quality=80):
+    """
+    Shrink an image for upload to the model and return (mime_type, base64_str).
+
+    Images larger than `max_edge` on their longest side are downscaled and
+    re-encoded as JPEG at `quality`. The original is kept when it is already
+    small enough, or when re-encoding wouldn't make it smaller.
+    """
+    mime_type = detect_mime_type(data)
+
+    if Image is not None:
+        try:
+            encoded = _downscale(data, mime_type, max_edge, quality)
+            if encoded is not None:
+                # b64encode reads the buffer in place, so we don't hold another copy of the JPEG
+                with encoded.getbuffer() as view:
+                    return 'image/jpeg', base64.b64encode(view).decode('ascii')
+        except Exception as e:
+            logger.warning("Image preprocessing failed, sending original: %s", e)
+
+    return mime_type, base64.b64encode(data).decode('ascii')
+
+
+def _downscale(data, mime_type, max_edge, quality):
+    """Return a BytesIO with the re-encoded JPEG, or None to keep the original"""
+    with Image.open(io.BytesIO(data)) as img:
+        needs_resize = max(img.size) > max_edge
+        if not needs_resize and mime_type in SUPPORTED_MIME_TYPES:
+            return None
+
+        # For JPEGs, let the decoder scale down by a power of two so we never
+        # materialize the full-resolution bitmap of a 12MP photo
+        img.draft('RGB', (max_edge, max_edge))
+        frame = ImageOps.exif_transpose(img)
+        if frame.mode != 'RGB':
+            frame = frame.convert('RGB')
+        frame.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        output = io.BytesIO()
+        frame.save(output, format='JPEG', quality=quality, optimize=True)
+        frame.close()
+
+    if mime_type in SUPPORTED_MIME_TYPES and output.tell() >= len(data):
+        return None
+    return output
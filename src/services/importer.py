@@ -0,0 +1,283 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+MACROS = ('calories', 'protein', 'carbs', 'fat')
+# Per-meal upper bounds; anything above is almost certainly a unit or typo error
+MACRO_LIMITS = {'calories': 10000, 'protein': 1000, 'carbs': 1500, 'fat': 1000}
+MEAL_COLUMNS = ('phone_number', 'date', 'meal_time', 'food_items',
+                'calories', 'protein', 'carbs', 'fat', 'analysis_text')
+PHONE_PATTERN = re.compile(r'^\+\d{7,15}$')
+_encode_json = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class ImportRowError(ValueError):
+    """A row that can't be imported; the message says which field is wrong"""
+
+
+class AlreadyImportedError(ValueError):
+    """The file's contents were imported before; importing again would duplicate its meals"""
+
+
+def read_rows(path, fmt=None):
+    """
+    Yield (line number, row dict) from a CSV file with a header row or a
+    JSONL file with one object per line. The format comes from the file
+    extension unless `fmt` is given.
+    """
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv')
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if fmt == 'csv':
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                yield line, row
+            return
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                yield line, ImportRowError(f"invalid JSON: {e}")
+                continue
+            yield line, row if isinstance(row, dict) else ImportRowError("expected a JSON object")
+
+
+def _phone(value):
+    phone = str(value or '').strip()
+    if phone.startswith('whatsapp:'):
+        phone = phone[len('whatsapp:'):]
+    if not phone.startswith('+'):
+        phone = '+' + phone
+    if not PHONE_PATTERN.match(phone):
+        raise ImportRowError(f"invalid phone_number {value!r}")
+    return 'whatsapp:' + phone
+
+
+def _macro(row, key):
+    value = row.get(key)
+    if value is None or value == '':
+        return 0
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        try:
+            number = int(round(float(value)))
+        except (TypeError, ValueError, OverflowError):
+            raise ImportRowError(f"{key} is not a number: {value!r}")
+    if not 0 <= number <= MACRO_LIMITS[key]:
+        raise ImportRowError(f"{key} out of range: {value!r}")
+    return number
+
+
+def _food_items(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    value = str(value)
+    if value.startswith('['):
+        try:
+            return [str(item) for item in json.loads(value)]
+        except ValueError:
+            raise ImportRowError("food_items is not a valid JSON list")
+    return [item.strip() for item in value.split(';') if item.strip()]
+
+
+def validate_row(row):
+    """
+    Normalize one input row into a meals tuple (see MEAL_COLUMNS).
+
+    Needs phone_number and a date or meal_time (ISO 8601); the meal's date
+    defaults to meal_time's date and meal_time to noon on that date. Missing
+    macros count as 0. food_items may be a list, a JSON list or a
+    semicolon-separated string.
+    """
+    if isinstance(row, Exception):
+        raise row
+    phone_number = _phone(row.get('phone_number'))
+
+    meal_date = str(row.get('date') or '').strip()
+    meal_time = str(row.get('meal_time') or '').strip()
+    try:
+        if meal_time:
+            parsed = datetime.fromisoformat(meal_time.replace('Z', ''))
+            meal_time = parsed.replace(tzinfo=None).isoformat(' ', 'seconds')
+        if meal_date:
+            meal_date = date.fromisoformat(meal_date).isoformat()
+    except ValueError:
+        raise ImportRowError(f"invalid date or meal_time {row.get('date') or row.get('meal_time')!r}")
+    if not meal_date and not meal_time:
+        raise ImportRowError("date or meal_time is required")
+    meal_date = meal_date or meal_time[:10]
+    meal_time = meal_time or f"{meal_date} 12:00:00"
+
+    return (
+        phone_number,
+        meal_date,
+        meal_time,
+        _encode_json(_food_items(row.get('food_items'))),
+        *(_macro(row, key) for key in MACROS),
+        str(row.get('analysis_text') or '')
+    )
+
+
+class MealImporter:
+    """
+    Loads validated meal rows in batches inside a single transaction.
+
+    Meals go in through Session.copy_rows (COPY on PostgreSQL), senders
+    are added to authorized_users once each, and every (user, date) touched
+    is recorded in a temp table so daily_tracking is rebuilt for exactly
+    those days in one pass at the end instead of once per meal.
+    """
+
+    def __init__(self, db, batch_size=5000, max_errors=100):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+    def run(self, rows, dry_run=False, source=None):
+        """
+        Import (line, row) pairs from read_rows. Returns a summary dict; rows
+        that fail validation are skipped and reported, and the whole import
+        is rolled back once more than max_errors rows have failed.
+
+        `source` is an optional (checksum, name) recorded in meal_imports in
+        the same transaction; a checksum that is already there raises
+        AlreadyImportedError before anything is loaded.
+        """
+        started = time.perf_counter()
+        result = {'rows_read': 0, 'imported': 0, 'rejected': 0, 'errors': [],
+                  'users_registered': 0, 'days_rebuilt': 0, 'phones': set(), 'committed': False}
+        batch = []
+
+        with self.db.transaction(commit=not dry_run) as session:
+            if source is not None:
+                self._claim_source(session, *source)
+            self._create_days_table(session)
+
+            for line, row in rows:
+                result['rows_read'] += 1
+                try:
+                    batch.append(validate_row(row))
+                except ImportRowError as e:
+                    result['rejected'] += 1
+                    result['errors'].append((line, str(e)))
+                    if result['rejected'] > self.max_errors:
+                        raise ImportRowError(f"more than {self.max_errors} invalid rows, import aborted")
+                    continue
+                if len(batch) >= self.batch_size:
+                    self._flush(session, batch, result)
+                    logger.info("Imported %d meals so far", result['imported'])
+            self._flush(session, batch, result)
+
+            result['days_rebuilt'] = self._rebuild_days(session)
+            if source is not None:
+                session.execute("UPDATE meal_imports SET row_count = ? WHERE checksum = ?",
+                                (result['imported'], source[0]))
+            if self.db.use_sqlite:
+                session.execute("DROP TABLE temp.import_days")
+        result['committed'] = not dry_run
+
+        result['seconds'] = time.perf_counter() - started
+        result['rows_per_second'] = result['imported'] / result['seconds'] if result['seconds'] else 0.0
+        logger.info("Imported %d meals (%d rejected) in %.1fs, %.0f rows/s",
+                    result['imported'], result['rejected'], result['seconds'], result['rows_per_second'])
+        return result
+
+    def _claim_source(self, session, checksum, name):
+        previous = session.fetchone(
+            "SELECT source, row_count, imported_at FROM meal_imports WHERE checksum = ?", (checksum,)
+        )
+        if previous:
+            raise AlreadyImportedError(
+                f"this file was already imported on {previous[2]} as {previous[0]} ({previous[1]} meals)"
+            )
+        # Inserted up front: a concurrent import of the same file waits on this
+        # row and then fails on the primary key instead of loading it twice
+        session.execute(
+            "INSERT INTO meal_imports (checksum, source, row_count, imported_at) VALUES (?, ?, ?, ?)",
+            (checksum, name, 0, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+
+    def _create_days_table(self, session):
+        if self.db.use_sqlite:
+            # Left behind if an earlier import on this connection failed
+            session.execute("DROP TABLE IF EXISTS temp.import_days")
+            session.execute("""
+                CREATE TEMP TABLE import_days (phone_number TEXT, date TEXT, PRIMARY KEY (phone_number, date))
+            """)
+        else:
+            session.execute("""
+                CREATE TEMP TABLE import_days (phone_number TEXT, date DATE, PRIMARY KEY (phone_number, date))
+                ON COMMIT DROP
+            """)
+
+    def _flush(self, session, batch, result):
+        if not batch:
+            return
+        new_phones = {meal[0] for meal in batch} - result['phones']
+        if new_phones:
+            # executemany's rowcount is the total on both drivers
+            registered = session.executemany(
+                self.db.upsert_sql('authorized_users', ('phone_number',), conflict=('phone_number',)),
+                [(phone,) for phone in new_phones]
+            )
+            result['users_registered'] += max(registered, 0)
+            result['phones'] |= new_phones
+
+        session.copy_rows('meals', MEAL_COLUMNS, batch)
+        session.executemany(
+            "INSERT INTO import_days (phone_number, date) VALUES (?, ?) ON CONFLICT DO NOTHING",
+            list({(meal[0], meal[1]) for meal in batch})
+        )
+        result['imported'] += len(batch)
+        batch.clear()
+
+    def _rebuild_days(self, session):
+        """Recompute daily_tracking for every (user, date) the import touched"""
+        session.execute("""
+            DELETE FROM daily_tracking
+            WHERE EXISTS (
+                SELECT 1 FROM import_days d
+                WHERE d.phone_number = daily_tracking.phone_number AND d.date = daily_tracking.date
+            )
+        """)
+        return session.execute("""
+            INSERT INTO daily_tracking
+            (phone_number, date, total_calories, total_protein, total_carbs, total_fat)
+            SELECT m.phone_number, m.date, SUM(m.calories), SUM(m.protein), SUM(m.carbs), SUM(m.fat)
+            FROM import_days d
+            JOIN meals m ON m.phone_number = d.phone_number AND m.date = d.date
+            GROUP BY m.phone_number, m.date
+        """)
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def import_file(db, path, fmt=None, batch_size=5000, max_errors=100, dry_run=False):
+    """
+    Import a CSV/JSONL meal log; see MealImporter.run for the result.
+
+    Imports aren't idempotent row by row, so each file's checksum is
+    recorded and the same contents are refused a second time. Files that
+    overlap without being identical still duplicate the shared meals.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    importer = MealImporter(db, batch_size=batch_size, max_errors=max_errors)
+    source = (file_checksum(path), os.path.basename(path))
+    return importer.run(read_rows(path, fmt), dry_run=dry_run, source=source)
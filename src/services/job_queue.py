@@ -0,0 +1,101 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisJobQueue:
+    """
+    Bounded in-process job queue backed by a pool of worker threads.
+
+    Each job is passed to `handler`, whose return value is delivered to the
+    user through `sender`. A job whose handler raises one of the `retry_on`
+    exceptions is retried with exponential backoff; any other exception, or
+    running out of retries, fails the job at once and `on_failure` builds the
+    reply instead. `submit` returns False when the queue is full so the
+    caller can push back instead of piling up work.
+    """
+
+    def __init__(self, handler, sender, on_failure=None, workers=4, max_pending=50,
+                 max_retries=2, retry_backoff=2.0, retry_on=()):
+        self.handler = handler
+        self.sender = sender
+        self.on_failure = on_failure
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_on = tuple(retry_on)
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'retried': 0, 'failed': 0}
+
+    def submit(self, job):
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('submitted')
+        return True
+
+    def join(self):
+        """Block until every submitted job has been processed"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+    def _ensure_workers(self):
+        # Threads don't survive fork, so start them lazily inside each gunicorn worker
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"analysis-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            except Exception as e:
+                logger.exception("Error delivering job result: %s", e)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job):
+        for attempt in range(self.max_retries + 1):
+            try:
+                reply = self.handler(job)
+                self._count('completed')
+                break
+            except Exception as e:
+                if attempt == self.max_retries or not isinstance(e, self.retry_on):
+                    logger.error("Job failed after %d attempt(s): %s", attempt + 1, e)
+                    self._count('failed')
+                    reply = self.on_failure(job, e) if self.on_failure else None
+                    break
+                self._count('retried')
+                time.sleep(self.retry_backoff * (2 ** attempt))
+
+        if reply:
+            self.sender.send(job['phone_number'], reply, from_=job.get('reply_from'))
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
@@ -0,0 +1,129 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+
+# WhatsApp senders look like "whatsapp:+972501234567"; keep only the last 4 digits
+_PHONE_RE = re.compile(r'(?<!\d)\+?\d{9,15}(?!\d)')
+
+_listener = None
+_listener_pid = None
+
+
+def mask_phone_numbers(text):
+    """Replace phone numbers in text with a masked form such as +97250***4567"""
+    def mask(match):
+        number = match.group()
+        return f"{number[:-7]}***{number[-4:]}"
+    return _PHONE_RE.sub(mask, text)
+
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with `extra=` fields included"""
+
+    def __init__(self, mask_phones=True):
+        super().__init__()
+        self.mask_phones = mask_phones
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        return mask_phone_numbers(line) if self.mask_phones else line
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable format for local development"""
+
+    def __init__(self, mask_phones=True):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s')
+        self.mask_phones = mask_phones
+
+    def format(self, record):
+        line = super().format(record)
+        return mask_phone_numbers(line) if self.mask_phones else line
+
+
+class DebugSampler(logging.Filter):
+    """Lets through only a `rate` fraction of DEBUG records; other levels always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class _PreformattingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting (JSON encoding, masking) to the
+    listener thread; only the message arguments are merged here, so the
+    record is safe to hand over.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging():
+    """
+    Route all logging through a non-blocking queue to stdout.
+
+    Callers only pay for putting a record on an in-memory queue; a listener
+    thread does the formatting and the (blocking) write. Settings:
+    LOG_LEVEL (default INFO), LOG_FORMAT (json or text, default json),
+    LOG_DEBUG_SAMPLE_RATE (fraction of DEBUG records kept, default 1) and
+    LOG_MASK_PHONES (default on). Safe to call more than once; the listener
+    is restarted in a forked worker.
+    """
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    mask_phones = os.getenv('LOG_MASK_PHONES', '1').lower() not in ('0', 'false', 'no')
+    if os.getenv('LOG_FORMAT', 'json').lower() == 'text':
+        formatter = TextFormatter(mask_phones=mask_phones)
+    else:
+        formatter = JsonFormatter(mask_phones=mask_phones)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _PreformattingQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1))))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(_listener.stop)
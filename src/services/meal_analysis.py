@@ -0,0 +1,103 @@
+import json
+from dataclasses import dataclass, field
+from typing import List
+
+MACROS = ('calories', 'protein', 'carbs', 'fat')
+
+# JSON schema the model must follow in structured output mode
+MEAL_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "Food name in Hebrew"},
+                    "quantity": {"type": "string", "description": "Estimated quantity in Hebrew"},
+                    "calories": {"type": "number"},
+                    "protein": {"type": "number", "description": "grams"},
+                    "carbs": {"type": "number", "description": "grams"},
+                    "fat": {"type": "number", "description": "grams"}
+                },
+                "required": ["name", "quantity", "calories", "protein", "carbs", "fat"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["items"],
+    "additionalProperties": False
+}
+
+
+@dataclass
+class FoodItem:
+    name: str
+    quantity: str
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+
+
+@dataclass
+class MealAnalysis:
+    items: List[FoodItem] = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, raw: str) -> 'MealAnalysis':
+        """Parse and validate the model's JSON output; raises ValueError if it is unusable"""
+        try:
+            data = json.loads(raw)
+        except (TypeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Response is not valid JSON: {e}")
+
+        items = data.get('items') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            raise ValueError("Response contains no food items")
+
+        parsed = []
+        for item in items:
+            if not isinstance(item, dict) or not str(item.get('name', '')).strip():
+                raise ValueError(f"Invalid food item: {item!r}")
+            values = {}
+            for macro in MACROS:
+                value = item.get(macro)
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    raise ValueError(f"Invalid {macro} for {item.get('name')!r}: {value!r}")
+                values[macro] = float(value)
+            parsed.append(FoodItem(
+                name=str(item['name']).strip(),
+                quantity=str(item.get('quantity', '')).strip(),
+                **values
+            ))
+        return cls(items=parsed)
+
+    def totals(self) -> dict:
+        """Whole-unit totals across all items, matching the meals schema"""
+        return {macro: int(round(sum(getattr(item, macro) for item in self.items))) for macro in MACROS}
+
+    def to_nutrition(self) -> dict:
+        """Same shape as parse_nutrition's result"""
+        nutrition = self.totals()
+        nutrition['food_items'] = [self._describe(item) for item in self.items]
+        return nutrition
+
+    def to_analysis_text(self) -> str:
+        """Hebrew summary in the same layout as the free-form model output"""
+        totals = self.totals()
+        lines = ["מנות:"]
+        lines.extend(f"- {self._describe(item)}" for item in self.items)
+        lines.extend([
+            "",
+            "### ערכים תזונתיים:",
+            f"- **קלוריות**: {totals['calories']}",
+            f"- **חלבון**: {totals['protein']} גרם",
+            f"- **פחמימה**: {totals['carbs']} גרם",
+            f"- **שומן**: {totals['fat']} גרם"
+        ])
+        return "\n".join(lines)
+
+    @staticmethod
+    def _describe(item):
+        return f"{item.name} ({item.quantity})" if item.quantity else item.name
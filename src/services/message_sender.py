@@ -0,0 +1,58 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TwilioMessageSender:
+    """Deliver outbound WhatsApp/SMS messages through the Twilio REST API"""
+
+    def __init__(self, account_sid=None, auth_token=None, default_from=None):
+        self.account_sid = account_sid or os.getenv('TWILIO_ACCOUNT_SID')
+        self.auth_token = auth_token or os.getenv('TWILIO_AUTH_TOKEN')
+        self.default_from = default_from or os.getenv('TWILIO_FROM_NUMBER')
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        # The REST client is created lazily so importing the app never needs credentials
+        with self._lock:
+            if self._client is None:
+                from twilio.rest import Client
+                self._client = Client(self.account_sid, self.auth_token)
+            return self._client
+
+    def send(self, to, body, from_=None):
+        message = self._get_client().messages.create(
+            to=to,
+            from_=from_ or self.default_from,
+            body=body
+        )
+        return message.sid
+
+
+class LocalMessageSender:
+    """
+    Stand-in sender for local development and offline testing.
+
+    Messages are kept in memory (and printed) instead of being sent.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, to, body, from_=None):
+        with self._lock:
+            self.sent.append({'to': to, 'from': from_, 'body': body})
+            sid = f"local-{len(self.sent)}"
+        logger.info("[LocalMessageSender] %s to %s: %s", sid, to, body)
+        return sid
+
+
+def create_message_sender():
+    """Pick the outbound sender based on the MESSAGE_SENDER environment variable"""
+    if os.getenv('MESSAGE_SENDER', 'twilio').lower() == 'local':
+        return LocalMessageSender()
+    return TwilioMessageSender()
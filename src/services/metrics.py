@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+PREFIX = 'foodbot'
+
+# Seconds; spans range from sub-millisecond cache lookups to multi-second model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+class Histogram:
+    """Thread-safe latency histogram with Prometheus-style cumulative buckets"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = f'{PREFIX}_{name}'
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, list(counts), total, count) for key, (counts, total, count) in self._series.items())
+        for key, counts, total, count in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+# Time spent in named steps of request handling (download, model call, DB writes...)
+SPAN_SECONDS = Histogram('span_seconds', 'Duration of instrumented operations', labelnames=('span',))
+# End-to-end HTTP request latency
+REQUEST_SECONDS = Histogram('request_seconds', 'HTTP request latency', labelnames=('route', 'status'))
+# Text command handling, per router entry
+COMMAND_SECONDS = Histogram('command_seconds', 'Text command handling latency', labelnames=('command',))
+
+_histograms = [SPAN_SECONDS, REQUEST_SECONDS, COMMAND_SECONDS]
+_collectors = []
+
+# Spans recorded during the current request, when tracing was requested
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+def start_trace():
+    _trace.set([])
+
+
+def end_trace():
+    """Stop tracing and return the recorded [(span, seconds)] in order"""
+    spans = _trace.get()
+    _trace.set(None)
+    return spans or []
+
+
+def _record_span(span, elapsed):
+    SPAN_SECONDS.observe(elapsed, span=span)
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((span, elapsed))
+
+
+class timed:
+    """
+    Time a block into SPAN_SECONDS and the current trace. Also works as a
+    decorator, for plain and async functions.
+    """
+
+    def __init__(self, span):
+        self.span = span
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record_span(self.span, time.perf_counter() - self._start)
+
+    def __call__(self, func):
+        span = self.span
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _record_span(span, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record_span(span, time.perf_counter() - start)
+        return wrapper
+
+
+def register_stats(name, stats_fn, **labels):
+    """
+    Expose a component's stats() dict as gauges named foodbot_<name>_<key>.
+
+    Numeric values become gauges; string values (such as a circuit breaker
+    state) become a gauge of 1 with the value as a label.
+    """
+    _collectors.append((name, stats_fn, tuple(sorted(labels.items()))))
+
+
+def _collect_gauges():
+    gauges = {}
+    for name, stats_fn, labels in _collectors:
+        try:
+            stats = stats_fn() or {}
+        except Exception:
+            continue
+        for key, value in stats.items():
+            metric = f'{PREFIX}_{name}_{key}'
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                gauges.setdefault(metric, []).append((list(labels), value))
+            elif isinstance(value, str):
+                gauges.setdefault(metric, []).append((list(labels) + [(key, value)], 1))
+    return gauges
+
+
+def render_prometheus():
+    """
+    All metrics in the Prometheus text exposition format.
+
+    Metrics are per process, so with several gunicorn workers each scrape
+    sees the worker that answered it.
+    """
+    lines = []
+    for histogram in _histograms:
+        lines.extend(histogram.render())
+    for metric, samples in sorted(_collect_gauges().items()):
+        lines.append(f'# TYPE {metric} gauge')
+        for labels, value in samples:
+            lines.append(f'{metric}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,369 @@
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _add_column_if_missing(table, column, definition):
+    """SQLite has no ADD COLUMN IF NOT EXISTS; a step that checks the table first"""
+    def step(cursor):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+# Each migration is (version, name, {backend: [statements]}). A statement is
+# SQL or a function taking the cursor, for steps plain SQL can't guard.
+# Migrations are applied in order, once, and recorded in schema_migrations,
+# and must also succeed on a database created from the schema files. Never
+# edit a migration that has shipped; add a new one instead.
+MIGRATIONS = [
+    (1, 'base_schema', {
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS authorized_users (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              phone_number TEXT UNIQUE NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS meals (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              phone_number TEXT NOT NULL,
+              date TEXT NOT NULL,
+              meal_time TEXT NOT NULL,
+              food_items TEXT NOT NULL,
+              calories INTEGER,
+              protein INTEGER,
+              carbs INTEGER,
+              fat INTEGER,
+              image_url TEXT,
+              analysis_text TEXT,
+              FOREIGN KEY (phone_number) REFERENCES authorized_users(phone_number)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS user_goals (
+              phone_number TEXT PRIMARY KEY,
+              calories INTEGER,
+              protein INTEGER,
+              carbs INTEGER,
+              fat INTEGER,
+              FOREIGN KEY (phone_number) REFERENCES authorized_users(phone_number)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS daily_tracking (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              phone_number TEXT,
+              date TEXT,
+              total_calories REAL,
+              total_protein REAL,
+              total_carbs REAL,
+              total_fat REAL,
+              FOREIGN KEY (phone_number) REFERENCES authorized_users(phone_number)
+            )
+            """,
+        ],
+        'postgres': [
+            """
+            CREATE TABLE IF NOT EXISTS authorized_users (
+              id SERIAL PRIMARY KEY,
+              phone_number TEXT UNIQUE NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS meals (
+              id SERIAL PRIMARY KEY,
+              phone_number TEXT NOT NULL,
+              date TEXT NOT NULL,
+              meal_time TEXT NOT NULL,
+              food_items TEXT NOT NULL,
+              calories INTEGER,
+              protein INTEGER,
+              carbs INTEGER,
+              fat INTEGER,
+              image_url TEXT,
+              analysis_text TEXT,
+              FOREIGN KEY (phone_number) REFERENCES authorized_users(phone_number)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS user_goals (
+              phone_number TEXT PRIMARY KEY,
+              calories INTEGER,
+              protein INTEGER,
+              carbs INTEGER,
+              fat INTEGER
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS daily_tracking (
+              id SERIAL PRIMARY KEY,
+              phone_number TEXT,
+              date TEXT,
+              total_calories REAL,
+              total_protein REAL,
+              total_carbs REAL,
+              total_fat REAL,
+              FOREIGN KEY (phone_number) REFERENCES authorized_users(phone_number)
+            )
+            """,
+        ],
+    }),
+    (2, 'meals_and_daily_tracking_indexes', {
+        'sqlite': [
+            # Concurrent writers left several partial rollup rows for some days;
+            # rebuild those days from meals before adding the unique key
+            """
+            CREATE TEMP TABLE duplicate_days AS
+            SELECT phone_number, date FROM daily_tracking
+            GROUP BY phone_number, date HAVING COUNT(*) > 1
+            """,
+            """
+            DELETE FROM daily_tracking
+            WHERE EXISTS (
+                SELECT 1 FROM duplicate_days d
+                WHERE d.phone_number = daily_tracking.phone_number AND d.date = daily_tracking.date
+            )
+            """,
+            """
+            INSERT INTO daily_tracking
+            (phone_number, date, total_calories, total_protein, total_carbs, total_fat)
+            SELECT m.phone_number, m.date, SUM(m.calories), SUM(m.protein), SUM(m.carbs), SUM(m.fat)
+            FROM duplicate_days d
+            JOIN meals m ON m.phone_number = d.phone_number AND m.date = d.date
+            GROUP BY m.phone_number, m.date
+            """,
+            "DROP TABLE duplicate_days",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_tracking_phone_date ON daily_tracking (phone_number, date)",
+            "CREATE INDEX IF NOT EXISTS idx_meals_phone_date ON meals (phone_number, date)",
+        ],
+        'postgres': [
+            # Concurrent writers left several partial rollup rows for some days;
+            # rebuild those days from meals before adding the unique key
+            """
+            CREATE TEMP TABLE duplicate_days AS
+            SELECT phone_number, date FROM daily_tracking
+            GROUP BY phone_number, date HAVING COUNT(*) > 1
+            """,
+            """
+            DELETE FROM daily_tracking
+            WHERE EXISTS (
+                SELECT 1 FROM duplicate_days d
+                WHERE d.phone_number = daily_tracking.phone_number AND d.date = daily_tracking.date
+            )
+            """,
+            """
+            INSERT INTO daily_tracking
+            (phone_number, date, total_calories, total_protein, total_carbs, total_fat)
+            SELECT m.phone_number, m.date, SUM(m.calories), SUM(m.protein), SUM(m.carbs), SUM(m.fat)
+            FROM duplicate_days d
+            JOIN meals m ON m.phone_number = d.phone_number AND m.date = d.date
+            GROUP BY m.phone_number, m.date
+            """,
+            "DROP TABLE duplicate_days",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_tracking_phone_date ON daily_tracking (phone_number, date)",
+            "CREATE INDEX IF NOT EXISTS idx_meals_phone_date ON meals (phone_number, date)",
+        ],
+    }),
+    (3, 'conversation_state', {
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS conversation_state (
+              phone_number TEXT PRIMARY KEY,
+              state TEXT NOT NULL,
+              version INTEGER NOT NULL,
+              expires_at REAL NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_conversation_state_expiry ON conversation_state (expires_at)",
+        ],
+        'postgres': [
+            """
+            CREATE TABLE IF NOT EXISTS conversation_state (
+              phone_number TEXT PRIMARY KEY,
+              state TEXT NOT NULL,
+              version INTEGER NOT NULL,
+              expires_at DOUBLE PRECISION NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_conversation_state_expiry ON conversation_state (expires_at)",
+        ],
+    }),
+    (4, 'user_timezones_and_native_dates', {
+        # NULL timezone means "derive it from the phone's country code".
+        # SQLite has no date types; its ISO-8601 TEXT dates already sort and
+        # compare correctly through the (phone_number, date) indexes.
+        'sqlite': [
+            _add_column_if_missing('authorized_users', 'timezone', 'TEXT'),
+        ],
+        'postgres': [
+            "ALTER TABLE authorized_users ADD COLUMN IF NOT EXISTS timezone TEXT",
+            """
+            ALTER TABLE meals
+              ALTER COLUMN date TYPE DATE USING date::date,
+              ALTER COLUMN meal_time TYPE TIMESTAMP USING meal_time::timestamp
+            """,
+            "ALTER TABLE daily_tracking ALTER COLUMN date TYPE DATE USING date::date",
+        ],
+    }),
+    (5, 'meal_imports', {
+        # One row per imported file, so the same file can't be loaded twice
+        'sqlite': [
+            """
+            CREATE TABLE IF NOT EXISTS meal_imports (
+              checksum TEXT PRIMARY KEY,
+              source TEXT NOT NULL,
+              row_count INTEGER NOT NULL,
+              imported_at TEXT NOT NULL
+            )
+            """,
+        ],
+        'postgres': [
+            """
+            CREATE TABLE IF NOT EXISTS meal_imports (
+              checksum TEXT PRIMARY KEY,
+              source TEXT NOT NULL,
+              row_count INTEGER NOT NULL,
+              imported_at TEXT NOT NULL
+            )
+            """,
+        ],
+    }),
+]
+
+# Queries on the request path, with the index each one is expected to use
+HOT_QUERIES = [
+    (
+        'daily_progress',
+        """
+        SELECT total_calories, total_protein, total_carbs, total_fat
+        FROM daily_tracking
+        WHERE phone_number = {p} AND date = {p}
+        """,
+        ('whatsapp:+10000000000', '2024-01-01'),
+        'idx_daily_tracking_phone_date'
+    ),
+    (
+        'daily_rollup',
+        """
+        SELECT SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+        FROM meals
+        WHERE phone_number = {p} AND date = {p}
+        """,
+        ('whatsapp:+10000000000', '2024-01-01'),
+        'idx_meals_phone_date'
+    ),
+    (
+        'range_summary',
+        """
+        SELECT date, SUM(total_calories), SUM(total_protein), SUM(total_carbs), SUM(total_fat)
+        FROM daily_tracking
+        WHERE phone_number = {p} AND date BETWEEN {p} AND {p}
+        GROUP BY date
+        ORDER BY date
+        """,
+        ('whatsapp:+10000000000', '2024-01-01', '2024-01-31'),
+        'idx_daily_tracking_phone_date'
+    ),
+]
+
+
+# pg_advisory_xact_lock key serializing apply_migrations across workers
+MIGRATION_LOCK_ID = 42420001
+
+
+def _backend(use_sqlite):
+    return 'sqlite' if use_sqlite else 'postgres'
+
+
+def apply_migrations(pool, use_sqlite):
+    """
+    Bring the database schema up to date. Returns the list of versions applied.
+
+    Safe to call from every gunicorn worker at startup: migrations run under
+    a lock taken before anything else (even creating schema_migrations), so
+    only the first worker does any work.
+    """
+    backend = _backend(use_sqlite)
+    placeholder = '?' if use_sqlite else '%s'
+    conn = pool.getconn()
+    applied = []
+    try:
+        cursor = conn.cursor()
+        if not use_sqlite:
+            # Held until the commit below. Concurrent CREATE TABLE IF NOT EXISTS
+            # on a fresh PostgreSQL database can still fail on pg_type's unique
+            # index, so the lock has to come before it.
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        """)
+        if use_sqlite:
+            conn.commit()
+            cursor.execute("BEGIN IMMEDIATE")
+
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cursor.fetchall()}
+
+        for version, name, statements in MIGRATIONS:
+            if version in done:
+                continue
+            for statement in statements[backend]:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(
+                f"INSERT INTO schema_migrations (version, name, applied_at) "
+                f"VALUES ({placeholder}, {placeholder}, {placeholder})",
+                (version, name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            )
+            applied.append(version)
+            logger.info("Applied migration %s: %s", version, name)
+
+        conn.commit()
+        return applied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def check_query_plans(pool, use_sqlite):
+    """
+    Explain every hot query and report whether it uses its expected index.
+
+    Returns a list of (name, uses_index, plan_text).
+    """
+    placeholder = '?' if use_sqlite else '%s'
+    conn = pool.getconn()
+    results = []
+    try:
+        cursor = conn.cursor()
+        if not use_sqlite:
+            # Small tables make sequential scans look cheaper; we only care
+            # whether the index is usable for these predicates
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+        for name, query, params, index in HOT_QUERIES:
+            query = query.format(p=placeholder)
+            if use_sqlite:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+            else:
+                cursor.execute(f"EXPLAIN {query}", params)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            results.append((name, index in plan, plan))
+
+        conn.rollback()
+        return results
+    finally:
+        pool.putconn(conn)
@@ -0,0 +1,109 @@
+import re
+
+# Nutrient keywords as the model writes them, mapped to our field names
+_KEYWORDS = {
+    'קלוריות': 'calories',
+    'קלוריה': 'calories',
+    'קק"ל': 'calories',
+    'קק״ל': 'calories',
+    'חלבון': 'protein',
+    'חלבונים': 'protein',
+    'פחמימה': 'carbs',
+    'פחמימות': 'carbs',
+    'שומן': 'fat',
+    'שומנים': 'fat',
+}
+
+_KEYWORD_ALTERNATION = '|'.join(sorted((re.escape(k) for k in _KEYWORDS), key=len, reverse=True))
+# "1,050" is a thousands separator, "12,5" a decimal comma
+_NUMBER = r'\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:[.,]\d+)?'
+_THOUSANDS_RE = re.compile(r'\d{1,3}(?:,\d{3})+(?:\.\d+)?')
+
+# One scan over the whole text finds bullet markers and nutrient keywords,
+# together with the value that follows a keyword: "**: כ-300-400 קק״ל",
+# ": 25.5 גרם", " ~12g"
+_TOKEN_RE = re.compile(
+    rf'^[ \t]*-|(?P<key>{_KEYWORD_ALTERNATION})'
+    rf'(?:(?:\*\*)?[ \t]*:?[ \t]*(?:\*\*)?[ \t]*(?:כ-?|~|≈|בערך[ \t]*|about[ \t]*)?'
+    rf'(?P<low>{_NUMBER})(?:[ \t]*[-–][ \t]*(?P<high>{_NUMBER}))?)?',
+    re.MULTILINE
+)
+# "סה״כ: 450 קלוריות" - number before the unit, for calories only
+_CALORIES_AFTER_RE = re.compile(
+    rf'(?P<low>{_NUMBER})(?:[ \t]*[-–][ \t]*(?P<high>{_NUMBER}))?[ \t]*(?:קלוריות|קק"ל|קק״ל|kcal)'
+)
+
+
+def _to_float(text):
+    if ',' not in text:
+        return float(text)
+    if _THOUSANDS_RE.fullmatch(text):
+        return float(text.replace(',', ''))
+    return float(text.replace(',', '.'))
+
+
+def _to_number(low, high):
+    """Midpoint of a range, rounded to whole units to match the meals schema"""
+    value = _to_float(low)
+    if high is not None:
+        value = (value + _to_float(high)) / 2
+    return int(round(value))
+
+
+def parse_nutrition(analysis_text):
+    """
+    Extract macros and food items from the model's Hebrew analysis in one pass.
+
+    Bold "**keyword**: value" entries win over plain mentions of the same
+    nutrient; otherwise the first mention counts. Ranges use their midpoint.
+    A "450 קלוריות"-style total is only used when no calories were found
+    after a keyword. Food items are the bullet lines that don't mention a
+    nutrient.
+    """
+    bold = {}
+    plain = {}
+    food_items = []
+    bullet = None  # (start, end) of the current bullet line while it still looks like food
+
+    for token in _TOKEN_RE.finditer(analysis_text):
+        key = token.group('key')
+        if key is None:
+            # A new bullet line; the previous one had no nutrient in it
+            if bullet is not None:
+                _add_food_item(food_items, analysis_text, bullet)
+            end = analysis_text.find('\n', token.end())
+            bullet = (token.end(), end if end >= 0 else len(analysis_text))
+            continue
+
+        start = token.start()
+        if bullet is not None and start < bullet[1]:
+            bullet = None
+
+        low = token.group('low')
+        if low is not None:
+            target = bold if analysis_text.endswith('**', 0, start) else plain
+            field = _KEYWORDS[key]
+            if field not in target:
+                target[field] = _to_number(low, token.group('high'))
+
+    if bullet is not None:
+        _add_food_item(food_items, analysis_text, bullet)
+
+    nutrition = {
+        'calories': bold.get('calories', plain.get('calories', 0)),
+        'protein': bold.get('protein', plain.get('protein', 0)),
+        'carbs': bold.get('carbs', plain.get('carbs', 0)),
+        'fat': bold.get('fat', plain.get('fat', 0)),
+        'food_items': food_items
+    }
+    if not nutrition['calories']:
+        match = _CALORIES_AFTER_RE.search(analysis_text)
+        if match:
+            nutrition['calories'] = _to_number(match.group('low'), match.group('high'))
+    return nutrition
+
+
+def _add_food_item(food_items, text, span):
+    food = text[span[0]:span[1]].strip('- ').strip()
+    if food:
+        food_items.append(food)
@@ -1,43 +1,46 @@
+import logging
 import os
 import json
-from datetime import date, datetime
-import psycopg2
-import sqlite3
+from datetime import timedelta
+from services.cache import MISSING, create_cache
+from services.db import get_database
+from services.metrics import timed
+from services.timezones import UserTimezones
 
+logger = logging.getLogger(__name__)
 
-class NutritionService:
-    def __init__(self):
-        self.db_url = os.environ.get('DATABASE_URL')
-        self.use_sqlite = not self.db_url
-        if self.use_sqlite:
-            self.db_path = 'nutrition.db'
-            print(f"NutritionService initialized with SQLite: {self.db_path}")
-        else:
-            print(f"NutritionService initialized with PostgreSQL: {self.db_url}")
-
-    def _get_connection(self):
-        """Get database connection based on environment"""
-        if self.use_sqlite:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # This makes rows accessible by column name
-            # Enable foreign keys
-            conn.execute('PRAGMA foreign_keys = ON')
-            return conn
-        else:
-            return psycopg2.connect(self.db_url)
 
+class NutritionService:
+    def __init__(self, db=None):
+        self.db = db or get_database()
+        self.pool = self.db.pool
+        self.use_sqlite = self.db.use_sqlite
+        logger.info("NutritionService initialized with %s", self.db.description)
+
+        # Meals are bucketed into days in each user's own time zone
+        self.timezones = UserTimezones(self.db)
+
+        # Range reports per user, keyed by "<days>:<end date>"; dropped whenever
+        # the user logs a meal, and shared between workers so the drop reaches
+        # all of them and a cached report is never stale
+        self.report_cache = create_cache(
+            'reports',
+            max_size=int(os.environ.get('REPORT_CACHE_SIZE', 10000)),
+            ttl=float(os.environ.get('REPORT_CACHE_TTL', 86400)),
+            shared=True
+        )
+
+    @timed('log_meal')
     def log_meal(self, phone_number, meal_data):
-        conn = None
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            current_date = date.today().isoformat()
-
-            # Insert meal data
-            if self.use_sqlite:
-                cursor.execute("""
+            now = self.timezones.now(phone_number)
+            current_time = now.strftime('%Y-%m-%d %H:%M:%S')
+            current_date = now.date().isoformat()
+            rollup = tuple(meal_data.get(key) or 0 for key in ('calories', 'protein', 'carbs', 'fat'))
+
+            with self.db.transaction() as session:
+                # Insert meal data
+                session.execute("""
                     INSERT INTO meals (
                         phone_number, date, meal_time, food_items, 
                         calories, protein, carbs, fat, analysis_text
@@ -54,164 +57,78 @@ class NutritionService:
                     meal_data.get('analysis_text', '')
                 ))
 
-                # Update daily tracking - first delete existing
-                cursor.execute("""
-                    DELETE FROM daily_tracking 
-                    WHERE phone_number = ? AND date = ?
-                """, (phone_number, current_date))
-
-                # Calculate new totals from all meals
-                cursor.execute("""
+                # Add this meal to the day's rollup row in the same transaction
+                session.execute("""
                     INSERT INTO daily_tracking 
                     (phone_number, date, total_calories, total_protein, total_carbs, total_fat)
-                    SELECT 
-                        ?, 
-                        ?, 
-                        SUM(calories),
-                        SUM(protein),
-                        SUM(carbs),
-                        SUM(fat)
-                    FROM meals 
-                    WHERE phone_number = ? AND date = ?
-                """, (phone_number, current_date, phone_number, current_date))
-            else:
-                # PostgreSQL version
-                cursor.execute("""
-                    INSERT INTO meals (
-                        phone_number, date, meal_time, food_items, 
-                        calories, protein, carbs, fat, analysis_text
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    phone_number,
-                    current_date,
-                    current_time,
-                    json.dumps(meal_data.get('food_items', []), ensure_ascii=False),
-                    meal_data.get('calories', 0),
-                    meal_data.get('protein', 0),
-                    meal_data.get('carbs', 0),
-                    meal_data.get('fat', 0),
-                    meal_data.get('analysis_text', '')
-                ))
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (phone_number, date) DO UPDATE SET
+                        total_calories = COALESCE(daily_tracking.total_calories, 0) + excluded.total_calories,
+                        total_protein = COALESCE(daily_tracking.total_protein, 0) + excluded.total_protein,
+                        total_carbs = COALESCE(daily_tracking.total_carbs, 0) + excluded.total_carbs,
+                        total_fat = COALESCE(daily_tracking.total_fat, 0) + excluded.total_fat
+                """, (phone_number, current_date, *rollup))
+
+            self.report_cache.delete(phone_number)
+            return True
 
-                # Update daily tracking to sum ALL meals for the day
-                cursor.execute("""
-                    DELETE FROM daily_tracking 
-                    WHERE phone_number = %s AND date = %s
-                """, (phone_number, current_date))
+        except Exception as e:
+            logger.exception("Error logging meal: %s", e)
+            return False
 
-                cursor.execute("""
-                    INSERT INTO daily_tracking 
+    def rebuild_daily_tracking(self, start_date, end_date, phone_number=None):
+        """
+        Recompute daily_tracking from meals for every day in [start_date, end_date].
+
+        Used to reconcile the incremental rollup after imports, manual fixes or
+        suspected drift. Returns the number of rollup rows written, or None on error.
+        """
+        try:
+            params = [start_date, end_date]
+            user_filter = ''
+            if phone_number:
+                user_filter = ' AND phone_number = ?'
+                params.append(phone_number)
+
+            with self.db.transaction() as session:
+                session.execute(f"""
+                    DELETE FROM daily_tracking
+                    WHERE date BETWEEN ? AND ?{user_filter}
+                """, params)
+
+                rebuilt = session.execute(f"""
+                    INSERT INTO daily_tracking
                     (phone_number, date, total_calories, total_protein, total_carbs, total_fat)
-                    SELECT 
-                        %s, 
-                        %s, 
-                        SUM(calories),
-                        SUM(protein),
-                        SUM(carbs),
-                        SUM(fat)
-                    FROM meals 
-                    WHERE phone_number = %s AND date = %s
-                """, (phone_number, current_date, phone_number, current_date))
-
-            conn.commit()
-            return True
+                    SELECT phone_number, date, SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+                    FROM meals
+                    WHERE date BETWEEN ? AND ?{user_filter}
+                    GROUP BY phone_number, date
+                """, params)
+
+            if phone_number:
+                self.report_cache.delete(phone_number)
+            else:
+                self.report_cache.clear()
+            return rebuilt
 
         except Exception as e:
-            print(f"Error logging meal: {str(e)}")
-            if conn:
-                conn.rollback()
-            return False
-        finally:
-            if conn:
-                conn.close()
+            logger.exception("Database error in rebuild_daily_tracking: %s", e)
+            return None
 
+    @timed('get_daily_progress')
     def get_daily_progress(self, phone_number):
-        conn = None
         try:
-            print(f"\n=== Debug: Getting daily progress for {phone_number} ===")
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            today = date.today().isoformat()
-            print(f"\nToday's date (ISO format): {today}")
-
-            # Progress query with totals
-            if self.use_sqlite:
-                # Check all meals in database (SQLite)
-                cursor.execute("SELECT date, calories, protein, carbs, fat FROM meals")
-                all_meals = cursor.fetchall()
-                print(f"All meals: {[dict(row) for row in all_meals] if all_meals else []}")
-
-                # Check today's meals (SQLite)
-                cursor.execute("""
-                    SELECT date, calories, protein, carbs, fat 
-                    FROM meals 
-                    WHERE phone_number = ? AND date = ?
-                """, (phone_number, today))
-                todays_meals = cursor.fetchall()
-                print(f"\nToday's meals: {[dict(row) for row in todays_meals] if todays_meals else []}")
-
-                # Get totals (SQLite)
-                progress_query = """
-                SELECT 
-                    COALESCE(SUM(calories), 0) as total_calories,
-                    COALESCE(SUM(protein), 0) as total_protein,
-                    COALESCE(SUM(carbs), 0) as total_carbs,
-                    COALESCE(SUM(fat), 0) as total_fat
-                FROM meals
+            today = self.timezones.today(phone_number).isoformat()
+
+            # Served from the daily_tracking rollup that log_meal maintains,
+            # so the cost doesn't grow with the size of the meals table
+            result = self.db.fetchone("""
+                SELECT total_calories, total_protein, total_carbs, total_fat
+                FROM daily_tracking
                 WHERE phone_number = ? AND date = ?
-                """
-
-                cursor.execute(progress_query, (phone_number, today))
-                result = cursor.fetchone()
-
-                if result:
-                    # Convert row to dict
-                    result_dict = dict(result)
-                    totals = {
-                        "totals": {
-                            "calories": float(result_dict['total_calories']),
-                            "protein": float(result_dict['total_protein']),
-                            "carbs": float(result_dict['total_carbs']),
-                            "fat": float(result_dict['total_fat'])
-                        }
-                    }
-                else:
-                    totals = {
-                        "totals": {
-                            "calories": 0,
-                            "protein": 0,
-                            "carbs": 0,
-                            "fat": 0
-                        }
-                    }
-            else:
-                # PostgreSQL version
-                cursor.execute("SELECT date, calories, protein, carbs, fat FROM meals")
-                all_meals = cursor.fetchall()
-                print(f"All meals: {all_meals}")
-
-                cursor.execute("""
-                    SELECT date, calories, protein, carbs, fat 
-                    FROM meals 
-                    WHERE phone_number = %s AND date = %s
-                """, (phone_number, today))
-                todays_meals = cursor.fetchall()
-                print(f"\nToday's meals: {todays_meals}")
-
-                progress_query = """
-                SELECT 
-                    COALESCE(SUM(calories), 0) as total_calories,
-                    COALESCE(SUM(protein), 0) as total_protein,
-                    COALESCE(SUM(carbs), 0) as total_carbs,
-                    COALESCE(SUM(fat), 0) as total_fat
-                FROM meals
-                WHERE phone_number = %s AND date = %s
-                """
-
-                cursor.execute(progress_query, (phone_number, today))
-                result = cursor.fetchone()
+            """, (phone_number, today))
 
+            if result:
                 totals = {
                     "totals": {
                         "calories": float(result[0]) if result[0] else 0,
@@ -220,13 +137,72 @@ class NutritionService:
                         "fat": float(result[3]) if result[3] else 0
                     }
                 }
+            else:
+                totals = {
+                    "totals": {
+                        "calories": 0,
+                        "protein": 0,
+                        "carbs": 0,
+                        "fat": 0
+                    }
+                }
 
-            print(f"Returning totals: {totals}")
+            logger.debug("Daily progress for %s on %s: %s", phone_number, today, totals)
             return totals
 
         except Exception as e:
-            print(f"Database error in get_daily_progress: {e}")
+            logger.exception("Database error in get_daily_progress: %s", e)
             return None
-        finally:
-            if conn:
-                conn.close()
\ No newline at end of file
+
+    @timed('get_range_summary')
+    def get_range_summary(self, phone_number, days):
+        """
+        Per-day totals plus period totals and averages for the last `days` days
+        (today included), from one grouped query over daily_tracking.
+
+        Averages are over the days that have meals logged. Returns None on error.
+        """
+        end = self.timezones.today(phone_number)
+        start = end - timedelta(days=days - 1)
+        period = f"{days}:{end.isoformat()}"
+
+        # Taken before reading anything, so a log_meal that invalidates the
+        # user's reports while this one is built stops it from being cached
+        generation = self.report_cache.generation(phone_number)
+        reports = self.report_cache.get(phone_number)
+        if reports is not MISSING and period in reports:
+            return reports[period]
+
+        try:
+            rows = self.db.fetchall("""
+                SELECT date, SUM(total_calories), SUM(total_protein), SUM(total_carbs), SUM(total_fat)
+                FROM daily_tracking
+                WHERE phone_number = ? AND date BETWEEN ? AND ?
+                GROUP BY date
+                ORDER BY date
+            """, (phone_number, start.isoformat(), end.isoformat()))
+        except Exception as e:
+            logger.exception("Database error in get_range_summary: %s", e)
+            return None
+
+        nutrients = ('calories', 'protein', 'carbs', 'fat')
+        daily = [
+            dict(date=row[0], **{n: float(value or 0) for n, value in zip(nutrients, row[1:])})
+            for row in rows
+        ]
+        totals = {n: sum(day[n] for day in daily) for n in nutrients}
+        summary = {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'days': days,
+            'logged_days': len(daily),
+            'daily': daily,
+            'totals': totals,
+            'averages': {n: totals[n] / len(daily) if daily else 0 for n in nutrients}
+        }
+
+        if reports is MISSING:
+            reports = {}
+        reports[period] = summary
+        self.report_cache.set(phone_number, reports, generation=generation)
+        return summary
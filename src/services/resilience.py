@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised instead of calling an upstream service that is overloaded or failing"""
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """Raised when the circuit breaker is rejecting calls"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`, so short
+    bursts are allowed while the sustained rate stays bounded.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.rejections = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self):
+        """Take a token if one is available; otherwise return the seconds until one is"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def _reject(self):
+        with self._lock:
+            self.rejections += 1
+        return False
+
+    def acquire(self, timeout=0.0):
+        """Take one token, waiting up to `timeout` seconds; returns False if none became available"""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return self._reject()
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout=0.0):
+        """acquire() for event-loop code: waits with asyncio.sleep instead of blocking"""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return self._reject()
+            await asyncio.sleep(wait)
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {'tokens': round(self._tokens, 2), 'rate': self.rate, 'rejections': self.rejections}
+
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream service is degraded.
+
+    After `failure_threshold` consecutive failures the circuit opens and every
+    call is rejected for `reset_timeout` seconds. It then goes half-open and
+    lets a single trial call through: success closes the circuit, failure
+    opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        self._stats = {'opens': 0, 'half_opens': 0, 'rejections': 0, 'failures': 0, 'successes': 0}
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not go through"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self._stats['rejections'] += 1
+                    raise CircuitOpenError("Circuit is open")
+                self.state = self.HALF_OPEN
+                self._stats['half_opens'] += 1
+                self._trial_running = False
+
+            if self.state == self.HALF_OPEN:
+                if self._trial_running:
+                    self._stats['rejections'] += 1
+                    raise CircuitOpenError("Circuit is half-open, trial call in progress")
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._stats['successes'] += 1
+            self._failures = 0
+            self._trial_running = False
+            if self.state != self.CLOSED:
+                logger.info("Circuit breaker closed")
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self._stats['opens'] += 1
+                    logger.warning("Circuit breaker opened after %d failures", self._failures)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that neither succeeded nor counted as an upstream failure"""
+        with self._lock:
+            self._trial_running = False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['state'] = self.state
+        return stats
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+
+from services.cache import TTLCache
+
+
+class MemoryStateStore:
+    """
+    Per-process conversation state, bounded in size and expiring after `ttl`.
+
+    Only suitable for a single gunicorn worker; use DatabaseStateStore when
+    running more than one.
+    """
+
+    def __init__(self, max_size=10000, ttl=1800):
+        self._states = TTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, phone_number):
+        state = self._states.get(phone_number, None)
+        return dict(state) if state is not None else None
+
+    def start(self, phone_number, state):
+        with self._lock:
+            current = self._states.get(phone_number, None)
+            version = current['_version'] + 1 if current else 1
+            self._states.set(phone_number, dict(state, _version=version))
+
+    def transition(self, phone_number, state):
+        """Save `state` only if nobody changed it since it was read. Returns False on conflict."""
+        with self._lock:
+            current = self._states.get(phone_number, None)
+            if current is None or current['_version'] != state['_version']:
+                return False
+            self._states.set(phone_number, dict(state, _version=state['_version'] + 1))
+            return True
+
+    def delete(self, phone_number):
+        self._states.delete(phone_number)
+
+
+class DatabaseStateStore:
+    """
+    Conversation state kept in the conversation_state table, so any worker
+    can continue a conversation another worker started.
+
+    Each row carries a version number; transition() is a compare-and-set on
+    it, which makes step changes atomic across workers.
+    """
+
+    def __init__(self, db, ttl=1800):
+        self.db = db
+        self.ttl = ttl
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, phone_number):
+        row = self.db.fetchone("""
+            SELECT state, version FROM conversation_state
+            WHERE phone_number = ? AND expires_at > ?
+        """, (phone_number, time.time()))
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        state['_version'] = row[1]
+        return state
+
+    def start(self, phone_number, state):
+        self._write("""
+            INSERT INTO conversation_state (phone_number, state, version, expires_at)
+            VALUES (?, ?, 1, ?)
+            ON CONFLICT (phone_number) DO UPDATE SET
+                state = excluded.state,
+                version = conversation_state.version + 1,
+                expires_at = excluded.expires_at
+        """, (phone_number, self._dump(state), time.time() + self.ttl))
+
+    def transition(self, phone_number, state):
+        """Save `state` only if nobody changed it since it was read. Returns False on conflict."""
+        updated = self._write("""
+            UPDATE conversation_state
+            SET state = ?, version = version + 1, expires_at = ?
+            WHERE phone_number = ? AND version = ?
+        """, (self._dump(state), time.time() + self.ttl, phone_number, state['_version']))
+        return updated == 1
+
+    def delete(self, phone_number):
+        self._write("DELETE FROM conversation_state WHERE phone_number = ?", (phone_number,))
+
+    def _write(self, query, params):
+        with self.db.transaction() as session:
+            rowcount = session.execute(query, params)
+
+            # Abandoned conversations are swept up every so often
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % 100 == 0
+            if prune:
+                session.execute("DELETE FROM conversation_state WHERE expires_at <= ?", (time.time(),))
+            return rowcount
+
+    @staticmethod
+    def _dump(state):
+        return json.dumps({k: v for k, v in state.items() if k != '_version'})
+
+
+def create_state_store(db):
+    """
+    Build the conversation state store selected by CONVERSATION_STATE_BACKEND.
+
+    'database' (default) shares state between workers; 'memory' keeps it in
+    this process.
+    """
+    ttl = float(os.environ.get('CONVERSATION_STATE_TTL', 1800))
+    if os.environ.get('CONVERSATION_STATE_BACKEND', 'database').lower() == 'memory':
+        return MemoryStateStore(max_size=int(os.environ.get('CONVERSATION_STATE_MAX_SIZE', 10000)), ttl=ttl)
+    return DatabaseStateStore(db, ttl=ttl)
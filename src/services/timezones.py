@@ -0,0 +1,168 @@
+import logging
+import os
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+from services.cache import MISSING, create_cache
+
+logger = logging.getLogger(__name__)
+
+# Zone for numbers whose country code isn't listed below
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE', 'Asia/Jerusalem')
+
+# Dialing code -> time zone. Countries spanning several zones map to their
+# most populous one; users elsewhere can set their zone explicitly.
+COUNTRY_TIMEZONES = {
+    '1': 'America/New_York',
+    '7': 'Europe/Moscow',
+    '20': 'Africa/Cairo',
+    '27': 'Africa/Johannesburg',
+    '30': 'Europe/Athens',
+    '31': 'Europe/Amsterdam',
+    '32': 'Europe/Brussels',
+    '33': 'Europe/Paris',
+    '34': 'Europe/Madrid',
+    '36': 'Europe/Budapest',
+    '39': 'Europe/Rome',
+    '40': 'Europe/Bucharest',
+    '41': 'Europe/Zurich',
+    '43': 'Europe/Vienna',
+    '44': 'Europe/London',
+    '45': 'Europe/Copenhagen',
+    '46': 'Europe/Stockholm',
+    '47': 'Europe/Oslo',
+    '48': 'Europe/Warsaw',
+    '49': 'Europe/Berlin',
+    '51': 'America/Lima',
+    '52': 'America/Mexico_City',
+    '54': 'America/Argentina/Buenos_Aires',
+    '55': 'America/Sao_Paulo',
+    '56': 'America/Santiago',
+    '57': 'America/Bogota',
+    '60': 'Asia/Kuala_Lumpur',
+    '61': 'Australia/Sydney',
+    '62': 'Asia/Jakarta',
+    '63': 'Asia/Manila',
+    '64': 'Pacific/Auckland',
+    '65': 'Asia/Singapore',
+    '66': 'Asia/Bangkok',
+    '81': 'Asia/Tokyo',
+    '82': 'Asia/Seoul',
+    '84': 'Asia/Ho_Chi_Minh',
+    '86': 'Asia/Shanghai',
+    '90': 'Europe/Istanbul',
+    '91': 'Asia/Kolkata',
+    '92': 'Asia/Karachi',
+    '212': 'Africa/Casablanca',
+    '234': 'Africa/Lagos',
+    '254': 'Africa/Nairobi',
+    '351': 'Europe/Lisbon',
+    '353': 'Europe/Dublin',
+    '358': 'Europe/Helsinki',
+    '359': 'Europe/Sofia',
+    '380': 'Europe/Kyiv',
+    '420': 'Europe/Prague',
+    '852': 'Asia/Hong_Kong',
+    '886': 'Asia/Taipei',
+    '962': 'Asia/Amman',
+    '966': 'Asia/Riyadh',
+    '970': 'Asia/Hebron',
+    '971': 'Asia/Dubai',
+    '972': 'Asia/Jerusalem',
+}
+
+_zone_names = None
+
+
+def timezone_for_phone(phone_number):
+    """Time zone name for a phone number, from its country dialing code"""
+    digits = (phone_number or '').replace('whatsapp:', '').lstrip('+')
+    # Dialing codes are prefix-free, so the first match is the only one
+    for length in (1, 2, 3):
+        zone = COUNTRY_TIMEZONES.get(digits[:length])
+        if zone:
+            return zone
+    return DEFAULT_TIMEZONE
+
+
+def find_timezone(name):
+    """Canonical IANA name for `name` (case-insensitive), or None if unknown"""
+    global _zone_names
+    if _zone_names is None:
+        _zone_names = {zone.lower(): zone for zone in available_timezones()}
+    return _zone_names.get((name or '').strip().replace(' ', '_').lower())
+
+
+class UserTimezones:
+    """
+    Per-user time zones for deciding which day a meal belongs to.
+
+    A zone set in authorized_users.timezone wins; otherwise it comes from
+    the phone's country code. Resolved names are cached per user, and
+    ZoneInfo keeps one instance (with its precomputed UTC transitions) per
+    zone, so finding a user's local day costs no database round trip.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.cache = create_cache(
+            'timezones',
+            max_size=int(os.environ.get('TIMEZONE_CACHE_SIZE', 10000)),
+            ttl=float(os.environ.get('TIMEZONE_CACHE_TTL', 86400)),
+            shared=True  # set() must reach every worker, not just the one handling the command
+        )
+
+    def get(self, phone_number):
+        """The user's ZoneInfo"""
+        name = self.cache.get(phone_number)
+        if name is MISSING:
+            # A set() between the read and the store must win over the old zone
+            generation = self.cache.generation(phone_number)
+            name = self._load(phone_number)
+            self.cache.set(phone_number, name, generation=generation)
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning("Unknown time zone %r for %s, using %s", name, phone_number, DEFAULT_TIMEZONE)
+            return ZoneInfo(DEFAULT_TIMEZONE)
+
+    def _load(self, phone_number):
+        try:
+            row = self.db.fetchone("SELECT timezone FROM authorized_users WHERE phone_number = ?", (phone_number,))
+        except Exception as e:
+            logger.exception("Database error loading time zone: %s", e)
+            row = None
+        if row and row[0]:
+            return row[0]
+        return timezone_for_phone(phone_number)
+
+    def set(self, phone_number, name):
+        """Store an explicit zone for the user; returns the canonical name, or None if unknown"""
+        zone = find_timezone(name)
+        if zone is None:
+            return None
+
+        try:
+            updated = self.db.execute(
+                "UPDATE authorized_users SET timezone = ? WHERE phone_number = ?", (zone, phone_number)
+            )
+        except Exception as e:
+            logger.exception("Database error in set timezone: %s", e)
+            return None
+        if not updated:
+            return None
+
+        self.cache.delete(phone_number)
+        logger.info("Time zone for %s set to %s", phone_number, zone)
+        return zone
+
+    def now(self, phone_number):
+        """Current wall-clock time for the user, as a naive datetime"""
+        return datetime.now(self.get(phone_number)).replace(tzinfo=None)
+
+    def today(self, phone_number):
+        """The user's current calendar day"""
+        return datetime.now(self.get(phone_number)).date()
+
+    def stats(self):
+        return self.cache.stats()
@@ -1,160 +1,106 @@
+import logging
 import os
-import psycopg2
-import sqlite3
+from services.cache import MISSING, TTLCache, create_cache
+from services.db import get_database
+from services.metrics import timed
 
+logger = logging.getLogger(__name__)
 
-class UserService:
-    def __init__(self):
-        self.db_url = os.environ.get('DATABASE_URL')
-        self.use_sqlite = not self.db_url
-        if self.use_sqlite:
-            self.db_path = 'nutrition.db'
-            print(f"UserService initialized with SQLite: {self.db_path}")
-        else:
-            print(f"UserService initialized with PostgreSQL: {self.db_url}")
-
-    def _get_connection(self):
-        """Get database connection based on environment"""
-        if self.use_sqlite:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            # Enable foreign keys
-            conn.execute('PRAGMA foreign_keys = ON')
-            return conn
-        else:
-            return psycopg2.connect(self.db_url)
 
+class UserService:
+    def __init__(self, db=None):
+        self.db = db or get_database()
+        self.pool = self.db.pool
+        self.use_sqlite = self.db.use_sqlite
+        logger.info("UserService initialized with %s", self.db.description)
+
+        # Phone numbers already present in authorized_users
+        self.known_users = TTLCache(
+            max_size=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+            ttl=float(os.environ.get('USER_CACHE_TTL', 3600))
+        )
+        # Goals only change through set_user_goals, which invalidates them here;
+        # the cache is shared between workers so the invalidation reaches all
+        self.goals_cache = create_cache(
+            'goals',
+            max_size=int(os.environ.get('GOALS_CACHE_SIZE', 10000)),
+            ttl=float(os.environ.get('GOALS_CACHE_TTL', 86400)),
+            shared=True
+        )
+
+    @timed('register_user')
     def register_user(self, phone_number):
-        conn = None
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            # Check if user already exists
-            if self.use_sqlite:
-                cursor.execute("SELECT 1 FROM authorized_users WHERE phone_number = ?", (phone_number,))
-            else:
-                cursor.execute("SELECT 1 FROM authorized_users WHERE phone_number = %s", (phone_number,))
+        # Known senders are served from memory with no database round trip
+        if self.known_users.get(phone_number, False):
+            return True
 
-            if cursor.fetchone() is None:
-                # User doesn't exist, insert new user
-                if self.use_sqlite:
-                    cursor.execute("INSERT INTO authorized_users (phone_number) VALUES (?)", (phone_number,))
-                else:
-                    cursor.execute("INSERT INTO authorized_users (phone_number) VALUES (%s)", (phone_number,))
-                conn.commit()
-                print(f"New user registered: {phone_number}")
-            else:
-                print(f"User already registered: {phone_number}")
+        try:
+            # Single round trip whether or not the user already exists
+            inserted = self.db.upsert('authorized_users', {'phone_number': phone_number}, conflict=('phone_number',))
+            if inserted:
+                logger.info("New user registered: %s", phone_number)
 
+            self.known_users.set(phone_number, True)
             return True
         except Exception as e:
-            print(f"Database error: {e}")
-            if conn:
-                conn.rollback()
+            logger.exception("Database error in register_user: %s", e)
             return False
-        finally:
-            if conn:
-                conn.close()
 
+    def registration_cache_stats(self):
+        """Hit/miss counters for the known-users cache, for monitoring"""
+        return self.known_users.stats()
+
+    @timed('set_user_goals')
     def set_user_goals(self, phone_number, calories, protein, carbs, fat):
-        conn = None
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
             # Insert or update user goals
-            if self.use_sqlite:
-                # Check if goals exist for this user
-                cursor.execute(
-                    "SELECT 1 FROM user_goals WHERE phone_number = ?",
-                    (phone_number,)
-                )
-
-                if cursor.fetchone():
-                    # Update existing goals
-                    cursor.execute("""
-                        UPDATE user_goals 
-                        SET calories = ?, protein = ?, carbs = ?, fat = ?
-                        WHERE phone_number = ?
-                    """, (calories, protein, carbs, fat, phone_number))
-                else:
-                    # Insert new goals
-                    cursor.execute("""
-                        INSERT INTO user_goals (phone_number, calories, protein, carbs, fat)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (phone_number, calories, protein, carbs, fat))
-            else:
-                # PostgreSQL version with ON CONFLICT
-                cursor.execute("""
-                    INSERT INTO user_goals (phone_number, calories, protein, carbs, fat)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (phone_number)
-                    DO UPDATE SET
-                        calories = EXCLUDED.calories,
-                        protein = EXCLUDED.protein,
-                        carbs = EXCLUDED.carbs,
-                        fat = EXCLUDED.fat
-                """, (phone_number, calories, protein, carbs, fat))
-
-            conn.commit()
-            print(
-                f"Goals updated for user: {phone_number} - Calories: {calories}, Protein: {protein}, Carbs: {carbs}, Fat: {fat}")
+            self.db.upsert(
+                'user_goals',
+                {'phone_number': phone_number, 'calories': calories, 'protein': protein, 'carbs': carbs, 'fat': fat},
+                conflict=('phone_number',),
+                update=('calories', 'protein', 'carbs', 'fat')
+            )
+            # Invalidate rather than write through: a reader that loaded the old
+            # goals before this commit then can't store them over the new ones
+            self.goals_cache.delete(phone_number)
+            logger.info("Goals updated for user: %s - Calories: %s, Protein: %s, Carbs: %s, Fat: %s",
+                        phone_number, calories, protein, carbs, fat)
             return True
 
         except Exception as e:
-            print(f"Database error in set_user_goals: {e}")
-            if conn:
-                conn.rollback()
+            logger.exception("Database error in set_user_goals: %s", e)
             return False
 
-        finally:
-            if conn:
-                conn.close()
-
+    @timed('get_user_goals')
     def get_user_goals(self, phone_number):
-        conn = None
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-
-            if self.use_sqlite:
-                cursor.execute("""
-                    SELECT calories, protein, carbs, fat
-                    FROM user_goals
-                    WHERE phone_number = ?
-                """, (phone_number,))
-            else:
-                cursor.execute("""
-                    SELECT calories, protein, carbs, fat
-                    FROM user_goals
-                    WHERE phone_number = %s
-                """, (phone_number,))
+        cached = self.goals_cache.get(phone_number)
+        if cached is not MISSING:
+            return cached
 
-            result = cursor.fetchone()
-
-            if result:
-                if self.use_sqlite:
-                    # Convert to dict if using SQLite with row_factory
-                    return {
-                        "calories": result['calories'],
-                        "protein": result['protein'],
-                        "carbs": result['carbs'],
-                        "fat": result['fat']
-                    }
-                else:
-                    # For PostgreSQL
-                    return {
-                        "calories": result[0],
-                        "protein": result[1],
-                        "carbs": result[2],
-                        "fat": result[3]
-                    }
-            else:
+        generation = self.goals_cache.generation(phone_number)
+        try:
+            result = self.db.fetchone("""
+                SELECT calories, protein, carbs, fat
+                FROM user_goals
+                WHERE phone_number = ?
+            """, (phone_number,))
+
+            if not result:
+                # Not cached: the user may be finishing the goal wizard on another worker
                 return None
+
+            goals = {
+                "calories": result[0],
+                "protein": result[1],
+                "carbs": result[2],
+                "fat": result[3]
+            }
+            self.goals_cache.set(phone_number, goals, generation=generation)
+            return goals
         except Exception as e:
-            print(f"Database error in get_user_goals: {e}")
+            logger.exception("Database error in get_user_goals: %s", e)
             return None
-        finally:
-            if conn:
-                conn.close()
\ No newline at end of file
+
+    def goals_cache_stats(self):
+        """Hit/miss counters for the goals cache, for monitoring"""
+        return self.goals_cache.stats()
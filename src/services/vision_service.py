@@ -1,17 +1,82 @@
 # vision_service.py
+import logging
 import os
-import requests
-import base64
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIConnectionError, APITimeoutError, InternalServerError, OpenAI, RateLimitError
+from services.http_client import MediaDownloadError, create_media_downloader
+from services.image_cache import create_image_cache
+from services.image_preprocessing import prepare_image
+from services.meal_analysis import MEAL_ANALYSIS_SCHEMA, MealAnalysis
+from services.metrics import timed
+from services.nutrition_parser import parse_nutrition
+from services.resilience import CircuitBreaker, TokenBucket, UpstreamUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# OpenAI errors that mean the API itself is degraded, as opposed to a bad request
+UPSTREAM_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+# Failures a later attempt may not hit again. Rate limits (which include an
+# exhausted quota) and our own circuit breaker and limiter are left out, as
+# retrying those only piles more calls onto an API that is refusing them.
+TRANSIENT_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError)
+
+
+class TruncatedAnalysisError(ValueError):
+    """The model hit max_tokens before finishing its structured (JSON) answer"""
+
+
+def is_transient(error):
+    """Whether an analysis failure is worth retrying"""
+    if isinstance(error, MediaDownloadError):
+        return error.transient
+    return isinstance(error, TRANSIENT_ERRORS)
 
 
 class VisionService:
     def __init__(self):
         load_dotenv()
         self.openai_api_key = os.getenv('OPENAI_API_KEY')
-        self.client = OpenAI(api_key=self.openai_api_key)
+        # Every model call has a deadline; retries are left to the job queue
+        self.client = OpenAI(
+            api_key=self.openai_api_key,
+            timeout=float(os.getenv('VISION_TIMEOUT', 45)),
+            max_retries=int(os.getenv('VISION_CLIENT_RETRIES', 0))
+        )
+        # Protect the workers from a slow or failing API: cap concurrent calls
+        # and fail fast while the circuit is open
+        self.max_concurrency = int(os.getenv('VISION_MAX_CONCURRENCY', 4))
+        self.slot_timeout = float(os.getenv('VISION_SLOT_TIMEOUT', 5))
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        # Optional cap on model calls per second, to stay under the account's
+        # OpenAI rate limit; off unless VISION_RATE_PER_SECOND is set
+        rate = float(os.getenv('VISION_RATE_PER_SECOND', 0))
+        self.rate_limiter = TokenBucket(
+            rate=rate,
+            capacity=float(os.getenv('VISION_RATE_BURST', max(1.0, rate)))
+        ) if rate > 0 else None
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv('VISION_BREAKER_FAILURES', 5)),
+            reset_timeout=float(os.getenv('VISION_BREAKER_RESET', 30))
+        )
+        self._slot_rejections = 0
+        # Shared keep-alive session for Twilio media downloads
+        self.downloader = create_media_downloader()
+        # Parsed results for images we've already analyzed (None when disabled)
+        self.image_cache = create_image_cache()
+        # Uploads are downscaled to this longest edge and JPEG quality
+        self.image_max_edge = int(os.getenv('IMAGE_MAX_EDGE', 1024))
+        self.image_quality = int(os.getenv('IMAGE_JPEG_QUALITY', 80))
+        # All photos attached to one message are analyzed together in one request
+        self.max_images = int(os.getenv('MEDIA_MAX_IMAGES', 5))
+        self.max_total_image_bytes = int(os.getenv('MEDIA_MAX_TOTAL_BYTES', 40 * 1024 * 1024))
+        self._download_pool = ThreadPoolExecutor(max_workers=self.max_images, thread_name_prefix='media-download')
+        # Structured mode asks for schema-validated JSON instead of free-form text.
+        # Its cap leaves room for a many-item meal with Hebrew names and
+        # quantities, since JSON cut off mid-way can't be parsed at all.
+        self.structured_output = os.getenv('VISION_STRUCTURED_OUTPUT', '').lower() in ('1', 'true', 'yes')
+        self.max_tokens = int(os.getenv('VISION_MAX_TOKENS', 800 if self.structured_output else 500))
 
         self.SYSTEM_PROMPT = """You are a nutrition expert analyzing food images. For each image:
                 1. List all visible food items with quantities in a clear format starting with "מנות:"
@@ -27,81 +92,25 @@ class VisionService:
                 - **פחמימה**: X גרם
                 - **שומן**: X גרם"""
 
+        self.STRUCTURED_SYSTEM_PROMPT = """You are a nutrition expert analyzing food images.
+                List every visible food item with its estimated quantity and its own calories,
+                protein, carbs and fat (grams). Write names and quantities in Hebrew."""
+
+        self.MULTI_IMAGE_PROMPT = ("These photos all show the same meal. Analyze them together as one meal "
+                                   "and count each food item only once, even if it appears in several photos.")
+
+    @timed('nutrition_parse')
     def extract_nutrition_from_text(self, analysis_text: str) -> dict:
         """
         Extract nutrition values and food items from the Hebrew analysis text.
         """
         try:
-            # Initialize default values
-            nutrition = {
-                'calories': 0,
-                'protein': 0,
-                'carbs': 0,
-                'fat': 0,
-                'food_items': []
-            }
-
-            # Extract food items
-            food_items = []
-            capture_foods = False
-            for line in analysis_text.split('\n'):
-                line = line.strip()
-                if 'מנות:' in line:
-                    capture_foods = True
-                    continue
-                elif '### ערכים תזונתיים:' in line:
-                    capture_foods = False
-                elif capture_foods and line.startswith('-'):
-                    food_item = line.strip('- ').strip()
-                    if food_item:
-                        food_items.append(food_item)
-
-            nutrition['food_items'] = food_items
-
-            # Hebrew regex patterns
-            calories_match = re.search(r'\*\*קלוריות\*\*:?\s*(?:כ-)?(\d+)', analysis_text)
-            if not calories_match:
-                calories_match = re.search(r'קלוריות:?\s*(?:כ-)?(\d+)', analysis_text)
-            if calories_match:
-                nutrition['calories'] = int(calories_match.group(1))
-
-            protein_match = re.search(r'\*\*חלבון\*\*:?\s*(?:כ-)?(\d+)', analysis_text)
-            if not protein_match:
-                protein_match = re.search(r'חלבון:?\s*(?:כ-)?(\d+)', analysis_text)
-            if protein_match:
-                nutrition['protein'] = int(protein_match.group(1))
-
-            carbs_match = re.search(r'\*\*פחמימה\*\*:?\s*(?:כ-)?(\d+)', analysis_text)
-            if not carbs_match:
-                carbs_match = re.search(r'פחמימה:?\s*(?:כ-)?(\d+)', analysis_text)
-            if carbs_match:
-                nutrition['carbs'] = int(carbs_match.group(1))
-
-            fat_match = re.search(r'\*\*שומן\*\*:?\s*(?:כ-)?(\d+)', analysis_text)
-            if not fat_match:
-                fat_match = re.search(r'שומן:?\s*(?:כ-)?(\d+)', analysis_text)
-            if fat_match:
-                nutrition['fat'] = int(fat_match.group(1))
-
-            # Extract food items (lines starting with dash that don't contain nutrition info)
-            food_list = []
-            lines = analysis_text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.startswith('-'):
-                    # Skip lines containing nutrition information in Hebrew
-                    if not any(word in line for word in ['קלוריות', 'חלבון', 'פחמימה', 'שומן']):
-                        food = line.strip('- ').strip()
-                        if food:
-                            food_list.append(food)
-
-            nutrition['food_items'] = food_list
-
-            print(f"Extracted nutrition values: {nutrition}")  # Debugging
+            nutrition = parse_nutrition(analysis_text)
+            logger.debug("Extracted nutrition values: %s", nutrition)
             return nutrition
 
         except Exception as e:
-            print(f"Error extracting nutrition values: {str(e)}")
+            logger.exception("Error extracting nutrition values: %s", e)
             return {
                 'calories': 0,
                 'protein': 0,
@@ -110,49 +119,195 @@ class VisionService:
                 'food_items': []
             }
 
-    def analyze_food_image(self, image_url: str, twilio_auth: tuple) -> dict:
+    def _image_message(self, text, images):
+        """User message with the prompt followed by each (mime_type, base64) image"""
+        content = [
+            {
+                "type": "text",
+                "text": text
+            }
+        ]
+        for mime_type, base64_image in images:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{mime_type};base64,{base64_image}"
+                }
+            })
+        return {
+            "role": "user",
+            "content": content
+        }
+
+    def _create_completion(self, **kwargs):
+        """chat.completions.create behind the circuit breaker, rate limiter and concurrency cap"""
+        self.circuit_breaker.before_call()
+        if not self._slots.acquire(timeout=self.slot_timeout):
+            self._slot_rejections += 1
+            self.circuit_breaker.release()
+            raise UpstreamUnavailableError("Too many model calls in progress")
+        # Only a call that holds a slot spends a rate token
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(timeout=self.slot_timeout):
+            self._slots.release()
+            self.circuit_breaker.release()
+            raise UpstreamUnavailableError("Rate limit reached for model calls")
+
         try:
-            # First, download the image from Twilio
-            print(f"Fetching image from Twilio URL: {image_url}")
-            response = requests.get(image_url, auth=twilio_auth)
-            if response.status_code != 200:
-                raise Exception(f"Failed to fetch image: {response.status_code}")
-
-            # Convert to base64
-            base64_image = base64.b64encode(response.content).decode('utf-8')
-
-            print("Sending to GPT-4o...")
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
+            with timed('model_call'):
+                response = self.client.chat.completions.create(**kwargs)
+        except UPSTREAM_ERRORS:
+            self.circuit_breaker.record_failure()
+            raise
+        except Exception:
+            self.circuit_breaker.release()
+            raise
+        else:
+            self.circuit_breaker.record_success()
+            return response
+        finally:
+            self._slots.release()
+
+    def resilience_stats(self):
+        stats = {'circuit_' + key: value for key, value in self.circuit_breaker.stats().items()}
+        stats['rate_limit_rejections'] = self.rate_limiter.stats()['rejections'] if self.rate_limiter else 0
+        stats['concurrency_rejections'] = self._slot_rejections
+        return stats
+
+    def build_completion_request(self, images):
+        """chat.completions.create arguments for the prepared (mime_type, base64) images"""
+        if self.structured_output:
+            # JSON analysis validated against MEAL_ANALYSIS_SCHEMA; no text parsing needed
+            return {
+                "model": "gpt-4o",
+                "messages": [
                     {
                         "role": "system",
-                        "content": self.SYSTEM_PROMPT
+                        "content": self.STRUCTURED_SYSTEM_PROMPT
                     },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Please analyze this food image and tell me if I'm hitting my goals"
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
+                    self._image_message(
+                        "Analyze this food image." if len(images) == 1 else self.MULTI_IMAGE_PROMPT,
+                        images
+                    )
                 ],
-                max_tokens=500
-            )
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": "meal_analysis",
+                        "strict": True,
+                        "schema": MEAL_ANALYSIS_SCHEMA
+                    }
+                },
+                "max_tokens": self.max_tokens
+            }
+
+        # Free-form Hebrew analysis, parsed with the regex parser
+        return {
+            "model": "gpt-4o",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": self.SYSTEM_PROMPT
+                },
+                self._image_message(
+                    "Please analyze this food image and tell me if I'm hitting my goals"
+                    if len(images) == 1 else self.MULTI_IMAGE_PROMPT,
+                    images
+                )
+            ],
+            "max_tokens": self.max_tokens
+        }
 
-            analysis = response.choices[0].message.content
-            print(f"Analysis received: {analysis}")
+    def is_truncated(self, response):
+        """Whether a structured answer was cut off by max_tokens (free text is still usable)"""
+        return self.structured_output and getattr(response.choices[0], 'finish_reason', None) == 'length'
+
+    def parse_completion(self, response):
+        """(analysis text, nutrition dict) from a completion made by build_completion_request"""
+        if self.is_truncated(response):
+            raise TruncatedAnalysisError("The analysis was too long and got cut off")
+        message = response.choices[0].message
+        if not self.structured_output:
+            analysis = message.content
+            logger.debug("Analysis received: %s", analysis)
 
             # Extract nutrition values from the analysis
-            nutrition_data = self.extract_nutrition_from_text(analysis)
+            return analysis, self.extract_nutrition_from_text(analysis)
+
+        if getattr(message, 'refusal', None):
+            raise ValueError(message.refusal)
+
+        meal = MealAnalysis.from_json(message.content)
+        logger.debug("Structured analysis received: %d items", len(meal.items))
+        return meal.to_analysis_text(), meal.to_nutrition()
+
+    def check_total_size(self, images):
+        total = sum(len(image) for image in images)
+        if total > self.max_total_image_bytes:
+            raise MediaDownloadError(f"Images are too large together ({total // 1024} KB)")
+
+    @timed('image_preprocess')
+    def prepare_images(self, images):
+        """Downscale, re-encode and base64 each image; returns [(mime_type, base64)]"""
+        return [
+            prepare_image(image_bytes, max_edge=self.image_max_edge, quality=self.image_quality)
+            for image_bytes in images
+        ]
+
+    def download_images(self, image_urls, twilio_auth):
+        """Download all images concurrently, enforcing the combined size limit"""
+        with timed('media_download'):
+            futures = [
+                self._download_pool.submit(self.downloader.download, url, auth=twilio_auth)
+                for url in image_urls
+            ]
+            images = [future.result() for future in futures]
+
+        self.check_total_size(images)
+        return images
+
+    def analyze_food_image(self, image_url: str, twilio_auth: tuple) -> dict:
+        return self.analyze_food_images([image_url], twilio_auth)
+
+    @timed('analyze_food_image')
+    def analyze_food_images(self, image_urls: list, twilio_auth: tuple) -> dict:
+        """Analyze one or more photos of the same meal in a single model request"""
+        try:
+            image_urls = image_urls[:self.max_images]
+            # First, download the images from Twilio
+            logger.debug("Fetching %d image(s) from Twilio", len(image_urls))
+            images = self.download_images(image_urls, twilio_auth)
+
+            # Resent or near-identical photos reuse the earlier analysis
+            cache_key = None
+            if self.image_cache is not None:
+                cache_key, cached = self.image_cache.lookup(images)
+                if cached is not None:
+                    logger.info("Using cached analysis for previously seen image")
+                    return {
+                        'success': True,
+                        'analysis': cached['analysis'],
+                        'nutrition': cached['nutrition'],
+                        'cached': True
+                    }
+
+            # Downscale, re-encode and convert to base64
+            prepared = self.prepare_images(images)
+            del images
+
+            logger.debug("Sending %d image(s) to GPT-4o", len(prepared))
+            request = self.build_completion_request(prepared)
+            response = self._create_completion(**request)
+            if self.is_truncated(response):
+                # Once, with twice the room; parse_completion rejects a second cut-off
+                logger.warning("Structured analysis hit max_tokens=%d, retrying with %d",
+                               request['max_tokens'], request['max_tokens'] * 2)
+                request['max_tokens'] *= 2
+                response = self._create_completion(**request)
+            analysis, nutrition_data = self.parse_completion(response)
+
+            # Don't cache responses we couldn't parse, so a resend gets a fresh try
+            if cache_key is not None and nutrition_data.get('calories'):
+                self.image_cache.store(cache_key, {'analysis': analysis, 'nutrition': nutrition_data})
 
             return {
                 'success': True,
@@ -160,9 +315,19 @@ class VisionService:
                 'nutrition': nutrition_data
             }
 
+        except (UpstreamUnavailableError,) + UPSTREAM_ERRORS as e:
+            logger.warning("Model unavailable: %s", e)
+            return {
+                'success': False,
+                'error': str(e),
+                'unavailable': True,
+                'retryable': is_transient(e)
+            }
+
         except Exception as e:
-            print(f"Error in analyze_food_image: {str(e)}")
+            logger.exception("Error in analyze_food_images: %s", e)
             return {
                 'success': False,
-                'error': str(e)
-            }
\ No newline at end of file
+                'error': str(e),
+                'retryable': is_transient(e)
+            }